@@ -99,7 +99,7 @@ def get_hosted_service_items(portal, items=None):
     '''
     hosted_service_items = []
     if items is None:
-        items = portal.search()
+        items = portal.iter_search()
     for item in items:
         if 'Hosted Service' in item['typeKeywords']:
             hosted_service_items.append(item)
@@ -108,7 +108,7 @@ def get_hosted_service_items(portal, items=None):
 def get_orphaned_hosted_service_items(portal):
     
     p_hosted_service_items = []
-    items = portal.search()
+    items = portal.iter_search()
     for item in items:
         url = item.get('url')
         if url:
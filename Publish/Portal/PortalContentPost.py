@@ -312,7 +312,7 @@ def publish_portal(portaladdress,contentpath,adminuser,adminpassword, users, hos
 
     # Create list of items to update
     # (exclude any items owned by esri_ accounts)
-    items_all = portaladmin.search()
+    items_all = portaladmin.iter_search()
     items_to_update = []
     for item in items_all:
         if not item["owner"].startswith("esri_"):
@@ -544,7 +544,7 @@ def publish_user_items(portal, username, usercontentpath, old_hostname, new_host
         id_mapping = json.load(open(filename))
         
         # Create list of existing portal items
-        existing_portal_items = portal.search()
+        existing_portal_items = portal.iter_search()
         for existing_portal_item in existing_portal_items:
             existing_portal_ids.append(existing_portal_item['id'])
         
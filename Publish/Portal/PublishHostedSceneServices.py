@@ -187,6 +187,7 @@ def main():
         
         # Create portal connection
         portal = Portal(portal_address, adminuser, password)
+        portal.enable_item_cache()
         
         # Get ids of the source items to publish
         valid_items = True
@@ -26,6 +26,14 @@ from datetime import datetime
 from portalpy import Portal
 from portalpy import TEXT_BASED_ITEM_TYPES
 
+# Add "Root folder"\SupportFiles to sys path inorder to import
+#   modules in subfolder
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.dirname(os.path.dirname(sys.argv[0]))), "SupportFiles"))
+
+from JobRunner import poll_jobs
+from JobRunner import is_portal_job_finished
+
 import logging
 logging.basicConfig()
 
@@ -65,7 +73,8 @@ def check_publishing_status(portal, item_id, services_pub_info):
     and jobMessage key/value pairs with job status information.
     """
     if services_pub_info:
-        for service_pub_info in services_pub_info:
+        jobs = {}
+        for i, service_pub_info in enumerate(services_pub_info):
 
             service_pub_info['jobStatus'] = None
             service_pub_info['jobMessage'] = None
@@ -73,12 +82,8 @@ def check_publishing_status(portal, item_id, services_pub_info):
             success = service_pub_info.get('success')
             if success is None:
                 # Publishing didn't immedidately fail therefore a job was
-                # created and started. Check publishing job status.
-                status_resp = check_job_status(portal, item_id,
-                                    service_pub_info.get('jobId'), 'publish')
-                status = status_resp['status']
-                service_pub_info['jobStatus'] = status
-                service_pub_info['jobMessage'] = status_resp['statusMessage']
+                # created and started. Check publishing job status below.
+                jobs[i] = {}
     
             else:
                 # Publishing failed immediately because 'success' key
@@ -88,22 +93,19 @@ def check_publishing_status(portal, item_id, services_pub_info):
                     info = service_pub_info.get('error')
                     if info:
                         service_pub_info['jobMessage'] = info.get('message')
+        
+        # Poll the status of all publishing jobs together
+        def check_status(i, status):
+            return portal.job_status(item_id,
+                                     services_pub_info[i].get('jobId'), 'publish')
+        
+        for i, status_resp in poll_jobs(jobs, check_status, is_portal_job_finished,
+                                        initial_interval=2, max_interval=30):
+            services_pub_info[i]['jobStatus'] = status_resp['status']
+            services_pub_info[i]['jobMessage'] = status_resp['statusMessage']
                         
     return services_pub_info
 
-def check_job_status(portal, item_id, job_id, job_type, check_interval=10):
-    """
-    Checks job status.
-    Continues to check status at the specified interval until job
-    reaches 'failed' or 'completed' state.
-    """
-    status = ''
-    while status not in ['failed', 'completed']:
-        resp = portal.job_status(item_id, job_id, job_type)
-        status = resp.get('status')
-        time.sleep(check_interval)
-    return resp
-
 def find_orig_service_item_id(portal, new_service_item_id):
     orig_service_item_id = None
     new_service_item = portal.item(new_service_item_id)
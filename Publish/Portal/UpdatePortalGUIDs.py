@@ -172,7 +172,7 @@ def main():
         
         print '\n{}'.format('-' * section_break_count)
         print '- Searching for portal items...\n'
-        items_temp = portal.search(q=search_query, sort_field='owner')
+        items_temp = portal.iter_search(q=search_query, sort_field='owner')
         
         items = []
         for item in items_temp:
@@ -18,7 +18,6 @@ __version__ = '1.0a8'
 
 import collections
 import copy
-import gzip
 import httplib
 import imghdr
 import json
@@ -27,16 +26,21 @@ import mimetools
 import mimetypes
 import os
 import re
+import socket
 import tempfile
+import threading
+import time
 import unicodedata
 import urllib
 import urllib2
 import urlparse
 import UserDict
+import zlib
 
 from calendar import timegm
 from cStringIO import StringIO
 from itertools import groupby
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
 
 URL_BASED_ITEM_TYPES = frozenset(['Feature Service', 'Map Service',
@@ -97,6 +101,43 @@ EXCLUDE_BASEMAP_FILTER = ' -tags:basemap'
 
 OPVIEW_ITEM_FILTER = 'type:"Operation View"' #EL, added 6/10/2013
 
+# Maximum number of results the portal returns for a single search query
+# (the start parameter can't page past it)
+SEARCH_WINDOW = 10000
+
+# Item data files larger than MULTIPART_UPLOAD_THRESHOLD bytes are uploaded in
+# parts of MULTIPART_PART_SIZE bytes (add item multipart), concurrently; each
+# part is retried up to MULTIPART_PART_RETRIES times. The portal is given
+# MULTIPART_COMMIT_TIMEOUT seconds to assemble the parts once they're committed
+MULTIPART_UPLOAD_THRESHOLD = 100 * 1024 * 1024
+MULTIPART_PART_SIZE = 20 * 1024 * 1024
+MULTIPART_PART_RETRIES = 3
+MULTIPART_COMMIT_TIMEOUT = 3600
+
+# Item data files larger than DOWNLOAD_SEGMENT_THRESHOLD bytes are downloaded
+# in segments of DOWNLOAD_SEGMENT_SIZE bytes (HTTP range requests),
+# concurrently; each segment is retried up to DOWNLOAD_SEGMENT_RETRIES times,
+# from where it stopped, and is read in blocks of DOWNLOAD_BLOCK_SIZE bytes
+DOWNLOAD_SEGMENT_THRESHOLD = 64 * 1024 * 1024
+DOWNLOAD_SEGMENT_SIZE = 16 * 1024 * 1024
+DOWNLOAD_SEGMENT_RETRIES = 3
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+# The version, properties and logged in user of a portal are cached (keyed by
+# portal url and username) for PORTAL_INFO_CACHE_TTL seconds, so constructing
+# another Portal for the same url and user doesn't request them again. The
+# cache is also kept in PORTAL_INFO_CACHE_FILE (if set), so it is shared by
+# scripts run one after the other. Tokens are never cached.
+PORTAL_INFO_CACHE_TTL = 600
+PORTAL_INFO_CACHE_FILE = os.path.join(tempfile.gettempdir(),
+                                      'portalpy_info_cache.json')
+_portal_info_cache = {}
+_portal_info_lock = threading.Lock()
+
+# Tokens are renewed TOKEN_RENEWAL_MARGIN seconds (or a tenth of their
+# lifetime, if that's shorter) before they expire
+TOKEN_RENEWAL_MARGIN = 120
+
 _log = logging.getLogger(__name__)
 
 # Version of Python installed with 10.4 now validates SSL
@@ -112,6 +153,18 @@ except AttributeError:
 else:
     # Handle target environment that doesn't support HTTPS verification
     ssl._create_default_https_context = _create_unverified_https_context
+
+# Decode responses with simplejson (and its C speedups) when it's installed.
+# With a str, simplejson returns ascii-only strings as str, so responses that
+# have had their non-ascii characters removed need no further conversion
+try:
+    import simplejson as _json
+except ImportError:
+    _json = json
+_json_sample = _json.loads('[{"key": "value"}, "item"]')
+_json_ascii_str = all(isinstance(s, str) for s
+                      in _json_sample[0].items()[0] + (_json_sample[1],))
+del _json_sample
     
 class Portal(object):
     """ An object representing a connection to a single portal (via URL)."""
@@ -128,8 +181,13 @@ class Portal(object):
 
     def __init__(self, url, username=None, password=None, key_file=None,
                  cert_file=None, expiration=160, referer=None, proxy_host=None,
-                 proxy_port=None, connection=None, workdir=tempfile.gettempdir()):
-        """ The Portal constructor. Requires URL and optionally username/password."""
+                 proxy_port=None, connection=None, workdir=tempfile.gettempdir(),
+                 max_workers=8, info_cache_ttl=PORTAL_INFO_CACHE_TTL):
+        """ The Portal constructor. Requires URL and optionally username/password.
+        Result pages of searches are fetched with up to max_workers concurrent
+        requests. The version, properties and logged in user are taken from
+        the portal info cache if they were cached less than info_cache_ttl
+        seconds ago (0 to always request them)."""
         self.url = url
         if url:
             normalized_url = normalize_url(self.url)
@@ -138,6 +196,7 @@ class Portal(object):
             self.resturl = normalized_url + 'sharing/rest/'
             self.hostname = parse_hostname(url)
         self.workdir = workdir
+        self.max_workers = max_workers
 
         # Setup the instance members
         self._basepostdata = { 'f': 'json' }
@@ -150,9 +209,17 @@ class Portal(object):
         self._is_pre_162 = False
         self._is_pre_21 = False
 
-        # Setup a cache for user item links, so we don't need to comb through
-        # folders every time we need it
-        self._user_item_links_cache = LRUCache(num_entries=100)
+        # Setup a cache of the folder of each item of a user (indexed by
+        # owner), so we don't need to comb through folders every time we
+        # need an item link
+        self._user_item_folders_cache = LRUCache(num_entries=100)
+
+        # The item cache is disabled until enable_item_cache is called
+        self._item_cache = None
+        self._item_cache_ttl = None
+        self._item_cache_hits = 0
+        self._item_cache_misses = 0
+        self._item_cache_lock = threading.Lock()
 
         # If a connection was passed in, use it, otherwise setup the
         # connection (use all SSL until portal informs us otherwise)
@@ -166,17 +233,67 @@ class Portal(object):
                                         key_file, cert_file, expiration, True,
                                         referer, proxy_host, proxy_port)
 
-        # Store the logged in user information. It's useful.
+        # Store the logged in user information (it's useful), and cache the
+        # version and properties information, unless they're cached already
+        if not self._load_portal_info(info_cache_ttl):
+            if self.is_logged_in():
+                self._logged_in_user = self.user(username)
+            self.reinitialize()
+
+    def _portal_info_key(self):
+        username = getattr(self.con, '_username', '') if self.is_logged_in() else ''
+        return normalize_url(self.url) + ' ' + username
+
+    def _load_portal_info(self, ttl):
+        """ Sets the version, properties and logged in user from the portal
+        info cache. Returns true if they were cached less than ttl seconds ago. """
+        if not ttl or not self.url:
+            return False
+        key = self._portal_info_key()
+        with _portal_info_lock:
+            info = _portal_info_cache.get(key)
+            if not info and PORTAL_INFO_CACHE_FILE:
+                info = _read_portal_info_file().get(key)
+        if not info or time.time() - info['time'] > ttl:
+            return False
+        if self.is_logged_in() and not info['user']:
+            return False
+        info = unicode_to_ascii(info) if self.con.ensure_ascii \
+               else copy.deepcopy(info)
+        self._version = info['version']
+        self._is_pre_162 = info['is_pre_162']
+        self._is_pre_21 = info['is_pre_21']
+        if info['resturl'] != self.resturl:
+            self.resturl = info['resturl']
+            self.con.baseurl = info['resturl']
+        self._properties = info['properties']
+        self.con.all_ssl = self.is_all_ssl()
         if self.is_logged_in():
-            self._logged_in_user = self.user(username)
+            self._logged_in_user = info['user']
+        return True
 
-        # Cache the version and properties information
-        self.reinitialize()
+    def _save_portal_info(self):
+        """ Saves the version, properties and logged in user in the portal
+        info cache. """
+        if not self.url or not self._version or not self._properties:
+            return
+        info = {'version': self._version, 'is_pre_162': self._is_pre_162,
+                'is_pre_21': self._is_pre_21, 'resturl': self.resturl,
+                'properties': self._properties,
+                'user': self._logged_in_user if self.is_logged_in() else None,
+                'time': time.time()}
+        key = self._portal_info_key()
+        with _portal_info_lock:
+            _portal_info_cache[key] = info
+            if PORTAL_INFO_CACHE_FILE:
+                cache = _read_portal_info_file()
+                cache[key] = info
+                _write_portal_info_file(cache)
 
     def _postdata(self):
         if self._basepostdata:
-            # Return a defensive copy
-            return copy.deepcopy(self._basepostdata)
+            # Return a defensive copy (the base postdata only holds strings)
+            return dict(self._basepostdata)
         return None
 
     def login(self, username, password, expiration=60):
@@ -184,6 +301,7 @@ class Portal(object):
         newtoken = self.con.login(username, password, expiration)
         if newtoken:
             self._logged_in_user = self.user(username)
+            self._save_portal_info()
         return newtoken
 
     def logout(self):
@@ -247,6 +365,7 @@ class Portal(object):
             if resp:
                 self._properties = resp
                 self.con.all_ssl = self.is_all_ssl()
+                self._save_portal_info()
 
         # Return a defensive copy
         return copy.deepcopy(self._properties)
@@ -414,14 +533,8 @@ class Portal(object):
         """ Returns invitations to an online subscription. """
         if properties is None:
             properties = []
-        resp = self._invitations_page(1, 100)
-        results = self._extract(resp['invitations'], properties)
-        nextstart = int(resp['nextStart'])
-        while nextstart > 0:
-            resp = self._invitations_page(nextstart, 100)
-            results.extend(self._extract(resp['invitations'], properties))
-            nextstart = int(resp['nextStart'])
-        return results
+        results = self._page_results(self._invitations_page, 'invitations')
+        return self._extract(results, properties)
 
     def _invitations_page(self, start, num):
         postdata = self._postdata()
@@ -454,23 +567,108 @@ class Portal(object):
 
     def item(self, id):
         """ Returns the item for the specified item id. """
-        return self.con.post('content/items/' + id, self._postdata())
+        if self._item_cache is None:
+            return self.con.post('content/items/' + id, self._postdata())
+
+        with self._item_cache_lock:
+            entry = self._item_cache.get(id)
+            if entry and time.time() - entry[1] < self._item_cache_ttl:
+                self._item_cache_hits += 1
+                return copy.deepcopy(entry[0])
+            self._item_cache_misses += 1
+
+        item = self.con.post('content/items/' + id, self._postdata())
+        if item:
+            with self._item_cache_lock:
+                if self._item_cache is not None:
+                    self._item_cache[id] = (copy.deepcopy(item), time.time())
+        return item
+
+    def enable_item_cache(self, num_entries=1000, ttl=300):
+        """ Caches up to num_entries items returned by item() for ttl seconds.
+        Cached items are invalidated when the portal returns a different
+        modified value for the item (i.e. in search results), and when the
+        item is updated, shared or deleted through this object. """
+        with self._item_cache_lock:
+            self._item_cache = LRUCache(num_entries=num_entries)
+            self._item_cache_ttl = ttl
+            self._item_cache_hits = 0
+            self._item_cache_misses = 0
+
+    def disable_item_cache(self):
+        """ Disables (and clears) the item cache. """
+        with self._item_cache_lock:
+            self._item_cache = None
+
+    def item_cache_stats(self):
+        """ Returns the hits, misses and size of the item cache. """
+        with self._item_cache_lock:
+            size = len(self._item_cache) if self._item_cache is not None else 0
+            return {'hits': self._item_cache_hits,
+                    'misses': self._item_cache_misses,
+                    'size': size}
+
+    def _invalidate_item(self, *ids):
+        if self._item_cache is None:
+            return
+        with self._item_cache_lock:
+            if self._item_cache is not None:
+                for id in ids:
+                    if id in self._item_cache:
+                        del self._item_cache[id]
+
+    def _validate_cached_items(self, items):
+        """ Invalidates cached items with a different modified value than
+        the (search result) items. """
+        if self._item_cache is None:
+            return
+        with self._item_cache_lock:
+            if self._item_cache is None:
+                return
+            for item in items:
+                id = item.get('id')
+                if id in self._item_cache:
+                    cached_item = self._item_cache.peek(id)[0]
+                    if 'modified' in item and \
+                            item['modified'] != cached_item.get('modified'):
+                        del self._item_cache[id]
 
     def item_data(self, id, return_json=False):
         """ Returns the item data for the specified item id. """
         return self.con.get('content/items/' + id + '/data', try_json=return_json)
 
-    def item_datad(self, id, dir=None, filename=None):
-        """ Downloads the item data for the specified item id, returns file path. """
+    def item_data_stream(self, id):
+        """ Returns the item data for the specified item id as a stream that's
+        read from the connection (see ArcGISConnection.open_stream). """
+        return self.con.open_stream('content/items/' + id + '/data')
+
+    def iter_item_data(self, id, key):
+        """ Yields the elements of an array (i.e. 'operationalLayers') in the
+        item data (JSON) of the specified item id, one at a time. The data is
+        parsed as it's read, without holding the whole document in memory. """
+        return _iter_json_array(self.con.iter_get('content/items/' + id + '/data'),
+                                key, self.con.ensure_ascii)
+
+    def item_datad(self, id, dir=None, filename=None, size=None):
+        """ Downloads the item data for the specified item id, returns file path.
+        Data larger than DOWNLOAD_SEGMENT_THRESHOLD is downloaded in resumable
+        segments, and verified against the item's size (if size isn't
+        specified, it's taken from the response to a range request). """
         dataurlpath = 'content/items/' + id + '/data'
         if not filename:
-            filename = self.item(id).get('name')
+            item = self.item(id) or {}
+            filename = item.get('name')
             if not filename:
                 filename = 'data'
+            if size is None:
+                size = item.get('size')
         if not dir:
             dir = self.workdir
         filepath = os.path.join(dir, filename)
-        self.con.download(dataurlpath, filepath)
+        if size is None or size > DOWNLOAD_SEGMENT_THRESHOLD:
+            self.con.download_segmented(dataurlpath, filepath, size)
+        else:
+            self.con.download(dataurlpath, filepath)
         return filepath
 
     def item_thumbnail(self, id):
@@ -492,10 +690,7 @@ class Portal(object):
             if thumbnail_url_path:
                 if not dir:
                     dir = self.workdir
-                file_name = os.path.split(thumbnail_file)[1]
-                if len(file_name) > 50: #If > 50 chars, truncate to last 30 chars
-                    file_name = file_name[-30:]
-                file_path = os.path.join(dir, file_name)
+                file_path = os.path.join(dir, thumbnail_file_name(thumbnail_file))
                 self.con.download(thumbnail_url_path, file_path)
                 return file_path
 
@@ -540,6 +735,82 @@ class Portal(object):
     def _search(self, search_func, properties, q, bbox, group_fields,
                 sort_field, sort_order, num, scope):
 
+        q = self._scope_query(q, scope)
+
+        # Parse the properties into the property names and aggregate functions.
+        # Then validate the inputs (e.g. make sure aggregate functions are
+        # supported, that propertie are valid)
+        if properties is None:
+            properties = []
+        prop_names, func_names = self._parse_properties(properties)
+        self._validate_properties(properties, func_names, group_fields)
+
+        # Prepare for searching
+        prop_names_nodups = list(set(prop_names))
+        sort_field_name = ''
+        if sort_field:
+            sort_field_name = self._parse_properties([sort_field])[0][0]
+
+        # Execute the search and get back the results. If the search has more
+        # results than a single query returns, split it into shards
+        def page_func(start, page_num):
+            return search_func(q, bbox, start, page_num, sort_field_name,
+                               sort_order)
+        resp = page_func(1, min(num, 100))
+        if num > SEARCH_WINDOW and int(resp.get('total') or 0) > SEARCH_WINDOW:
+            results = self._sharded_search(search_func, q, bbox, sort_field_name,
+                                           sort_order, num)
+        else:
+            results = self._page_results(page_func, 'results', num,
+                                         first_resp=resp)
+        if search_func == self._search_page:
+            self._validate_cached_items(results)
+        results = self._extract(results, prop_names_nodups)
+
+        # If group fields were specified, aggregate the results (and sort, if
+        # sort field was specified)
+        if group_fields:
+            results = self._groupby_and_sort(results, group_fields, prop_names,
+                                             func_names, sort_field, sort_order)
+        return results
+
+    def iter_search(self, properties=None, q=None, bbox=None, sort_field='',
+                    sort_order='asc', num=100000, scope='default'):
+        """ Searches portal items, yielding the items as the result pages
+        arrive. The next page is fetched while the current one is processed. """
+        q = self._scope_query(q, scope)
+        return self._iter_search(self._search_page, properties, q, bbox,
+                                 sort_field, sort_order, num)
+
+    def _iter_search(self, search_func, properties, q, bbox, sort_field,
+                     sort_order, num):
+        if properties is None:
+            properties = []
+        prop_names, func_names = self._parse_properties(properties)
+        self._validate_properties(properties, func_names, None)
+        prop_names_nodups = list(set(prop_names))
+        sort_field_name = ''
+        if sort_field:
+            sort_field_name = self._parse_properties([sort_field])[0][0]
+
+        # If the search has more results than a single query returns, split
+        # it into shards
+        def page_func(start, page_num):
+            return search_func(q, bbox, start, page_num, sort_field_name,
+                               sort_order)
+        resp = page_func(1, min(num, 100))
+        if num > SEARCH_WINDOW and int(resp.get('total') or 0) > SEARCH_WINDOW:
+            results = self._iter_sharded_search(search_func, q, bbox,
+                                                sort_field_name, sort_order, num)
+        else:
+            results = self._iter_pages(page_func, 'results', num, first_resp=resp)
+        for result in results:
+            if search_func == self._search_page:
+                self._validate_cached_items([result])
+            yield self._extract([result], prop_names_nodups)[0]
+
+    def _scope_query(self, q, scope):
+
         # If user is attempting to search public and hasn't specified a query
         # then throw an error
         is_searching_public = self._is_searching_public(scope)
@@ -560,39 +831,161 @@ class Portal(object):
                 raise PortalError('Cannot search this portal at the org scope. ' \
                                   + 'Either attemping to search www.arcgis.com ' \
                                   + 'or a private subscirption/portal anonymously')
-
-        # Parse the properties into the property names and aggregate functions.
-        # Then validate the inputs (e.g. make sure aggregate functions are
-        # supported, that propertie are valid)
-        if properties is None:
-            properties = []
-        prop_names, func_names = self._parse_properties(properties)
-        self._validate_properties(properties, func_names, group_fields)
-
-        # Prepare for searching
-        prop_names_nodups = list(set(prop_names))
-        sort_field_name = ''
-        if sort_field:
-            sort_field_name = self._parse_properties([sort_field])[0][0]
-
-        # Execute the search and get back the results
-        count = 0
-        resp = search_func(q, bbox, 1, min(num, 100), sort_field_name, sort_order)
-        results = self._extract(resp['results'], prop_names_nodups)
-        count += int(resp['num'])
+        return q
+
+    def _iter_pages(self, page_func, results_key, num=None, page_size=100,
+                    first_resp=None):
+        """ Yields up to num (all if None) results of a paged request, in
+        order. page_func is called with the start and num of a page; the next
+        page is requested in the background while the current page's results
+        are yielded. """
+        pool = ThreadPool(1)
+        try:
+            count = 0
+            resp = first_resp
+            if resp is None:
+                resp = page_func(1, page_size if num is None else min(num, page_size))
+            while resp:
+                pending = None
+                count += int(resp['num'])
+                nextstart = int(resp['nextStart'])
+                if nextstart > 0 and (num is None or count < num):
+                    page_num = page_size if num is None else min(num - count, page_size)
+                    pending = pool.apply_async(page_func, (nextstart, page_num))
+                for result in resp.get(results_key) or []:
+                    yield result
+                resp = pending.get() if pending else None
+        finally:
+            # Don't wait for a prefetched page if the caller stopped early
+            pool.close()
+
+    def _sharded_search(self, search_func, q, bbox, sort_field, sort_order,
+                        num, field='created'):
+        """ Returns up to num results of a search that has more results than
+        a single query returns (SEARCH_WINDOW); see _iter_sharded_search. """
+        return list(self._iter_sharded_search(search_func, q, bbox, sort_field,
+                                              sort_order, num, field))
+
+    def _iter_sharded_search(self, search_func, q, bbox, sort_field,
+                             sort_order, num, field='created'):
+        """ Yields up to num results of a search that has more results than
+        a single query returns (SEARCH_WINDOW). The query is split into
+        disjoint date ranges of the field (created or modified), halving any
+        range with more than SEARCH_WINDOW results. The ranges are searched
+        concurrently (max_workers at a time) and the results merged, without
+        duplicates. Results are yielded as the ranges arrive, unless a sort
+        field is specified; they are then sorted like the portal sorts them
+        (strings case-insensitively, missing values last), although the order
+        of equal values may differ from the portal's. """
+        def shard_query(shard):
+            return '(%s) AND %s:[%019d TO %019d]' % (q, field, shard[0], shard[1])
+
+        def count(shard):
+            resp = search_func(shard_query(shard), bbox, 1, 1, '', 'asc')
+            return shard, int(resp['total'])
+
+        def fetch(shard):
+            def page_func(start, page_num):
+                return search_func(shard_query(shard), bbox, start, page_num,
+                                   sort_field, sort_order)
+            return self._page_results(page_func, 'results', max_workers=1)
+
+        max_workers = max(1, self.max_workers)
+        shards = []
+        pending = [(0, int(time.time() * 1000) + 86400000)]
+        pool = ThreadPool(max_workers)
+        try:
+            # Plan the shards
+            while pending:
+                split = []
+                for shard, total in pool.imap(count, pending):
+                    if total > SEARCH_WINDOW and shard[0] < shard[1]:
+                        middle = (shard[0] + shard[1]) // 2
+                        split.extend([(shard[0], middle), (middle + 1, shard[1])])
+                    elif total > 0:
+                        if total > SEARCH_WINDOW:
+                            _log.warning(str(total) + ' results with the same ' \
+                                         + field + ' date; only ' \
+                                         + str(SEARCH_WINDOW) + ' are returned')
+                        shards.append(shard)
+                pending = split
+            shards.sort()
+            _log.info('Searching ' + str(len(shards)) + ' shards (q=' + str(q) + ')')
+
+            # Search the shards, keeping at most max_workers shards in flight
+            def iter_shard_results():
+                fetches = collections.deque()
+                for shard in shards:
+                    fetches.append(pool.apply_async(fetch, (shard,)))
+                    if len(fetches) >= max_workers:
+                        yield fetches.popleft().get()
+                while fetches:
+                    yield fetches.popleft().get()
+
+            # Merge the results
+            result_ids = set()
+            def merged():
+                for shard_results in iter_shard_results():
+                    for result in shard_results:
+                        if result['id'] not in result_ids:
+                            result_ids.add(result['id'])
+                            yield result
+
+            if sort_field:
+                results = _sort_search_results(list(merged()), sort_field,
+                                               sort_order)
+            else:
+                results = merged()
+            for i, result in enumerate(results):
+                if i >= num:
+                    break
+                yield result
+        finally:
+            pool.close()
+
+    def _page_results(self, page_func, results_key, num=None, page_size=100,
+                      first_resp=None, max_workers=None):
+        """ Returns up to num (all if None) results of a paged request, in
+        order. page_func is called with the start and num of a page. Once the
+        first page returns the total, the remaining pages are fetched
+        concurrently (up to max_workers requests at a time). """
+        if max_workers is None:
+            max_workers = self.max_workers
+        if first_resp is not None:
+            resp = first_resp
+        elif num is None:
+            resp = page_func(1, page_size)
+        else:
+            resp = page_func(1, min(num, page_size))
+        results = list(resp.get(results_key) or [])
+        count = int(resp['num'])
         nextstart = int(resp['nextStart'])
-        while count < num and nextstart > 0:
-            resp = search_func(q, bbox, nextstart, min(num - count, 100),
-                               sort_field_name, sort_order)
-            results.extend(self._extract(resp['results'], prop_names_nodups))
-            count += int(resp['num'])
-            nextstart = int(resp['nextStart'])
+        if nextstart <= 0 or (num is not None and count >= num):
+            return results
 
-        # If group fields were specified, aggregate the results (and sort, if
-        # sort field was specified)
-        if group_fields:
-            results = self._groupby_and_sort(results, group_fields, prop_names,
-                                             func_names, sort_field, sort_order)
+        # Without the total, the pages can only be fetched one after another
+        total = resp.get('total')
+        if total is None or max_workers <= 1:
+            while nextstart > 0 and (num is None or count < num):
+                page_num = page_size if num is None else min(num - count, page_size)
+                resp = page_func(nextstart, page_num)
+                results.extend(resp.get(results_key) or [])
+                count += int(resp['num'])
+                nextstart = int(resp['nextStart'])
+            return results
+
+        end = int(total) if num is None else min(int(total), num)
+        pages = [(start, min(end - start + 1, page_size))
+                 for start in range(nextstart, end + 1, page_size)]
+        if not pages:
+            return results
+        pool = ThreadPool(min(max_workers, len(pages)))
+        try:
+            for resp in pool.imap(lambda page: page_func(*page), pages):
+                results.extend(resp.get(results_key) or [])
+        finally:
+            pool.close()
+            pool.join()
         return results
 
     def _groupby_and_sort(self, results, group_fields, prop_names, func_names,
@@ -845,9 +1238,14 @@ class Portal(object):
         # Build the files list (tuples)
         files = []
         if data:
-            if _is_http_url(data):
-                data = urllib.urlretrieve(data)[0]
-            files.append(('file', data, os.path.basename(data)))
+            if hasattr(data, 'read'):
+                # A stream with a known length (i.e. from item_data_stream)
+                # is sent as it's read
+                files.append(('file', data, item.get('name') or 'data'))
+            else:
+                if _is_http_url(data):
+                    data = urllib.urlretrieve(data)[0]
+                files.append(('file', data, os.path.basename(data)))
         if metadata:
             if _is_http_url(metadata):
                 metadata = urllib.urlretrieve(metadata)[0]
@@ -868,13 +1266,33 @@ class Portal(object):
         if not owner:
             owner = self.logged_in_user()['username']
 
+        # Upload large data files in parts after the item has been added
+        multipart_data = self._multipart_data(postdata, files)
+
         # Setup the item path, including the folder, and post to it
         path = 'content/users/' + owner
         if folder:
             path += '/' + folder
         path += '/addItem'
         resp = self.con.post(path, postdata, files)
+        if resp and resp.get('success') and multipart_data:
+            item_props = unicode_to_ascii(item)
+            if not self._upload_parts(owner, resp['id'], multipart_data,
+                                      item_props):
+                # The portal doesn't support multipart uploads (or they
+                # failed), so remove the item and add it again, uploading the
+                # data in a single request
+                _log.warning('Multipart upload of ' + multipart_data \
+                             + ' failed, uploading it in a single request')
+                self.con.post('content/users/' + owner + '/items/' \
+                              + resp['id'] + '/delete', self._postdata())
+                self._single_request_data(postdata, files, multipart_data)
+                resp = self.con.post(path, postdata, files)
         if resp and resp.get('success'):
+            # Add the item to the owner's item index (if it's been built)
+            item_folders = self._user_item_folders_cache.peek(owner)
+            if item_folders is not None:
+                item_folders[resp['id']] = folder
             return resp['id']
 
     def update_item(self, id, item=None, data=None, metadata=None, thumbnail=None):
@@ -923,10 +1341,114 @@ class Portal(object):
                         thumbnail = new_thumbnail
             files.append(('thumbnail', thumbnail, os.path.basename(thumbnail)))
 
+        # Upload large data files in parts after the item has been updated
+        multipart_data = self._multipart_data(postdata, files)
+
         resp = self.con.post(path, postdata, files)
+        if resp and resp.get('success') and multipart_data:
+            owner = path.split('/')[2]
+            if not self._upload_parts(owner, id, multipart_data):
+                # Fall back to updating the data in a single request
+                _log.warning('Multipart upload of ' + multipart_data \
+                             + ' failed, uploading it in a single request')
+                self._single_request_data(postdata, files, multipart_data)
+                resp = self.con.post(path, postdata, files)
+        self._invalidate_item(id)
         if resp:
             return resp.get('success')
 
+    def _multipart_data(self, postdata, files):
+        """ If the data file is larger than MULTIPART_UPLOAD_THRESHOLD, removes
+        it from the files, sets up the postdata for a multipart upload and
+        returns the path of the data file. """
+        for file_tuple in files:
+            if file_tuple[0] == 'file' and \
+                    isinstance(file_tuple[1], basestring) and \
+                    os.path.getsize(file_tuple[1]) > MULTIPART_UPLOAD_THRESHOLD:
+                files.remove(file_tuple)
+                postdata['multipart'] = 'true'
+                postdata['filename'] = file_tuple[2]
+                return file_tuple[1]
+        return None
+
+    def _single_request_data(self, postdata, files, filepath):
+        """ Reverts the changes made by _multipart_data, so the data file is
+        uploaded with the rest of the request. """
+        del postdata['multipart']
+        files.append(('file', filepath, postdata.pop('filename')))
+
+    def _upload_parts(self, owner, id, filepath, commit_props=None,
+                      part_size=None, status_interval=2, timeout=None):
+        """ Uploads a file to a multipart item in parts (concurrently, retrying
+        each part), commits the item and waits (up to timeout seconds) for the
+        commit to complete. Returns true if successful. """
+        if not part_size:
+            part_size = MULTIPART_PART_SIZE
+        if not timeout:
+            timeout = MULTIPART_COMMIT_TIMEOUT
+        basepath = 'content/users/' + owner + '/items/' + id + '/'
+        filename = os.path.basename(filepath)
+        size = os.path.getsize(filepath)
+        parts = [(i + 1, offset, min(part_size, size - offset))
+                 for i, offset in enumerate(range(0, size, part_size))]
+
+        def upload_part(part):
+            part_num, offset, length = part
+            for attempt in range(MULTIPART_PART_RETRIES):
+                postdata = self._postdata()
+                postdata['partNum'] = part_num
+                try:
+                    resp = self.con.post(basepath + 'addPart', postdata,
+                                         [('file', filepath, filename, offset, length)])
+                    if resp and resp.get('success'):
+                        return part_num, True
+                except (httplib.HTTPException, socket.error, urllib2.URLError) as e:
+                    _log.warning('Upload of part ' + str(part_num) + ' of ' \
+                                 + filename + ' failed: ' + str(e))
+            return part_num, False
+
+        # Upload the first part on its own, so a portal that doesn't support
+        # multipart uploads is detected before the rest of the file is sent
+        _log.info('Uploading ' + filename + ' in ' + str(len(parts)) + ' parts')
+        if not upload_part(parts[0])[1]:
+            _log.error('Upload of part 1 of ' + filename + ' failed')
+            return False
+        pool = ThreadPool(max(1, min(self.max_workers, len(parts) - 1)))
+        try:
+            failed_parts = [part_num for part_num, success
+                            in pool.imap_unordered(upload_part, parts[1:])
+                            if not success]
+        finally:
+            pool.close()
+            pool.join()
+        if failed_parts:
+            _log.error('Upload of parts ' + str(sorted(failed_parts)) + ' of ' \
+                       + filename + ' failed')
+            return False
+
+        # Commit the parts, and wait until the item has been assembled
+        postdata = self._postdata()
+        if commit_props:
+            postdata.update(commit_props)
+        resp = self.con.post(basepath + 'commit', postdata)
+        if not resp or not resp.get('success'):
+            return False
+        deadline = time.time() + timeout
+        while True:
+            resp = self.con.post(basepath + 'status', self._postdata())
+            if not resp or resp.get('status') == 'failed':
+                _log.error('Commit of ' + filename + ' failed: ' \
+                           + str(resp and resp.get('statusMessage')))
+                return False
+            if resp.get('status') == 'completed':
+                return True
+            if time.time() + status_interval > deadline:
+                raise PortalError('Commit of ' + filename + ' (item ' + id \
+                                  + ') did not complete within ' \
+                                  + str(timeout) + ' seconds')
+            time.sleep(status_interval)
+            status_interval = min(status_interval * 2, 30)
+
     def publish_item(self, file_type, item_id, publish_parameters=None, output_type=None):
         """
         Publishes a hosted service based on an existing service definition item.
@@ -1043,6 +1565,7 @@ class Portal(object):
         """ Deletes a single item from the portal. """
         path = self.user_item_link(id, owner, path_only=True) + '/delete'
         resp = self.con.post(path, self._postdata())
+        self._invalidate_item(id)
         if resp:
             return resp.get('success')
 
@@ -1053,14 +1576,18 @@ class Portal(object):
         postdata['everyone'] = str(everyone).lower()
         postdata['org'] = str(org).lower()
         postdata['groups'] = ','.join(group_ids) if group_ids else ''
-        return self.con.post('content/items/' + item_id + '/share', postdata)
+        resp = self.con.post('content/items/' + item_id + '/share', postdata)
+        self._invalidate_item(item_id)
+        return resp
 
     def unshare_item(self, item_id, group_ids):
         """ Unshares a single item within the portal . """
         group_ids = unpack(group_ids, 'id')
         postdata = self._postdata()
         postdata['groups'] = ','.join(group_ids) if group_ids else ''
-        return self.con.post('content/items/' + item_id + '/unshare', postdata)
+        resp = self.con.post('content/items/' + item_id + '/unshare', postdata)
+        self._invalidate_item(item_id)
+        return resp
 
     def reassign_item(self, id, target_owner, target_folder=None):
         """ Reassigns a single item within the portal. """
@@ -1068,7 +1595,9 @@ class Portal(object):
         postdata = self._postdata()
         postdata['targetUsername'] = target_owner
         postdata['targetFoldername'] = target_folder if target_folder else '/'
-        return self.con.post(user_item_link + '/reassign', postdata)
+        resp = self.con.post(user_item_link + '/reassign', postdata)
+        self._invalidate_item(id)
+        return resp
 
     def share_items(self, owner, item_ids, group_ids=None, org=False,
                     everyone=False):
@@ -1080,8 +1609,10 @@ class Portal(object):
         postdata['org'] = str(org).lower()
         postdata['groups'] = ','.join(group_ids) if group_ids else ''
         postdata['items'] = ','.join(item_ids)
-        return self.con.post('content/users/' + owner + '/shareItems',
+        resp = self.con.post('content/users/' + owner + '/shareItems',
                              postdata)
+        self._invalidate_item(*item_ids)
+        return resp
 
     def unshare_items(self, owner, item_ids, group_ids):
         """ Unshares items with groups. """
@@ -1090,14 +1621,18 @@ class Portal(object):
         postdata = self._postdata()
         postdata.update({'groups': ','.join(group_ids),
                          'items': ','.join(item_ids)})
-        return self.con.post('content/users/' + owner + '/unshareItems', postdata)
+        resp = self.con.post('content/users/' + owner + '/unshareItems', postdata)
+        self._invalidate_item(*item_ids)
+        return resp
 
     def delete_items(self, owner, item_ids):
         """ Deletes items from the portal. """
         item_ids = unpack(item_ids, 'id')
         postdata = self._postdata()
         postdata['items'] = ','.join(item_ids)
-        return self.con.post('content/users/' + owner + '/deleteItems', postdata)
+        resp = self.con.post('content/users/' + owner + '/deleteItems', postdata)
+        self._invalidate_item(*item_ids)
+        return resp
 
     def folders(self, owner):
         """ Returns the specified user's folders. """
@@ -1187,6 +1722,14 @@ class Portal(object):
         return self._search(self._groups_page, properties, q, None, group_fields,
                             sort_field, sort_order, num, scope)
 
+    def iter_groups(self, properties=None, q=None, sort_field='',
+                    sort_order='asc', num=5000, scope='default'):
+        """ Searches portal groups, yielding the groups as the result pages
+        arrive. The next page is fetched while the current one is processed. """
+        q = self._scope_query(q, scope)
+        return self._iter_search(self._groups_page, properties, q, None,
+                                 sort_field, sort_order, num)
+
     def _groups_page(self, q=None, bbox=None, start=1, num=10, sortfield='',
                      sortorder='asc'):
         _log.info('Searching groups (q=' + str(q) + ', start=' + str(start) \
@@ -1311,20 +1854,7 @@ class Portal(object):
     def user_item(self, id, owner=None, folder_id=None):
         """ Returns a tuple of the item properties, item sharing, and folder id. """
 
-        # EL commented 6/7/2013: having issues where the id exists in the cache,
-        # but the URL to the item is incorrect; for example, the item is located
-        # in a folder, but the folder_id is None.
-        
-        ## First check the cache, and if we have the link, try it
-        #if id in self._user_item_links_cache:
-        #    user_item_link = self._user_item_links_cache[id]
-        #    resp = self.con.post(user_item_link, self._postdata())
-        #    if resp and not resp.get('error'):
-        #        return resp['item'], resp['sharing'], folder_id
-        
-        # If we haven't cached the link, or the cached link no longer works,
-        # proceed with trying the more manual approach. Start with getting the
-        # owner, if not provided as input.
+        # Start with getting the owner, if not provided as input.
         if not owner:
             item = self.item(id)
             if not item:
@@ -1339,27 +1869,49 @@ class Portal(object):
             path = basepath + folder_id + '/items/' + id
             resp = self.con.post(path, self._postdata())
             if resp and not resp.get('error'):
-                self._user_item_links_cache[id] = path
                 return resp['item'], resp['sharing'], folder_id
 
         # Otherwise, first try the root folder
         path = basepath + 'items/' + id
         resp = self.con.post(path, self._postdata())
         if resp and not 'error' in resp:
-            self._user_item_links_cache[id] = path
             return resp['item'], resp['sharing'], folder_id
 
-        # If the item wasnt in root folder, try other folders
-        folders = self.folders(owner)
-        for folder in folders:
-            path = basepath + folder['id'] + '/items/' + id
-            resp = self.con.post(path, self._postdata())
-            if resp and not resp.get('error'):
-                self._user_item_links_cache[id] = path
-                return resp['item'], resp['sharing'], folder['id']
+        # If the item wasn't in the root folder, look up its folder in the
+        # owner's item index. The index is rebuilt if the item isn't in it, or
+        # the link is stale (i.e. the item was moved to another folder)
+        item_folders = self._user_item_folders_cache.get(owner)
+        for rebuild in (item_folders is None, True):
+            if rebuild:
+                item_folders = self._user_item_folders(owner)
+            folder_id = item_folders.get(id)
+            if folder_id:
+                path = basepath + folder_id + '/items/' + id
+                resp = self.con.post(path, self._postdata())
+                if resp and not resp.get('error'):
+                    return resp['item'], resp['sharing'], folder_id
+            if rebuild:
+                break
 
         return None, None, None
 
+    def _user_item_folders(self, owner):
+        """ Builds and caches the index of the folder id (None for the root
+        folder) of each of the owner's items. """
+        item_folders = {}
+        try:
+            root_items, folders = self.user_contents(owner)
+        except (TypeError, KeyError):
+            # The owner doesn't exist or its content can't be accessed
+            return item_folders
+        for item in root_items:
+            item_folders[item['id']] = None
+        for folder_id, folder_title, items in folders:
+            for item in items:
+                item_folders[item['id']] = folder_id
+        self._user_item_folders_cache[owner] = item_folders
+        return item_folders
+
     def user_item_link(self, id, owner=None, folder_id=None, path_only=False):
         """ Returns the user link to an item (includes folder if appropriate). """
 
@@ -1394,18 +1946,8 @@ class Portal(object):
         prop_names_nodups = list(set(prop_names))
 
         # Execute the search and get back the results
-        count = 0
-        resp = self._org_users_page(1, min(num, 100))
-        resp_users = resp.get('users')
-        results = self._extract(resp_users, prop_names_nodups)
-        count += int(resp['num'])
-        nextstart = int(resp['nextStart'])
-        while count < num and nextstart > 0:
-            resp = self._org_users_page(nextstart, min(num - count, 100))
-            resp_users = resp.get('users')
-            results.extend(self._extract(resp_users, prop_names_nodups))
-            count += int(resp['num'])
-            nextstart = int(resp['nextStart'])
+        results = self._page_results(self._org_users_page, 'users', num)
+        results = self._extract(results, prop_names_nodups)
 
         # If group fields were specified, aggregate the results (and sort, if
         # sort field was specified)
@@ -1426,26 +1968,7 @@ class Portal(object):
               sort_order='asc', num=5000, scope='default'):
         """ Searches portal users. Supports sorting, aggregation, and auto-paging. """
 
-        # If user is attempting to search public and hasn't specified a query
-        # then throw an error
-        is_searching_public = self._is_searching_public(scope)
-        if is_searching_public and not q:
-            raise PortalError('q parameter is required when searching ' \
-                              + 'with public scope')
-
-        # If the user is searching within the org, verify that either we can
-        # get the org's account id. If we can't, it's likely a private portal
-        # and the user is not logged in... then we throw an error
-        if not is_searching_public:
-            accountid = self._properties.get('id')
-            if accountid and q:
-                q += ' accountid:' + accountid
-            elif accountid:
-                q = 'accountid:' + accountid
-            else:
-                raise PortalError('Cannot search this portal at the org scope. ' \
-                                  + 'Either attemping to search www.arcgis.com ' \
-                                  + 'or a private subscirption/portal anonymously')
+        q = self._scope_query(q, scope)
 
         # Parse the properties into the property names and aggregate functions.
         # Then validate the inputs (e.g. make sure aggregate functions are
@@ -1462,19 +1985,11 @@ class Portal(object):
             sort_field_name = self._parse_properties([sort_field])[0][0]
 
         # Execute the search and get back the results
-        count = 0
-        resp = self._users_page(q, 1, min(num, 100), sort_field_name, sort_order)
-        resp_users = resp.get('results')
-        results = self._extract(resp_users, prop_names_nodups)
-        count += int(resp['num'])
-        nextstart = int(resp['nextStart'])
-        while count < num and nextstart > 0:
-            resp = self._users_page(q, nextstart, min(num - count, 100),
-                                    sort_field_name, sort_order)
-            resp_users = resp.get('results')
-            results.extend(self._extract(resp_users, prop_names_nodups))
-            count += int(resp['num'])
-            nextstart = int(resp['nextStart'])
+        def page_func(start, page_num):
+            return self._users_page(q, start, page_num, sort_field_name,
+                                    sort_order)
+        results = self._page_results(page_func, 'results', num)
+        results = self._extract(results, prop_names_nodups)
 
         # If group fields were specified, aggregate the results (and sort, if
         # sort field was specified)
@@ -1483,6 +1998,28 @@ class Portal(object):
                                              func_names, sort_field, sort_order)
         return results
 
+    def iter_users(self, properties=None, q=None, sort_field='',
+                   sort_order='asc', num=5000, scope='default'):
+        """ Searches portal users, yielding the users as the result pages
+        arrive. The next page is fetched while the current one is processed. """
+        q = self._scope_query(q, scope)
+        def search_func(q, bbox, start, num, sortfield, sortorder):
+            return self._users_page(q, start, num, sortfield, sortorder)
+        return self._iter_search(search_func, properties, q, None,
+                                 sort_field, sort_order, num)
+
+    def iter_org_users(self, properties=None, num=5000):
+        """ Yields the users within the portal organization as the result
+        pages arrive. The next page is fetched while the current one is
+        processed. """
+        if properties is None:
+            properties = []
+        prop_names, func_names = self._parse_properties(properties)
+        self._validate_properties(properties, func_names, None)
+        prop_names_nodups = list(set(prop_names))
+        for result in self._iter_pages(self._org_users_page, 'users', num):
+            yield self._extract([result], prop_names_nodups)[0]
+
     def _users_page(self, q=None, start=1, num=10, sortfield='', sortorder='asc'):
         _log.info('Searching users (q=' + str(q) + ', start=' + str(start) \
                   + ', num=' + str(num) + ')')
@@ -1493,15 +2030,29 @@ class Portal(object):
 
     def user_contents(self, username):
         """ Returns a tuple of root items and a dictionary of folder items."""
-        resp = self.con.post('content/users/' + username, self._postdata())
-        root_items = resp['items']
+        root_items, root_folders = self._user_folder_contents(username)
         folders = []
-        for folder in resp['folders']:
-            resp = self.con.post('content/users/' + username + '/' \
-                                 + folder['id'], self._postdata())
-            folders.append((folder['id'], folder['title'], resp['items']))
+        for folder in root_folders:
+            items = self._user_folder_contents(username, folder['id'])[0]
+            folders.append((folder['id'], folder['title'], items))
         return root_items, folders
 
+    def _user_folder_contents(self, username, folder_id=None):
+        """ Returns all items (of all pages) in a user's folder (the root
+        folder if folder_id is None), and the folders listed in the response. """
+        path = 'content/users/' + username
+        if folder_id:
+            path += '/' + folder_id
+        def page_func(start, num):
+            postdata = self._postdata()
+            postdata.update({'start': start, 'num': num})
+            return self.con.post(path, postdata)
+        resp = page_func(1, 100)
+        if 'nextStart' not in resp:
+            return resp['items'], resp.get('folders') or []
+        items = self._page_results(page_func, 'items', first_resp=resp)
+        return items, resp.get('folders') or []
+
     def user_invitations(self, username):
         """ Returns all of a user's invitations. """
         invitations_url = 'community/users/' + username + '/invitations'
@@ -1696,8 +2247,11 @@ class ArcGISConnection(object):
 
     def __init__(self, baseurl, username=None, password=None, key_file=None,
                  cert_file=None, expiration=60, all_ssl=False, referer=None,
-                 proxy_host=None, proxy_port=None, ensure_ascii=True):
-        """ The ArcGISConnection constructor. Requires URL and optionally username/password. """
+                 proxy_host=None, proxy_port=None, ensure_ascii=True,
+                 max_connections=10, idle_timeout=60):
+        """ The ArcGISConnection constructor. Requires URL and optionally username/password.
+        Requests are sent over persistent connections; at most max_connections
+        idle connections are kept per host, for up to idle_timeout seconds. """
 
         self.baseurl = normalize_url(baseurl)
         self.key_file = key_file
@@ -1707,12 +2261,16 @@ class ArcGISConnection(object):
         self.proxy_port = proxy_port
         self.ensure_ascii = ensure_ascii
         self.token = None
-
-        # Setup the referer and user agent
+        self._token_renew_time = None
+        self._token_lock = threading.RLock()
+        self._renewing_token = False
+        self._pool = _ConnectionPool(max_connections, idle_timeout,
+                                     key_file, cert_file, proxy_host, proxy_port)
+
+        # Setup the referer (the host name; tokens are only checked against
+        # the referer they were generated for) and user agent
         if not referer:
-            import socket
-            ip = socket.gethostbyname(socket.gethostname())
-            referer = socket.gethostbyaddr(ip)[0]
+            referer = socket.gethostname()
         self._referer = referer
         self._useragent = 'PortalPy/' + __version__
 
@@ -1724,18 +2282,34 @@ class ArcGISConnection(object):
 
     def generate_token(self, username, password, expiration=60):
         """ Generates and returns a new token, but doesn't re-login. """
+        resp = self._generate_token(username, password, expiration)
+        if resp:
+            return resp.get('token')
+
+    def _generate_token(self, username, password, expiration):
         postdata = { 'username': username, 'password': password,
                      'client': 'referer', 'referer': self._referer,
                      'expiration': expiration, 'f': 'json' }
-        resp = self.post('generateToken', postdata, ssl=True)
-        if resp:
-            return resp.get('token')
+        # Don't send the current (possibly expired) token when renewing it
+        return self.post('generateToken', postdata, ssl=True, use_token=False)
 
     def login(self, username, password, expiration=60):
-        """ Logs into the portal using username/password. """
-        newtoken = self.generate_token(username, password, expiration)
+        """ Logs into the portal using username/password. The token is renewed
+        shortly before it expires. """
+        resp = self._generate_token(username, password, expiration)
+        newtoken = resp.get('token') if resp else None
         if newtoken:
+            # Use the requested lifetime if the expiry time returned by the
+            # portal is later, or is in the past (the clocks differ)
+            now = time.time()
+            lifetime = expiration * 60
+            if resp.get('expires'):
+                expires_in = resp['expires'] / 1000.0 - now
+                if 0 < expires_in < lifetime:
+                    lifetime = expires_in
             self.token = newtoken
+            self._token_renew_time = now + lifetime \
+                                     - min(TOKEN_RENEWAL_MARGIN, lifetime / 10.0)
             self._username = username
             self._password = password
             self._expiration = expiration
@@ -1750,11 +2324,47 @@ class ArcGISConnection(object):
     def logout(self):
         """ Logs out of the portal. """
         self.token = None
+        self._token_renew_time = None
+
+    def _current_token(self):
+        """ Returns the token, renewing it first if it's about to expire. One
+        thread renews the token; other requests wait for the new token. """
+        if self._token_renew_time and time.time() >= self._token_renew_time:
+            with self._token_lock:
+                if not self._renewing_token and self._token_renew_time \
+                        and time.time() >= self._token_renew_time:
+                    _log.info('Token is about to expire, fetching a new token')
+                    self._relogin_locked()
+        return self.token
+
+    def _renew_token(self, expired_token):
+        """ Renews a token the server reported as expired, unless another
+        request has renewed it already. Returns the new token. """
+        with self._token_lock:
+            if self.token == expired_token and not self._renewing_token:
+                self._relogin_locked()
+        return self.token
+
+    def _relogin_locked(self):
+        # Called with the token lock held; requests sent while logging in
+        # (generateToken) must not try to renew the token again
+        self._renewing_token = True
+        try:
+            if not self.relogin():
+                # Don't retry before the token has actually expired
+                self._token_renew_time = None
+                _log.warning('Unable to renew token')
+        finally:
+            self._renewing_token = False
 
     def is_logged_in(self):
         """ Returns true if logged into the portal. """
         return self.token is not None
 
+    def close(self):
+        """ Closes the idle persistent connections. """
+        self._pool.clear()
+
     def get(self, path, ssl=False, compress=True, try_json=True, is_retry=False):
         """ Returns result of an HTTP GET. Handles token timeout and all SSL mode."""
         url = path
@@ -1764,37 +2374,28 @@ class ArcGISConnection(object):
             url = url.replace('http://', 'https://')
 
         # Add the token if logged in
+        token = None
         if self.is_logged_in():
-            url = self._url_add_token(url, self.token)
+            token = self._current_token()
+            url = self._url_add_token(url, token)
 
         _log.debug('REQUEST (get): ' + url)
 
         try:
             # Send the request and read the response
-            headers = [('Referer', self._referer),
-                       ('User-Agent', self._useragent)]
+            headers = {'Referer': self._referer,
+                       'User-Agent': self._useragent}
             if compress:
-                headers.append(('Accept-encoding', 'gzip'))
-            opener = urllib2.build_opener()
-            opener.addheaders = headers
-            resp = opener.open(url)
-            if resp.info().get('Content-Encoding') == 'gzip':
-                buf = StringIO(resp.read())
-                f = gzip.GzipFile(fileobj=buf)
-                resp_data = f.read()
-            else:
-                resp_data = resp.read()
+                headers['Accept-encoding'] = 'gzip'
+            resp_info, resp_data = self._open(url, headers=headers)
 
             # If we're not trying to parse to JSON, return response as is
             if not try_json:
                 return resp_data
 
             try:
-                resp_json = json.loads(resp_data)
-
-                # Convert to ascii if directed to do so
-                if self.ensure_ascii:
-                    resp_json = unicode_to_ascii(resp_json)
+                # Parse (converting to ascii if directed to do so)
+                resp_json = _json_loads(resp_data, self.ensure_ascii)
 
                 # Check for errors, and handle the case where the token timed
                 # out during use (and simply needs to be re-generated)
@@ -1804,9 +2405,8 @@ class ArcGISConnection(object):
                         if errorcode == 498 and not is_retry:
                             _log.info('Token expired during get request, ' \
                                       + 'fetching a new token and retrying')
-                            newtoken = self.relogin()
-                            newpath = self._url_add_token(path, newtoken)
-                            return self.get(newpath, ssl, compress, try_json, is_retry=True)
+                            self._renew_token(token)
+                            return self.get(path, ssl, compress, try_json, is_retry=True)
                         elif errorcode == 498:
                             raise PortalError('Invalid token')
                         self._handle_json_error(resp_json['error'])
@@ -1821,7 +2421,7 @@ class ArcGISConnection(object):
 
             # If we couldnt parse the response to JSON, return it as is
             except ValueError:
-                return resp
+                return resp_data
 
         # If we got an HTTPError when making the request check to see if it's
         # related to token timeout, in which case, regenerate a token
@@ -1829,15 +2429,130 @@ class ArcGISConnection(object):
             if e.code == 498 and not is_retry:
                 _log.info('Token expired during get request, fetching a new ' \
                           + 'token and retrying')
-                self.logout()
-                newtoken = self.relogin()
-                newpath = self._url_add_token(path, newtoken)
-                return self.get(newpath, ssl, try_json, is_retry=True)
+                self._renew_token(token)
+                return self.get(path, ssl, compress, try_json, is_retry=True)
             elif e.code == 498:
                 raise PortalError('Invalid token')
             else:
                 raise e
 
+    def iter_get(self, path, ssl=False, is_retry=False):
+        """ Yields the body of an HTTP GET in blocks as it's read (and
+        decompressed). Handles token timeout and all SSL mode. """
+        url = path
+        if not path.startswith('http://') and not path.startswith('https://'):
+            url = self.baseurl + path
+        if ssl or self.all_ssl:
+            url = url.replace('http://', 'https://')
+
+        # Add the token if logged in
+        token = None
+        if self.is_logged_in():
+            token = self._current_token()
+            url = self._url_add_token(url, token)
+
+        _log.debug('REQUEST (iter_get): ' + url)
+
+        headers = {'Referer': self._referer,
+                   'User-Agent': self._useragent,
+                   'Accept-encoding': 'gzip'}
+
+        # Proxied requests and redirects are left to urllib2 (and read whole)
+        if not self.proxy_host and _is_environment_proxied(url):
+            yield self._urllib2_open(url, None, headers)[1]
+            return
+
+        conn, resp = self._send_request('GET', url, None, headers)
+        if resp.status in (301, 302, 303, 307, 308) or resp.status >= 400:
+            resp_data = resp.read()
+            self._release_connection(url, conn, resp)
+            if resp.status == 498 and not is_retry:
+                _log.info('Token expired during get request, fetching a new ' \
+                          + 'token and retrying')
+                self._renew_token(token)
+                for block in self.iter_get(path, ssl, is_retry=True):
+                    yield block
+                return
+            elif resp.status == 498:
+                raise PortalError('Invalid token')
+            elif resp.status < 400:
+                yield self._urllib2_open(url, None, headers)[1]
+                return
+            raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                                    StringIO(resp_data))
+
+        complete = False
+        try:
+            for block in _iter_response(resp, resp.msg):
+                yield block
+            complete = True
+        finally:
+            if complete:
+                self._release_connection(url, conn, resp)
+            else:
+                conn.close()
+
+    def open_stream(self, path, ssl=False, is_retry=False):
+        """ Returns the body of an HTTP GET as a stream, read from the connection
+        as the caller reads it; its length attribute is the length of the body
+        (None if unknown). The stream must be read to the end or closed.
+        Follows redirects. Handles token timeout and all SSL mode. """
+        url = path
+        if not path.startswith('http://') and not path.startswith('https://'):
+            url = self.baseurl + path
+        if ssl or self.all_ssl:
+            url = url.replace('http://', 'https://')
+
+        # Add the token if logged in
+        token = None
+        if self.is_logged_in():
+            token = self._current_token()
+            url = self._url_add_token(url, token)
+
+        _log.debug('REQUEST (open_stream): ' + url)
+
+        headers = {'Referer': self._referer,
+                   'User-Agent': self._useragent}
+
+        # Proxied requests are left to urllib2
+        if not self.proxy_host and _is_environment_proxied(url):
+            opener = urllib2.build_opener()
+            opener.addheaders = headers.items()
+            resp = opener.open(url)
+            length = resp.info().get('Content-Length')
+            return _ResponseStream(resp, int(length) if length else None,
+                                   lambda complete: resp.close())
+
+        for redirect in range(5):
+            conn, resp = self._send_request('GET', url, None, headers)
+            if resp.status in (301, 302, 303, 307, 308):
+                resp.read()
+                self._release_connection(url, conn, resp)
+                url = urlparse.urljoin(url, resp.getheader('Location'))
+                continue
+            if resp.status >= 400:
+                resp_data = resp.read()
+                self._release_connection(url, conn, resp)
+                if resp.status == 498 and not is_retry:
+                    _log.info('Token expired during get request, fetching a ' \
+                              + 'new token and retrying')
+                    self._renew_token(token)
+                    return self.open_stream(path, ssl, is_retry=True)
+                elif resp.status == 498:
+                    raise PortalError('Invalid token')
+                raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                                        StringIO(resp_data))
+
+            def release(complete, url=url, conn=conn, resp=resp):
+                if complete:
+                    self._release_connection(url, conn, resp)
+                else:
+                    conn.close()
+            length = resp.getheader('Content-Length')
+            return _ResponseStream(resp, int(length) if length else None,
+                                   release)
+        raise PortalError('Too many redirects for ' + url)
+
     def download(self, path, filepath, ssl=False, is_retry=False):
         """ Downloads result of an HTTP GET. Handles token timeout and all SSL mode."""
         url = path
@@ -1847,8 +2562,10 @@ class ArcGISConnection(object):
             url = url.replace('http://', 'https://')
 
         # Add the token if logged in
+        token = None
         if self.is_logged_in():
-            url = self._url_add_token(url, self.token)
+            token = self._current_token()
+            url = self._url_add_token(url, token)
 
         _log.debug('REQUEST (download): ' + url + ', to ' + filepath)
 
@@ -1864,15 +2581,188 @@ class ArcGISConnection(object):
             if e.code == 498 and not is_retry:
                 _log.info('Token expired during download request, fetching a ' \
                           + 'new token and retrying')
-                self.logout()
-                newtoken = self.relogin()
-                newpath = self._url_add_token(path, newtoken)
-                self.download(newpath, filepath, ssl, is_retry=True)
+                self._renew_token(token)
+                return self.download(path, filepath, ssl, is_retry=True)
             elif e.code == 498:
                 raise PortalError('Invalid token')
             else:
                 raise e
 
+    def download_segmented(self, path, filepath, size, ssl=False,
+                           segment_size=None, max_workers=4):
+        """ Downloads result of an HTTP GET of the given size (bytes) in
+        segments, using concurrent HTTP range requests. The file is written to
+        filepath + '.part' first; segments completed by an interrupted download
+        of the same file are not downloaded again. Falls back to download() if
+        the server doesn't support range requests. If size is None, it's taken
+        from the range response, and results no larger than
+        DOWNLOAD_SEGMENT_THRESHOLD are downloaded in one request. """
+        url = path
+        if not path.startswith('http://') and not path.startswith('https://'):
+            url = self.baseurl + path
+        if ssl or self.all_ssl:
+            url = url.replace('http://', 'https://')
+        if not self.proxy_host and _is_environment_proxied(url):
+            return self.download(path, filepath, ssl)
+
+        # Check that the server supports range requests for the url (and the
+        # size is right), and resolve any redirects
+        data_url, total = self._probe_range(url)
+        if not data_url:
+            _log.info('Server does not support range requests, downloading ' \
+                      + filepath + ' in one request')
+            return self.download(path, filepath, ssl)
+        if size is None:
+            size = total
+            if size <= DOWNLOAD_SEGMENT_THRESHOLD:
+                return self.download(path, filepath, ssl)
+        if total != size:
+            raise PortalError('Size of ' + url + ' (' + str(total) \
+                              + ' bytes) does not match expected size (' \
+                              + str(size) + ' bytes)')
+
+        # Resume the segments of a previous download of the same file (the
+        # first line of the .done file identifies the size and segmentation)
+        if not segment_size:
+            segment_size = DOWNLOAD_SEGMENT_SIZE
+        part_path = filepath + '.part'
+        done_path = filepath + '.part.done'
+        header = str(size) + ' ' + str(segment_size)
+        done = set()
+        if os.path.exists(part_path) and os.path.exists(done_path):
+            with open(done_path) as f:
+                lines = f.read().splitlines()
+            if lines and lines[0] == header:
+                done = set(int(line) for line in lines[1:] if line.isdigit())
+        if not done:
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            with open(done_path, 'w') as f:
+                f.write(header + '\n')
+        segments = [(start, min(start + segment_size, size) - 1)
+                    for start in range(0, size, segment_size)
+                    if start not in done]
+        done_lock = threading.Lock()
+
+        # Requests to the portal (not redirected) use the current token
+        has_token = 'token' in urlparse.parse_qs(urlparse.urlparse(data_url).query)
+
+        def download_segment(segment):
+            start, end = segment
+            pos = start
+            for attempt in range(DOWNLOAD_SEGMENT_RETRIES):
+                segment_url = data_url
+                if has_token and self.is_logged_in():
+                    segment_url = self._url_add_token(data_url, self._current_token())
+                try:
+                    with open(part_path, 'r+b') as f:
+                        f.seek(pos)
+                        for block in self._get_range(segment_url, pos, end):
+                            f.write(block)
+                            pos += len(block)
+                    if pos > end:
+                        break
+                except (httplib.HTTPException, socket.error, IOError) as e:
+                    _log.warning('Download of bytes ' + str(pos) + '-' \
+                                 + str(end) + ' of ' + filepath \
+                                 + ' failed: ' + str(e))
+            if pos <= end:
+                raise PortalError('Download of bytes ' + str(pos) + '-' \
+                                  + str(end) + ' of ' + filepath + ' failed')
+            with done_lock:
+                with open(done_path, 'a') as f:
+                    f.write(str(start) + '\n')
+            return end - start + 1
+
+        start_time = time.time()
+        pool = ThreadPool(max(1, min(max_workers, len(segments))))
+        try:
+            downloaded = sum(pool.imap_unordered(download_segment, segments))
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = max(time.time() - start_time, 0.001)
+
+        if os.path.getsize(part_path) != size:
+            raise PortalError('Size of ' + part_path + ' does not match ' \
+                              + 'expected size (' + str(size) + ' bytes)')
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        os.rename(part_path, filepath)
+        os.remove(done_path)
+        _log.info('Downloaded %s: %.1f MB in %.1f seconds (%.1f MB/s)%s' % (
+                  filepath, downloaded / 1048576.0, elapsed,
+                  downloaded / 1048576.0 / elapsed,
+                  ', resumed' if done else ''))
+
+    def _probe_range(self, url, is_retry=False):
+        """ Requests the first byte of url, following redirects. Returns the
+        (redirected) url and the total size if the server responds with a
+        partial response, or (None, None) otherwise. """
+        token = None
+        if self.is_logged_in():
+            token = self._current_token()
+            url = self._url_add_token(url, token)
+        for redirect in range(5):
+            scheme, netloc, selector = self._request_target(url)
+            conn, reused = self._pool.get(scheme, netloc)
+            try:
+                conn.request('GET', selector, None,
+                             {'Referer': self._referer,
+                              'User-Agent': self._useragent,
+                              'Range': 'bytes=0-0'})
+                resp = conn.getresponse()
+                if resp.status == 200:
+                    return None, None
+                resp_data = resp.read()
+            finally:
+                conn.close()
+            if resp.status in (301, 302, 303, 307, 308):
+                url = urlparse.urljoin(url, resp.getheader('Location'))
+                continue
+            if resp.status == 498 and not is_retry:
+                _log.info('Token expired during download request, fetching ' \
+                          + 'a new token and retrying')
+                self._renew_token(token)
+                return self._probe_range(url, is_retry=True)
+            if resp.status >= 400:
+                raise urllib2.HTTPError(url, resp.status, resp.reason,
+                                        resp.msg, StringIO(resp_data))
+            content_range = resp.getheader('Content-Range', '')
+            if resp.status != 206 or '/' not in content_range:
+                return None, None
+            return url, int(content_range.rsplit('/', 1)[1])
+        raise PortalError('Too many redirects for ' + url)
+
+    def _get_range(self, url, start, end):
+        """ Yields the blocks of a byte range of the response to a GET request,
+        read over a pooled persistent connection. """
+        scheme, netloc, selector = self._request_target(url)
+        conn, reused = self._pool.get(scheme, netloc)
+        complete = False
+        try:
+            conn.request('GET', selector, None,
+                         {'Referer': self._referer,
+                          'User-Agent': self._useragent,
+                          'Range': 'bytes=' + str(start) + '-' + str(end)})
+            resp = conn.getresponse()
+            content_range = resp.getheader('Content-Range', '')
+            if resp.status != 206 or not content_range.startswith(
+                    'bytes ' + str(start) + '-'):
+                raise httplib.HTTPException('Unexpected response to range ' \
+                    + 'request: ' + str(resp.status) + ' ' + content_range)
+            while True:
+                block = resp.read(DOWNLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+            complete = not resp.will_close
+        finally:
+            if complete:
+                self._pool.release(scheme, netloc, conn)
+            else:
+                conn.close()
+
     def _url_add_token(self, url, token):
 
         # Parse the URL and query string
@@ -1898,7 +2788,7 @@ class ArcGISConnection(object):
 
     # TODO Handle HTTPError (?)
     def post(self, path, postdata=None, files=None, ssl=False, compress=True,
-             is_retry=False):
+             is_retry=False, use_token=True):
         """ Returns result of an HTTP POST. Supports Multipart requests."""
         url = path
         if not path.startswith('http://') and not path.startswith('https://'):
@@ -1907,8 +2797,10 @@ class ArcGISConnection(object):
             url = url.replace('http://', 'https://')
 
         # Add the token if logged in
-        if self.is_logged_in():
-            postdata['token'] = self.token
+        token = None
+        if use_token and self.is_logged_in():
+            token = self._current_token()
+            postdata['token'] = token
 
         if _log.isEnabledFor(logging.DEBUG):
             msg = 'REQUEST: ' + url + ', ' + str(postdata)
@@ -1930,28 +2822,17 @@ class ArcGISConnection(object):
             encoded_postdata = None
             if postdata:
                 encoded_postdata = urllib.urlencode(postdata)
-            headers = [('Referer', self._referer),
-                       ('User-Agent', self._useragent)]
+            headers = {'Referer': self._referer,
+                       'User-Agent': self._useragent}
             if compress:
-                headers.append(('Accept-encoding', 'gzip'))
-            opener = urllib2.build_opener()
-            opener.addheaders = headers
-            resp = opener.open(url, data=encoded_postdata)
-            if resp.info().get('Content-Encoding') == 'gzip':
-                buf = StringIO(resp.read())
-                f = gzip.GzipFile(fileobj=buf)
-                resp_data = f.read()
-            else:
-                resp_data = resp.read()
+                headers['Accept-encoding'] = 'gzip'
+            resp_info, resp_data = self._open(url, encoded_postdata, headers)
 
         # Parse the response into JSON
         if _log.isEnabledFor(logging.DEBUG):
             _log.debug('RESPONSE: ' + url + ', ' + unicode_to_ascii(resp_data))
-        resp_json = json.loads(resp_data)
-
-        # Convert to ascii if directed to do so
-        if self.ensure_ascii:
-            resp_json = unicode_to_ascii(resp_json)
+        # Parse (converting to ascii if directed to do so)
+        resp_json = _json_loads(resp_data, self.ensure_ascii)
 
         # Check for errors, and handle the case where the token timed out
         # during use (and simply needs to be re-generated)
@@ -1961,11 +2842,12 @@ class ArcGISConnection(object):
                 if errorcode == 498 and not is_retry:
                     _log.info('Token expired during post request, fetching a new '
                               + 'token and retrying')
-                    self.logout()
-                    newtoken = self.relogin()
-                    postdata['token'] = newtoken
+                    self._renew_token(token)
+                    if files and any(hasattr(f[1], 'read') for f in files):
+                        raise PortalError('Token expired while posting a '
+                                          'stream, which can\'t be sent again')
                     return self.post(path, postdata, files, ssl, compress,
-                                     is_retry=True)
+                                     is_retry=True, use_token=use_token)
                 elif errorcode == 498:
                     raise PortalError('Invalid token')
                 self._handle_json_error(resp_json['error'])
@@ -1983,44 +2865,130 @@ class ArcGISConnection(object):
         'Referer': self._referer,
         'Content-Type': 'multipart/form-data; boundary=%s' % boundary
         }
-        if self.proxy_host:
-            if ssl:
-                h = httplib.HTTPSConnection(self.proxy_host, self.proxy_port,
-                                            key_file=self.key_file,
-                                            cert_file=self.cert_file)
-                h.request('POST', 'https://' + host + selector, body, headers)
-            else:
-                h = httplib.HTTPConnection(self.proxy_host, self.proxy_port)
-                h.request('POST', 'http://' + host + selector, body, headers)
+        headers['Content-Length'] = str(body.length)
+        url = ('https://' if ssl else 'http://') + host + selector
+        resp, resp_data = self._request('POST', url, body, headers)
+        return resp_data
+
+    def _open(self, url, data=None, headers=None):
+        """ Sends a GET (or a POST if data is present) request over a
+        persistent connection and returns the response headers and body.
+        Raises urllib2.HTTPError for error responses, like urllib2.urlopen. """
+        headers = dict(headers or {})
+
+        # Requests that urllib2 would send through a proxy configured in the
+        # environment, and redirects, are left to urllib2
+        if not self.proxy_host and _is_environment_proxied(url):
+            return self._urllib2_open(url, data, headers)
+
+        if data is None:
+            resp, resp_data = self._request('GET', url, None, headers)
         else:
-            if ssl:
-                h = httplib.HTTPSConnection(host, key_file=self.key_file,
-                                            cert_file=self.cert_file)
-                h.request('POST', selector, body, headers)
-            else:
-                h = httplib.HTTPConnection(host)
-                h.request('POST', selector, body, headers)
-        return h.getresponse().read()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            resp, resp_data = self._request('POST', url, data, headers)
+
+        if resp.status in (301, 302, 303, 307, 308):
+            return self._urllib2_open(url, data, headers)
+        if resp.status >= 400:
+            raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                                    StringIO(resp_data))
+        return resp.msg, resp_data
+
+    def _urllib2_open(self, url, data, headers):
+        handlers = []
+        if self.key_file or self.cert_file:
+            handlers.append(HTTPSClientAuthHandler(self.key_file, self.cert_file))
+        opener = urllib2.build_opener(*handlers)
+        opener.addheaders = headers.items()
+        resp = opener.open(url, data=data)
+        return resp.info(), _read_response(resp, resp.info())
+
+    def _request(self, method, url, body=None, headers=None):
+        """ Sends a request over a pooled persistent connection (to the proxy
+        if one is set) and returns the response and the response body
+        (decompressed as it's read, if gzip encoded). """
+        conn, resp = self._send_request(method, url, body, headers)
+        try:
+            resp_data = _read_response(resp, resp.msg)
+        except:
+            conn.close()
+            raise
+        self._release_connection(url, conn, resp)
+        return resp, resp_data
+
+    def _send_request(self, method, url, body=None, headers=None):
+        """ Sends a request over a pooled persistent connection and returns
+        the connection and the response, without reading the response body. """
+        scheme, netloc, selector = self._request_target(url)
+
+        # A pooled connection may have been closed by the server while it was
+        # idle; retry once on a new connection if sending over it fails.
+        # Bodies that can't be sent again are sent over a new connection.
+        reuse = getattr(body, 'rewindable', True)
+        while True:
+            conn, reused = self._pool.get(scheme, netloc, reuse)
+            try:
+                conn.request(method, selector, body, headers or {})
+                return conn, conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+
+    def _release_connection(self, url, conn, resp):
+        """ Returns the connection to the pool once the response has been read,
+        unless the server is closing it. """
+        if resp.will_close:
+            conn.close()
+        else:
+            scheme, netloc, selector = self._request_target(url)
+            self._pool.release(scheme, netloc, conn)
+
+    def _request_target(self, url):
+        """ Returns the scheme, the host and the selector to request for url
+        (the absolute url for plain http requests sent to a proxy; https
+        requests are tunneled through the proxy). """
+        parsed_url = urlparse.urlparse(url)
+        if self.proxy_host and parsed_url.scheme == 'http':
+            selector = url
+        else:
+            selector = parsed_url.path or '/'
+            if parsed_url.query:
+                selector += '?' + parsed_url.query
+        return parsed_url.scheme, parsed_url.netloc, selector
 
     def _encode_multipart_formdata(self, fields, files):
+        """ Returns the boundary and the (streamed) body of a multipart request.
+        files is a list of (key, filepath, filename) tuples, or (key, filepath,
+        filename, offset, length) tuples to send part of a file; instead of a
+        filepath, a stream with a length attribute can be specified. """
         boundary = mimetools.choose_boundary()
         buf = StringIO()
+        segments = []
         for (key, value) in fields.iteritems():
             buf.write('--%s\r\n' % boundary)
             buf.write('Content-Disposition: form-data; name="%s"' % key)
             buf.write('\r\n\r\n' + _tostr(value) + '\r\n')
-        for (key, filepath, filename) in files:
+        for file_tuple in files:
+            key, filepath, filename = file_tuple[:3]
             buf.write('--%s\r\n' % boundary)
             buf.write('Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (key, filename))
             buf.write('Content-Type: %s\r\n' % (self._get_content_type(filename)))
-            file = open(filepath, "rb")
-            try:
-                buf.write('\r\n' + file.read() + '\r\n')
-            finally:
-                file.close()
+            buf.write('\r\n')
+            segments.append(buf.getvalue())
+            if hasattr(filepath, 'read'):
+                segments.append(filepath)
+            elif len(file_tuple) > 3:
+                segments.append((filepath,) + tuple(file_tuple[3:5]))
+            else:
+                segments.append((filepath, 0, os.path.getsize(filepath)))
+            buf = StringIO()
+            buf.write('\r\n')
         buf.write('--' + boundary + '--\r\n\r\n')
-        buf = buf.getvalue()
-        return boundary, buf
+        segments.append(buf.getvalue())
+        return boundary, _MultipartBody(segments)
 
     def _get_content_type(self, filename):
         return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
@@ -2030,6 +2998,164 @@ class ArcGISConnection(object):
         for errordetail in error['details']:
             _log.error(errordetail)
 
+class _MultipartBody(object):
+    """ A multipart request body that is read from its string and file
+    segments while it is sent (in blocks), instead of being built in memory.
+    File segments are (filepath, offset, length) tuples, or streams with a
+    length attribute (which can only be read once). """
+
+    def __init__(self, segments):
+        self._segments = segments
+        self.length = 0
+        for segment in segments:
+            if isinstance(segment, str):
+                self.length += len(segment)
+            elif isinstance(segment, tuple):
+                self.length += segment[2]
+            else:
+                self.length += segment.length
+        self.rewindable = all(isinstance(segment, (str, tuple))
+                              for segment in segments)
+        self._file = None
+        self._index = 0
+        self._pos = 0
+
+    def seek(self, offset):
+        """ Rewinds the body (only offset 0 is supported). """
+        if offset != 0:
+            raise IOError('Multipart body can only be rewound')
+        if not self.rewindable and (self._index or self._pos):
+            raise IOError('Multipart body with streams can not be rewound')
+        self.close()
+        self._index = 0
+        self._pos = 0
+
+    def read(self, size=8192):
+        chunks = []
+        while size > 0 and self._index < len(self._segments):
+            segment = self._segments[self._index]
+            if isinstance(segment, str):
+                segment_length = len(segment)
+                chunk = segment[self._pos:self._pos + size]
+            elif not isinstance(segment, tuple):
+                segment_length = segment.length
+                chunk = segment.read(min(size, segment_length - self._pos))
+                if not chunk and self._pos < segment_length:
+                    raise IOError('Stream ended after ' + str(self._pos) \
+                                  + ' of ' + str(segment_length) + ' bytes')
+            else:
+                filepath, offset, segment_length = segment
+                if self._file is None:
+                    self._file = open(filepath, 'rb')
+                    self._file.seek(offset + self._pos)
+                chunk = self._file.read(min(size, segment_length - self._pos))
+                if not chunk and self._pos < segment_length:
+                    raise IOError('File ' + filepath + ' changed during upload')
+            chunks.append(chunk)
+            size -= len(chunk)
+            self._pos += len(chunk)
+            if self._pos >= segment_length:
+                self.close()
+                self._index += 1
+                self._pos = 0
+        return ''.join(chunks)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class _ResponseStream(object):
+    """ The body of a response, read from the connection as it's read from
+    the stream. length is the length of the body (None if unknown). """
+
+    def __init__(self, resp, length, release):
+        self.length = length
+        self._resp = resp
+        self._release = release
+        self._read = 0
+
+    def read(self, size=-1):
+        data = self._resp.read() if size < 0 else self._resp.read(size)
+        self._read += len(data)
+        if not data or size < 0 or \
+                (self.length is not None and self._read >= self.length):
+            self._finish(True)
+        return data
+
+    def close(self):
+        """ Closes the connection, unless the body has been read. """
+        self._finish(False)
+
+    def _finish(self, complete):
+        if self._release:
+            release, self._release = self._release, None
+            release(complete)
+
+class _ConnectionPool(object):
+    """ A thread-safe pool of persistent HTTP/1.1 connections per host.
+    If a proxy is set, connections are made to the proxy; https connections
+    are tunneled through it (with CONNECT). """
+
+    def __init__(self, max_size=10, idle_timeout=60, key_file=None,
+                 cert_file=None, proxy_host=None, proxy_port=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.key_file = key_file
+        self.cert_file = cert_file
+        self.proxy_host = proxy_host
+        self.proxy_port = proxy_port
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc, reuse=True):
+        """ Returns an idle connection to the host (or a new one, always if
+        reuse is false), and whether the connection was reused. """
+        now = time.time()
+        conn = None
+        expired = []
+        with self._lock:
+            idle = self._idle.get((scheme, netloc), [])
+            while idle and reuse:
+                candidate, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        if conn:
+            return conn, True
+        if self.proxy_host:
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(self.proxy_host, self.proxy_port,
+                                               key_file=self.key_file,
+                                               cert_file=self.cert_file)
+                conn.set_tunnel(netloc)
+                return conn, False
+            return httplib.HTTPConnection(self.proxy_host, self.proxy_port), False
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, key_file=self.key_file,
+                                           cert_file=self.cert_file), False
+        return httplib.HTTPConnection(netloc), False
+
+    def release(self, scheme, netloc, conn):
+        """ Returns a connection to the pool (closes it if the pool is full). """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_size:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        """ Closes all idle connections. """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn, last_used in conns:
+                conn.close()
+
 class PortalInfo(object):
     """ An object describing the portal. Supports printable string representation."""
     _org_str = 'Name: {0}\nID: {1}\nURL Key: {2}\nDescription: {3}\n' \
@@ -2111,11 +3237,9 @@ class WebMap(object):
         if self.data:
             if not self._data_json:
                 try:
-                    self._data_json = json.loads(self.data)
+                    self._data_json = _json_loads(self.data, self.ensure_ascii)
                     if not self._data_json:
                         raise PortalError('WebMap "' + self.id + '" has no data')
-                    if self.ensure_ascii:
-                        self._data_json = unicode_to_ascii(self._data_json)
                 except:
                     raise PortalError('WebMap "' + self.id + '" has invalid data')
             return copy.deepcopy(self._data_json)
@@ -2306,11 +3430,9 @@ class OperationView(object):
         if self.data:
             if not self._data_json:
                 try:
-                    self._data_json = json.loads(self.data)
+                    self._data_json = _json_loads(self.data, self.ensure_ascii)
                     if not self._data_json:
                         raise PortalError('OperationView "' + self.id + '" has no data')
-                    if self.ensure_ascii:
-                        self._data_json = unicode_to_ascii(self._data_json)
                 except:
                     raise PortalError('OperationView "' + self.id + '" has invalid data')
             return copy.deepcopy(self._data_json)
@@ -2475,10 +3597,174 @@ def parse_hostname(url, include_port=False):
         parsed_url = urlparse.urlparse(normalize_url(url))
         return parsed_url.netloc if include_port else parsed_url.hostname
 
+def thumbnail_file_name(thumbnail):
+    """ Returns the name of the file an item thumbnail is downloaded to. """
+    file_name = os.path.split(thumbnail)[1]
+    if len(file_name) > 50: #If > 50 chars, truncate to last 30 chars
+        file_name = file_name[-30:]
+    return file_name
+
 def _is_http_url(url):
     if url:
         return urlparse.urlparse(url).scheme in ['http', 'https']
 
+def _read_response(resp, headers):
+    """ Reads a response body, decompressing it as it's read if gzip encoded. """
+    return ''.join(_iter_response(resp, headers))
+
+def _iter_response(resp, headers, block_size=DOWNLOAD_BLOCK_SIZE):
+    """ Yields the blocks of a response body, decompressed incrementally if
+    gzip encoded (so the compressed body is never held in memory). """
+    decompressor = None
+    if headers.get('Content-Encoding') == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        block = resp.read(block_size)
+        if not block:
+            break
+        if decompressor:
+            block = decompressor.decompress(block)
+            if not block:
+                continue
+        yield block
+    if decompressor:
+        block = decompressor.flush()
+        if block:
+            yield block
+
+def _iter_json_array(blocks, key, ensure_ascii=True):
+    """ Yields the elements of the key array in a JSON object (i.e.
+    {"operationalLayers": [...], ...}) read from an iterable of text blocks.
+    Only the current element (or skipped value) is held in memory. Raises
+    PortalError if the object is a portal error. """
+    decoder = _json.JSONDecoder()
+    blocks = iter(blocks)
+    state = {'buf': '', 'pos': 0, 'eof': False}
+
+    def read(min_length=1):
+        # Drop the consumed text, and read until min_length characters are
+        # buffered (or the end of the data is reached)
+        state['buf'] = state['buf'][state['pos']:]
+        state['pos'] = 0
+        while len(state['buf']) < min_length and not state['eof']:
+            try:
+                state['buf'] += next(blocks)
+            except StopIteration:
+                state['eof'] = True
+        return len(state['buf']) >= min_length
+
+    def next_char():
+        # Returns the next non-whitespace character (without consuming it)
+        while True:
+            buf, pos = state['buf'], state['pos']
+            while pos < len(buf) and buf[pos] in ' \t\n\r':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not read():
+                raise ValueError('Unexpected end of JSON data')
+
+    def expect(chars):
+        char = next_char()
+        if char not in chars:
+            raise ValueError('Expected ' + ' or '.join(chars) + ' but found ' + char)
+        state['pos'] += 1
+        return char
+
+    def decode_value():
+        # Values that are cut off at the end of the buffer fail to decode
+        # (or, for numbers, end at the end of the buffer); read at least twice
+        # as much and try again, so large values are only rescanned a few times
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buf'], state['pos'])
+                if end < len(state['buf']) or state['eof']:
+                    state['pos'] = end
+                    return value
+            except ValueError:
+                if state['eof']:
+                    raise
+            read(2 * (len(state['buf']) - state['pos']) + 1)
+
+    def elements():
+        expect('{')
+        if next_char() == '}':
+            return
+        while True:
+            name = decode_value()
+            expect(':')
+            if name == key:
+                expect('[')
+                if next_char() == ']':
+                    return
+                while True:
+                    yield decode_value()
+                    if expect(',]') == ']':
+                        return
+            value = decode_value()
+            if name == 'error' and isinstance(value, dict):
+                raise PortalError(unicode_to_ascii(value.get('message', 'Unknown Error')))
+            if expect(',}') == '}':
+                return
+
+    for value in elements():
+        yield unicode_to_ascii(value) if ensure_ascii else value
+
+    # Read the rest of the data (so the connection can be reused)
+    for block in blocks:
+        pass
+
+def _read_portal_info_file():
+    """ Returns the portal info cache from PORTAL_INFO_CACHE_FILE, without
+    expired entries (an empty dict if it can't be read). """
+    try:
+        with open(PORTAL_INFO_CACHE_FILE) as f:
+            cache = _json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    now = time.time()
+    return dict((key, info) for key, info in cache.iteritems()
+                if isinstance(info, dict)
+                and now - info.get('time', 0) <= PORTAL_INFO_CACHE_TTL)
+
+def _write_portal_info_file(cache):
+    """ Writes the portal info cache to PORTAL_INFO_CACHE_FILE (readable
+    by the current user only), replacing it in one step. """
+    temp_path = PORTAL_INFO_CACHE_FILE + '.' + str(os.getpid()) + '.tmp'
+    try:
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            _json.dump(cache, f)
+        if os.name == 'nt' and os.path.exists(PORTAL_INFO_CACHE_FILE):
+            os.remove(PORTAL_INFO_CACHE_FILE)
+        os.rename(temp_path, PORTAL_INFO_CACHE_FILE)
+    except (IOError, OSError):
+        _log.debug('Unable to write portal info cache ' + PORTAL_INFO_CACHE_FILE)
+
+def _sort_search_results(results, sort_field, sort_order):
+    """ Sorts search results by a field the way the portal does: strings
+    case-insensitively, and results without a value last. """
+    def sort_key(result):
+        value = result.get(sort_field)
+        if isinstance(value, basestring):
+            return value.lower()
+        return value
+    with_value = [result for result in results
+                  if result.get(sort_field) is not None]
+    without_value = [result for result in results
+                     if result.get(sort_field) is None]
+    with_value.sort(key=sort_key, reverse=(sort_order.lower() == 'desc'))
+    return with_value + without_value
+
+def _is_environment_proxied(url):
+    """ Returns true if urllib2 would send a request for the URL through a
+    proxy configured in the environment (i.e. the https_proxy variable). """
+    parsed_url = urlparse.urlparse(url)
+    return parsed_url.scheme in urllib.getproxies() and \
+        not urllib.proxy_bypass(parsed_url.hostname)
+
 def portal_time(dt):
     """ Turns a UTC datetime object into portal's date/time string format."""
     return '000000' + str(timegm(dt.timetuple()) * 1000)
@@ -2527,7 +3813,40 @@ def unicode_to_ascii(data):
         return data
 
 def _remove_non_ascii(s):
-    return ''.join(i for i in s if ord(i) < 128)
+    return _NON_ASCII_RE.sub('', s)
+
+# Non-ascii bytes, and \u escapes of non-ascii characters that aren't
+# themselves escaped (preceded by an odd number of backslashes)
+_NON_ASCII_RE = re.compile(r'[\x80-\xff]+')
+_NON_ASCII_JSON_RE = re.compile(r'[\x80-\xff]+|(?<!\\)((?:\\\\)*)\\u'
+                                r'(?:00[89a-fA-F]|0[1-9a-fA-F][0-9a-fA-F]|'
+                                r'[1-9a-fA-F][0-9a-fA-F]{2})[0-9a-fA-F]')
+
+def _json_loads(data, ensure_ascii=True):
+    """ Parses JSON. If ensure_ascii is true, returns the same result as
+    unicode_to_ascii(json.loads(data)), but converts the strings while
+    parsing: non-ascii characters are removed from the JSON text first. """
+    if not ensure_ascii:
+        if _json_ascii_str and isinstance(data, str):
+            data = data.decode('utf8')
+        return _json.loads(data)
+    if isinstance(data, unicode):
+        data = data.encode('utf8')
+    data = _NON_ASCII_JSON_RE.sub(lambda match: match.group(1) or '', data)
+    if _json_ascii_str:
+        return _json.loads(data)
+    return _ascii_value(_json.loads(data, object_pairs_hook=_ascii_pairs))
+
+def _ascii_pairs(pairs):
+    # Nested objects have already been converted by the time they're passed
+    return dict((str(key), _ascii_value(value)) for key, value in pairs)
+
+def _ascii_value(value):
+    if isinstance(value, unicode):
+        return str(value)
+    if isinstance(value, list):
+        return [_ascii_value(v) for v in value]
+    return value
 
 def _tostr(obj):
     if not obj:
@@ -2552,38 +3871,63 @@ class HTTPSClientAuthHandler(urllib2.HTTPSHandler):
         return httplib.HTTPSConnection(host, key_file=self.key, cert_file=self.cert)
 
 # Based on recipe 18.7 in O'Reilly's Python Cookbook:
-# Caching Objects with a FIFO (or LRU) Pruning Strategy
+# Caching Objects with a FIFO (or LRU) Pruning Strategy. The entries are kept
+# in an ordered dict (least recently used first), so lookups, inserts and
+# deletes are O(1). Thread-safe; lookups are counted as hits or misses.
 class LRUCache(object, UserDict.DictMixin):
     def __init__(self, num_entries=100, dct=()):
         self.num_entries = num_entries
-        self.dct = dict(dct)
-        self.lst = []
+        self.dct = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        for key, value in dict(dct).iteritems():
+            self[key] = value
     def __repr__(self):
         return '%r(%r%r)' % (
-        self.__class__.__name__, self.num_entries, self.dct)
+        self.__class__.__name__, self.num_entries, dict(self.dct))
     def copy(self):
         return self.__class__(self.num_entries, self.dct)
     def keys(self):
-        return list(self.lst)
+        with self._lock:
+            return self.dct.keys()
+    def __len__(self):
+        return len(self.dct)
+    def __iter__(self):
+        return iter(self.keys())
+    def __contains__(self, key):
+        return key in self.dct
+    def has_key(self, key):
+        return key in self.dct
     def __getitem__(self, key):
-        if key in self.dct:
-            self.lst.remove(key)
-        else:
-            raise KeyError
-        self.lst.append(key)
-        return self.dct[key]
+        with self._lock:
+            try:
+                value = self.dct.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self.dct[key] = value
+            self.hits += 1
+            return value
     def __setitem__(self, key, value):
-        dct = self.dct
-        lst = self.lst
-        if key in dct:
-            lst.remove(key)
-        dct[key] = value
-        lst.append(key)
-        if len(lst) > self.num_entries:
-            del dct[lst.pop(0)]
+        with self._lock:
+            dct = self.dct
+            if key in dct:
+                del dct[key]
+            dct[key] = value
+            if len(dct) > self.num_entries:
+                dct.popitem(last=False)
     def __delitem__(self, key):
-        self.dct.pop(key)
-        self.lst.remove(key)
+        with self._lock:
+            del self.dct[key]
+    def peek(self, key, default=None):
+        """ Returns the value without marking it as used or counting it. """
+        return self.dct.get(key, default)
+    def stats(self):
+        """ Returns the hits, misses and size of the cache. """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self.dct), 'num_entries': self.num_entries}
 
 # This function is a workaround to deal with what's typically described as a
 # problem with the web server closing a connection. This is problem
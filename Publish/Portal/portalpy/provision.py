@@ -14,16 +14,21 @@
 
 """ The portalpy provisioning package for working with the ArcGIS Online API."""
 
+import collections
 import copy
 import csv
 import json
 import logging
 import os
+import Queue
 import shutil
 import tempfile
 
+from multiprocessing.pool import ThreadPool
+
 from portalpy import TEXT_BASED_ITEM_TYPES, FILE_BASED_ITEM_TYPES, PortalError,\
-                     unicode_to_ascii
+                     unicode_to_ascii, thumbnail_file_name, \
+                     MULTIPART_UPLOAD_THRESHOLD, DOWNLOAD_BLOCK_SIZE
 
 ITEM_COPY_PROPERTIES = ['title', 'type', 'typekeywords', 'description', 'tags',
                         'snippet', 'extent', 'spatialreference', 'name',
@@ -36,12 +41,20 @@ GROUP_EXTRACT_PROPERTIES = ['id'] + GROUP_COPY_PROPERTIES
 
 clean_temp_files = True
 
+# Stream the data of file-based items from the source portal straight into
+# the request that adds the item to the target portal, instead of through a
+# file in the copy directory. Data of unknown length, or larger than
+# MULTIPART_UPLOAD_THRESHOLD (uploaded in parts), is still written to disk.
+stream_item_data = True
+
 _log = logging.getLogger(__name__)
 
 
 def copy_items(items, source, target, target_user, target_folder=None,
-               relationships=None, work_dir=tempfile.gettempdir()):
-    """ Copy items from the source portal to the target portal."""
+               relationships=None, work_dir=tempfile.gettempdir(),
+               max_workers=4):
+    """ Copy items from the source portal to the target portal. Up to
+    max_workers items are copied at a time."""
     if not target.is_logged_in():
         raise PortalError('Must be logged into target portal to copy')
 
@@ -55,16 +68,11 @@ def copy_items(items, source, target, target_user, target_folder=None,
     copy_dir = tempfile.mkdtemp(prefix='copy_items_',
                                 dir=unicode_to_ascii(work_dir))
     try:
-        # Copy the items
-        copied_items = _copy_items(items, source, target, target_user,
-                                   target_folder_id, None, copy_dir)
-
-        # Copy the related items (if specified)
-        if relationships:
-            related_items = _copy_relationships(copied_items, source, target,
-                                                target_user, target_folder_id, relationships,
-                                                copy_dir)
-            copied_items.update(related_items)
+        # Copy the items, and the related items (if specified)
+        folder_items = [(item, target_folder_id) for item in items]
+        copied_items = _copy_items(folder_items, source, target, target_user,
+                                   relationships, target_folder_id, copy_dir,
+                                   max_workers)
 
     finally:
         if clean_temp_files:
@@ -73,8 +81,10 @@ def copy_items(items, source, target, target_user, target_folder=None,
     return copied_items
 
 def copy_user_contents(source, source_user, target, target_user, ids=None,
-                       relationships=None, work_dir=tempfile.gettempdir()):
-    """ Copy a user's items from the source portal to the target portal."""
+                       relationships=None, work_dir=tempfile.gettempdir(),
+                       max_workers=4):
+    """ Copy a user's items from the source portal to the target portal. Up
+    to max_workers items are copied at a time."""
     if not source.is_logged_in():
         raise PortalError('Must be logged into source portal to copy a '\
                           + 'user\'s contents')
@@ -89,23 +99,19 @@ def copy_user_contents(source, source_user, target, target_user, ids=None,
     copy_dir = tempfile.mkdtemp(prefix='copy_user_content_',
                                 dir=unicode_to_ascii(work_dir))
     try:
-        # Copy the items in the root folder
-        copied_items = _copy_items(root_items, source, target, target_user, None,
-                                   ids, copy_dir)
-
         # Loop over all of the folders in the source portal, and get or create
         # the corresponding folder in the target portal
+        folder_items = [(item, None) for item in root_items]
         for folder_id, folder_title, items in folders:
             target_folder_id = _get_or_create_folder(target, target_user, folder_title)
-            copied_folder_items = _copy_items(items, source, target, target_user,
-                                              target_folder_id, ids, copy_dir)
-            copied_items.update(copied_folder_items)
+            folder_items.extend((item, target_folder_id) for item in items)
+        if ids:
+            folder_items = [(item, target_folder_id) for item, target_folder_id
+                            in folder_items if item['id'] in ids]
 
-        # Copy the related items (if specified)
-        if relationships:
-            related_items = _copy_relationships(copied_items, source, target,
-                                                target_user, None, relationships, copy_dir)
-            copied_items.update(related_items)
+        # Copy the items, and the related items (if specified)
+        copied_items = _copy_items(folder_items, source, target, target_user,
+                                   relationships, None, copy_dir, max_workers)
 
     finally:
         if clean_temp_files:
@@ -113,23 +119,131 @@ def copy_user_contents(source, source_user, target, target_user, ids=None,
 
     return copied_items
 
-def _copy_items(items, source, target, target_user, target_folder_id, ids,
-                copy_dir):
+def _copy_items(folder_items, source, target, target_user, relationships,
+                related_folder_id, copy_dir, max_workers):
+    """ Copies the (item, target folder id) tuples, and the items related to
+    them (into related_folder_id), with a pool of max_workers threads. An item
+    is copied after the items it's related to (the destinations of its
+    relationships), and each relationship is added as soon as both of its
+    items have been copied. Returns a dict of source to target item ids. """
+    items = collections.OrderedDict((item['id'], (item, target_folder_id))
+                                    for item, target_folder_id in folder_items)
+    edges = []
+    if relationships:
+        edges = _related_items_graph(items, source, relationships,
+                                     related_folder_id, max_workers)
+
+    # Track the items each item is waiting for, and the relationships to add
+    # once an item has been copied
+    waiting_for = dict((item_id, set()) for item_id in items)
+    dependents = collections.defaultdict(list)
+    item_edges = collections.defaultdict(list)
+    for edge in edges:
+        origin_id, dest_id, rel_type = edge
+        item_edges[origin_id].append(edge)
+        if dest_id != origin_id:
+            item_edges[dest_id].append(edge)
+            if dest_id not in waiting_for[origin_id]:
+                waiting_for[origin_id].add(dest_id)
+                dependents[dest_id].append(origin_id)
+    ready = collections.deque(item_id for item_id in items
+                              if not waiting_for[item_id])
+    blocked = set(item_id for item_id in items if waiting_for[item_id])
+    finished = set()
     copied_items = dict()
-    for item in items:
-        itemid = item['id']
-        if not ids or itemid in ids:
-            target_itemid = _copy_item(item, source, target, target_user,
-                                       target_folder_id, None, copy_dir)[0]
-            if target_itemid:
-                copied_items[itemid] = target_itemid
+    completed = Queue.Queue()
+
+    def copy(item_id):
+        item, target_folder_id = items[item_id]
+        try:
+            return item_id, _copy_item(item, source, target, target_user,
+                                       target_folder_id, copy_dir), None
+        except Exception as e:
+            return item_id, None, e
+
+    pool = ThreadPool(max(1, max_workers))
+    running = 0
+    try:
+        while ready or blocked or running:
+
+            # If the remaining items are related in a cycle, start one anyway
+            if not ready and not running:
+                item_id = next(item_id for item_id in items
+                               if item_id in blocked)
+                blocked.remove(item_id)
+                ready.append(item_id)
+
+            while ready:
+                pool.apply_async(copy, (ready.popleft(),),
+                                 callback=completed.put)
+                running += 1
+
+            item_id, target_item_id, error = completed.get()
+            running -= 1
+            if error:
+                raise error
+            finished.add(item_id)
+            if target_item_id:
+                copied_items[item_id] = target_item_id
+
+            # Add the relationships whose items have both been copied
+            for origin_id, dest_id, rel_type in item_edges[item_id]:
+                if origin_id not in finished or dest_id not in finished:
+                    continue
+                if dest_id not in copied_items:
+                    _log.warning('Unable to copy related item ' + dest_id\
+                                 + ' to target portal')
+                elif origin_id in copied_items:
+                    target.add_relationship(target_user,
+                                            copied_items[origin_id],
+                                            copied_items[dest_id], rel_type)
+
+            # Start the items that were only waiting for this item
+            for dependent_id in dependents[item_id]:
+                waiting_for[dependent_id].discard(item_id)
+                if not waiting_for[dependent_id] and dependent_id in blocked:
+                    blocked.remove(dependent_id)
+                    ready.append(dependent_id)
+
+    finally:
+        pool.close()
+        pool.join()
+
     return copied_items
 
-def _copy_item(item, source, target, target_user, target_folder_id,
-               relationships, copy_dir):
+def _related_items_graph(items, source, relationships, target_folder_id,
+                         max_workers):
+    """ Adds the items related to the items (recursively) to the items dict,
+    to be copied into target_folder_id, and returns the relationships as
+    (origin id, destination id, relationship type) tuples. The related items
+    of each level of the graph are requested concurrently. """
+    edges = []
+    level = list(items)
+    pool = ThreadPool(max(1, max_workers))
+    try:
+        while level:
+            next_level = []
+            for item_id, related_items in pool.imap(
+                    lambda item_id: (item_id, source.related_items(item_id,
+                                                                   relationships)),
+                    level):
+                for related_item, rel_type, rel_direction in related_items:
+                    related_id = related_item['id']
+                    edges.append((item_id, related_id, rel_type))
+                    if related_id not in items:
+                        items[related_id] = (related_item, target_folder_id)
+                        next_level.append(related_id)
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+    return edges
+
+def _copy_item(item, source, target, target_user, target_folder_id, copy_dir):
     itemid = item['id']
     item_dir = os.path.join(copy_dir, itemid)
     os.makedirs(item_dir)
+    data_file = None
     try:
 
         # Create a new items with the subset of properties we want to
@@ -140,13 +254,19 @@ def _copy_item(item, source, target, target_user, target_folder_id,
         # add it to the request. Otherwise treat it as a
         # file-based item, download it and add to the request
         # as a file
-        data_file = None
+        stream_data = False
         if item['type'] in TEXT_BASED_ITEM_TYPES:
             text = source.item_data(itemid)
             if text and len(text) > 0:
                 target_item['text'] = text
         elif item['type'] in FILE_BASED_ITEM_TYPES:
-            data_file = source.item_datad(itemid, item_dir, item.get('name'))
+            if stream_item_data and \
+                    not item.get('size') > MULTIPART_UPLOAD_THRESHOLD:
+                stream_data = True
+            else:
+                data_file = source.item_datad(itemid, item_dir,
+                                              item.get('name'),
+                                              item.get('size'))
 
         # Handle the thumbnail (if one exists)
         thumbnail_file = None
@@ -157,23 +277,41 @@ def _copy_item(item, source, target, target_user, target_folder_id,
         # Handle the metadata (if it exists)
         metadata_file = source.item_metadatad(itemid, item_dir)
 
-        # Add the item to the target portal
-        target_itemid = target.add_item(
-            target_item, data_file, thumbnail_file, metadata_file,
-            target_user, unicode_to_ascii(target_folder_id))
+        # Open the data stream last, so it isn't left waiting. The request
+        # adding the item needs the length of the data; if it isn't known
+        # (or is too large to send in one request), spill it to disk.
+        spill_path = os.path.join(item_dir,
+                                  unicode_to_ascii(item.get('name') or 'data'))
+        if stream_data:
+            data_stream = source.item_data_stream(itemid)
+            if data_stream.length is None or \
+                    data_stream.length > MULTIPART_UPLOAD_THRESHOLD:
+                data_file = _spill_stream(data_stream, spill_path)
+            else:
+                data_file = data_stream
+
+        # Add the item to the target portal. A stream can only be sent once,
+        # so if the request fails (i.e. the token expired while it was being
+        # sent), spill the data to disk and add the item again
+        try:
+            target_itemid = target.add_item(
+                target_item, data_file, thumbnail_file, metadata_file,
+                target_user, unicode_to_ascii(target_folder_id))
+        except PortalError as e:
+            if not hasattr(data_file, 'read'):
+                raise
+            _log.info('Adding item ' + itemid + ' from a stream failed (' \
+                      + str(e) + '), adding it from a file')
+            data_file.close()
+            data_file = _spill_stream(source.item_data_stream(itemid),
+                                      spill_path)
+            target_itemid = target.add_item(
+                target_item, data_file, thumbnail_file, metadata_file,
+                target_user, unicode_to_ascii(target_folder_id))
         if target_itemid:
             _log.info('Copied item ' + itemid + ' in source portal '
                       + 'to ' + target_itemid + ' in target portal')
-
-            # We're returning a mapping of source id to target (dict).
-            # But before we return, handle the related items (if specified)
-            copied_items = dict({itemid: target_itemid})
-            if relationships:
-                related_items = _copy_relationships(copied_items, source,
-                                                    target, target_user, target_folder_id,
-                                                    relationships, copy_dir)
-                copied_items.update(related_items)
-            return target_itemid, copied_items
+            return target_itemid
 
         else:
             _log.warning('Item ' + itemid + ' was not copied '\
@@ -186,43 +324,22 @@ def _copy_item(item, source, target, target_user, target_folder_id,
 
     # Clean up the item directories as we go
     finally:
+        if hasattr(data_file, 'close'):
+            data_file.close()
         if clean_temp_files:
             shutil.rmtree(item_dir)
 
-    # Return an empty tuple, if for some reason the copy didn't happen
-    return None, None
-
-def _copy_relationships(items, source, target, target_user, target_folder_id,
-                        relationships, work_dir):
-    all_copied_rel_items = dict()
-    for source_id, target_id in items.items():
-
-        # Get the items related to source_id in the source portal
-        related_items = source.related_items(source_id, relationships)
-        for source_rel_item, rel_type, rel_direction in related_items:
-            source_rel_id = source_rel_item['id']
-
-            # See if it's already been copied to the target
-            target_rel_id = items.get(source_rel_id)
-            if not target_rel_id:
-
-                # If not, then copy it to the target
-                target_rel_id, copied_rel_items =\
-                _copy_item(source_rel_item, source, target, target_user,
-                           target_folder_id, relationships, work_dir)
-                if copied_rel_items:
-                    all_copied_rel_items.update(copied_rel_items)
-                    items.update(copied_rel_items)
-
-            # Add the relationship
-            if target_rel_id:
-                target.add_relationship(target_user, target_id, target_rel_id,
-                                        rel_type)
-            else:
-                _log.warning('Unable to copy related item ' + source_rel_id\
-                             + ' to target portal')
+    # Return None, if for some reason the copy didn't happen
+    return None
 
-    return all_copied_rel_items
+def _spill_stream(stream, path):
+    """ Writes a stream to a file (in blocks) and closes it. Returns the path. """
+    try:
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, DOWNLOAD_BLOCK_SIZE)
+    finally:
+        stream.close()
+    return path
 
 def _select_properties(properties, property_names):
     selected = dict()
@@ -308,12 +425,17 @@ def copy_groups(groups, source, target, target_owner=None,
 
 class JSONSerializer(object):
     """ A class for serializing users, groups, and items to JSON."""
-    def __init__(self, data=True, metadata=True, thumbnails=True, indent=None):
-        """ The JSONSerializer constructor. """
+    def __init__(self, data=True, metadata=True, thumbnails=True, indent=None,
+                 max_workers=4, skip_unchanged=True):
+        """ The JSONSerializer constructor. Items are serialized max_workers
+        at a time. If skip_unchanged is true, items that are already serialized
+        (with the same modified time) are skipped. """
         self.data = data
         self.metadata = metadata
         self.thumbnails = thumbnails
         self.indent = indent
+        self.max_workers = max_workers
+        self.skip_unchanged = skip_unchanged
 
     def serialize_groups(self, groups, path, portal=None):
         """ Serialize groups to JSON. """
@@ -348,45 +470,89 @@ class JSONSerializer(object):
         elif not os.path.isdir(base_dir):
             base_dir = os.path.dirname(base_dir)
 
-        for item in items:
-            item_dir = os.path.join(base_dir, item['id'])
-            if not os.path.exists(item_dir):
-                os.makedirs(item_dir)
-
-            # Write the thumbnail to a file (per the name specified in the item)
-            if self.thumbnails:
-                if not portal:
-                    raise PortalError('The "portal" argument is required to  '\
-                                      + 'download thumbnails')
-                thumbnail = item.get('thumbnail')
-                if thumbnail:
-                    portal.item_thumbnaild(item['id'], item_dir, thumbnail)
-
-            # Handle the data
-            if self.data:
-                if not portal:
-                    raise PortalError('The "portal" argument is required to  '\
-                                      + 'download data')
-                if item['type'] in TEXT_BASED_ITEM_TYPES:
-                    text = portal.item_data(item['id'])
-                    if text and len(text) > 0:
-                        item['text'] = text
-                elif item['type'] in FILE_BASED_ITEM_TYPES:
-                    data_dir = os.path.join(item_dir, 'data')
-                    if not os.path.exists(data_dir):
-                        os.makedirs(data_dir)
-                    portal.item_datad(item['id'], data_dir, item.get('name'))
-
-            # Write the metadata to a file
-            if self.metadata:
-                if not portal:
-                    raise PortalError('The "portal" argument is required to  '\
-                                      + 'download metadata')
-                portal.item_metadatad(item['id'], item_dir)
+        # Serialize the items (and download their files) concurrently
+        pool = ThreadPool(max(1, self.max_workers))
+        try:
+            skipped = sum(pool.imap_unordered(
+                lambda item: self._serialize_item(item, base_dir, portal),
+                items))
+        finally:
+            pool.close()
+            pool.join()
+        if skipped:
+            _log.info('Skipped ' + str(skipped) + ' unchanged items')
+
+    def _serialize_item(self, item, base_dir, portal):
+        """ Serializes an item to a folder (named by the id) in base_dir.
+        Returns true if the item was skipped because it was unchanged. """
+        item_dir = os.path.join(base_dir, item['id'])
+        if not os.path.exists(item_dir):
+            os.makedirs(item_dir)
+        elif self.skip_unchanged and self._is_serialized(item, item_dir):
+            return True
+
+        # Write the thumbnail to a file (per the name specified in the item)
+        if self.thumbnails:
+            if not portal:
+                raise PortalError('The "portal" argument is required to  '\
+                                  + 'download thumbnails')
+            thumbnail = item.get('thumbnail')
+            if thumbnail:
+                portal.item_thumbnaild(item['id'], item_dir, thumbnail)
 
-            # Write the item itself to a file (do this at the end, as the data
-            # will get writen to the item if the item type is text)
-            self.to_file(item, os.path.join(item_dir, 'item.json'))
+        # Handle the data
+        if self.data:
+            if not portal:
+                raise PortalError('The "portal" argument is required to  '\
+                                  + 'download data')
+            if item['type'] in TEXT_BASED_ITEM_TYPES:
+                # Items without data get empty text, which records that the
+                # data was fetched (and is dropped when deserializing)
+                item['text'] = portal.item_data(item['id']) or ''
+            elif item['type'] in FILE_BASED_ITEM_TYPES:
+                data_dir = os.path.join(item_dir, 'data')
+                if not os.path.exists(data_dir):
+                    os.makedirs(data_dir)
+                portal.item_datad(item['id'], data_dir, item.get('name'),
+                                  item.get('size'))
+
+        # Write the metadata to a file
+        if self.metadata:
+            if not portal:
+                raise PortalError('The "portal" argument is required to  '\
+                                  + 'download metadata')
+            portal.item_metadatad(item['id'], item_dir)
+
+        # Write the item itself to a file (do this at the end, as the data
+        # will get writen to the item if the item type is text, and so an
+        # item.json means the files were all written)
+        self.to_file(item, os.path.join(item_dir, 'item.json'))
+        return False
+
+    def _is_serialized(self, item, item_dir):
+        """ Returns true if the item has been serialized to item_dir with the
+        same modified time, and its thumbnail and data (files, or text written
+        to the item) still exist. """
+        try:
+            with open(os.path.join(item_dir, 'item.json')) as infile:
+                serialized_item = json.load(infile)
+        except (IOError, ValueError):
+            return False
+        if item.get('modified') is None \
+                or serialized_item.get('modified') != item['modified']:
+            return False
+        thumbnail = item.get('thumbnail')
+        if self.thumbnails and thumbnail and not os.path.exists(
+                os.path.join(item_dir, thumbnail_file_name(thumbnail))):
+            return False
+        if self.data and item['type'] in TEXT_BASED_ITEM_TYPES \
+                and serialized_item.get('text') is None:
+            return False
+        if self.data and item['type'] in FILE_BASED_ITEM_TYPES \
+                and not os.path.exists(os.path.join(item_dir, 'data',
+                                                    item.get('name') or 'data')):
+            return False
+        return True
 
     def to_file(self, data, path):
         with open(path, 'w') as outfile:
@@ -413,12 +579,12 @@ class JSONDeserializer(object):
         item_dirs = os.listdir(path)
         for item_dir in item_dirs:
             item_path = os.path.join(base_dir, item_dir, 'item.json')
-            item = self.from_file(item_path)
+            item = self._item_from_file(item_path)
 
             thumbnail_path = None
             thumbnail = item.get('thumbnail')
             if thumbnail:
-                thumbnail_filename = os.path.basename(thumbnail)
+                thumbnail_filename = thumbnail_file_name(thumbnail)
                 thumbnail_path = os.path.join(base_dir, item_dir, thumbnail_filename)
 
             data_path = None
@@ -446,12 +612,12 @@ class JSONDeserializer(object):
             return
         
         item_path = os.path.join(path, 'item.json')
-        item = self.from_file(item_path)
+        item = self._item_from_file(item_path)
 
         thumbnail_path = None
         thumbnail = item.get('thumbnail')
         if thumbnail:
-            thumbnail_filename = os.path.basename(thumbnail)
+            thumbnail_filename = thumbnail_file_name(thumbnail)
             thumbnail_path = os.path.join(path, thumbnail_filename)
 
         data_path = None
@@ -473,6 +639,13 @@ class JSONDeserializer(object):
         with open(path, 'r') as infile:
             return json.load(infile)
 
+    def _item_from_file(self, path):
+        # Items without data are serialized with empty text
+        item = self.from_file(path)
+        if item.get('text') == '':
+            del item['text']
+        return item
+
 class CSVSerializer(object):
     """ A class for serializing users, groups, and items to CSV."""
     def __init__(self, data=True, metadata=True, thumbnails=True):
@@ -20,7 +20,7 @@
 #               target Ops Server ArcGIS Server.
 #
 #==============================================================================
-import sys, os, time, traceback
+import sys, os, time, traceback, tempfile
 from datetime import datetime
 
 # Add "Root folder"\SupportFiles to sys path inorder to import
@@ -53,6 +53,10 @@ doRegDataStores = True
 doPublishServiceDefs = True
 doUnregDataStores = True
 
+# File that keeps the database connection strings encrypted by the ArcGIS
+# Server site, so later runs don't have to encrypt them again
+dbConnStrCacheFile = os.path.join(tempfile.gettempdir(), 'PublishToOpsServer_dbconnstrs.json')
+
 #publishingDBServer = OpsServerConfig.publishingDBServer
 databases = OpsServerConfig.databasesToCreate
 dbuser = "sde"
@@ -390,6 +394,7 @@ try:
     # Register data stores
     # ---------------------------------------------------------------------
     if doRegDataStores:
+        DataStore.set_db_connection_str_cache_file(dbConnStrCacheFile)
         success, dataStorePaths = registerDataStores()
         if not success:
             totalSuccess = success
@@ -28,13 +28,16 @@ sys.path.append(os.path.join(os.path.dirname(
     os.path.dirname(os.path.dirname(sys.argv[0]))), "SupportFiles"))
 
 from AGSRestFunctions import getServiceList
-from AGSRestFunctions import stopStartServices
-from AGSRestFunctions import getServiceStatus
+from AGSRestFunctions import stopStartServicesBatch
+from AGSRestFunctions import getServicesStatus
+from AGSRestFunctions import AdminSession
+from AGSRestFunctions import restartServicesRolling
 
 validTypes = ["MapServer", "ImageServer", "GeometryServer", "GeocodeServer",
               "GPServer", "FeatureServer", "GlobeServer", "GeoDataServer"]
 userServiceStr = None
 serviceList = None
+servicesPerCluster = 1
 scriptName = os.path.basename(sys.argv[0])
 
 # ---------------------------------------------------------------------
@@ -42,14 +45,16 @@ scriptName = os.path.basename(sys.argv[0])
 # ---------------------------------------------------------------------
 
 if len(sys.argv) < 7:
-    print '\n' + scriptName + ' <Server_Name> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Start|Stop> {{folder/}service.type,...| Service_List_File}'
+    print '\n' + scriptName + ' <Server_Name> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Start|Stop|Restart> {{folder/}service.type,...| Service_List_File} {Services_Per_Cluster}'
     print '\nWhere:'
     print '\n\t<Server_Name> (required) server name.'
     print '\n\t<Server_Port> (required) server port; if not using server port enter #'
     print '\n\t<User_Name> (required) user with admin or publisher permission.'
     print '\n\t<Password> (required) user password.'
     print '\n\t<Use_SSL: Yes|No> (required) Flag indicating if ArcGIS Server requires HTTPS.'
-    print '\n\t<Start|Stop> (required) action to perform.'
+    print '\n\t<Start|Stop|Restart> (required) action to perform.'
+    print '\t\tRestart - rolling restart; services are restarted in waves within each cluster. A wave'
+    print '\t\tis complete when the REST endpoint of each of its services answers.'
     
     print '\n\t{{folder/}service.type,...| Service_List_File} (optional) to Start|Stop specific services, specify'
     print '\t\tcomma delimited list of services or specify a path to a file containing {{folder/}service.type entries.'
@@ -66,7 +71,11 @@ if len(sys.argv) < 7:
     print '\t\t\tMyServices.MapServer'
     print '\t\t\tUtilities/Geometry.GeometryServer'
     print '\t\t\tMyServices.MapServer,Utilities/Geometry.GeometryServer'
-    print '\t\t\t"MyServices.MapServer, Utilities/Geometry.GeometryServer"\n'
+    print '\t\t\t"MyServices.MapServer, Utilities/Geometry.GeometryServer"'
+    print '\n\t\tSpecify # to Start|Stop|Restart all services.'
+    
+    print '\n\t{Services_Per_Cluster} (optional) number of services restarted at the same time in each'
+    print '\t\tcluster when using the Restart action (default 1).\n'
     sys.exit(1)
 
 serverName = sys.argv[1]
@@ -75,8 +84,14 @@ userName = sys.argv[3]
 passWord = sys.argv[4]
 useSSL = sys.argv[5]
 serviceAction = sys.argv[6]
-if len(sys.argv) == 8:
-    userServiceStr = sys.argv[7]
+if len(sys.argv) >= 8:
+    if sys.argv[7].strip() <> '#':
+        userServiceStr = sys.argv[7]
+if len(sys.argv) >= 9:
+    if not sys.argv[8].strip().isdigit() or int(sys.argv[8]) < 1:
+        print "Error: Services_Per_Cluster must be a positive integer.\n"
+        sys.exit(1)
+    servicesPerCluster = int(sys.argv[8])
 
 if useSSL.strip().lower() in ['yes', 'ye', 'y']:
     useSSL = True
@@ -128,7 +143,7 @@ if userServiceStr is not None:
 if serverPort.strip() == '#':
     serverPort = None
             
-validActionList = ["stop", "start"]
+validActionList = ["stop", "start", "restart"]
 isActionValid = False
 
 # Check if user specific valid actions
@@ -141,14 +156,18 @@ if not isActionValid:
     print "Valid actions are:" + str(validActionList) + "\n"
     sys.exit(1)
 
+session = None
 try:
     startTime = datetime.now()
+    
+    # Share one token and a pool of keep-alive connections across all requests
+    session = AdminSession(serverName, serverPort, userName, passWord, useSSL)
  
     # ---------------------------------------------------------------------
     # Get list of all services/or user specified list
     # ---------------------------------------------------------------------
     if not serviceList:
-        serviceList = getServiceList(serverName, serverPort, userName, passWord, useSSL)
+        serviceList = getServiceList(serverName, serverPort, userName, passWord, useSSL, session)
 
     # Remove hosted services from list since these can't be started/stopped
     print '\nRemoving "Hosted" services from service list; these services can not be started/stopped.'
@@ -169,17 +188,23 @@ try:
         print "\n{}".format("-" * 110)
         print "- Check status of specified services...\n"
         
+        # Get the status of all services; uses one request per folder when
+        # the server supports the folder report resource
+        serviceStatuses = getServicesStatus(serverName, serverPort, userName, passWord, serviceList, useSSL, session)
+        
         for service in serviceList:
-            folder = None
-            serviceNameAndType = service
+            serviceStatus = serviceStatuses[service]
             service = service.replace("//", "/")
-            if service.find("/") > 0:
-                folder = service.split("/")[0]
-                serviceNameAndType = service.split("/")[1]
             
-            serviceStatus = getServiceStatus(serverName, serverPort, userName, passWord, folder, serviceNameAndType, useSSL)
             realTimeState = serviceStatus.get("realTimeState")
-            if realTimeState:
+            if realTimeState and serviceAction.upper() == "RESTART":
+                # Only restart services that are running
+                if realTimeState.upper() == "STARTED":
+                    print "{:.<70}will {} the service.".format(service, serviceAction.lower())
+                    modServiceList.append(service)
+                else:
+                    print "{:.<70}not started; will not restart the service.".format(service)
+            elif realTimeState:
                 if realTimeState.upper() == actionStatusMap[serviceAction.upper()]:
                     print "{:.<70}already at requested state '{}'.".format(service, realTimeState)
                 else:
@@ -190,14 +215,23 @@ try:
 
         
     # ---------------------------------------------------------------------
-    # Start/Stop all services
+    # Start/Stop/Restart all services
     # ---------------------------------------------------------------------
     if len(modServiceList) > 0:
         print "\n{}".format("-" * 110)
         print "- Will attempt to " + serviceAction.lower() + " the specified services...\n"
         
-        stopStartServices(serverName, serverPort, userName, passWord, \
-                          serviceAction.title(), modServiceList, useSSL)
+        if serviceAction.upper() == "RESTART":
+            results = restartServicesRolling(serverName, serverPort, userName, passWord, \
+                          modServiceList, useSSL, session, servicesPerCluster)
+        else:
+            results = stopStartServicesBatch(serverName, serverPort, userName, passWord, \
+                          serviceAction.title(), modServiceList, useSSL, session)
+        
+        failedServices = [x for x in modServiceList if not results[x]['success']]
+        if len(failedServices) > 0:
+            totalSuccess = False
+            print "\n\t*ERROR: Could not " + serviceAction.lower() + " the following services: " + str(failedServices)
         
             
 except:
@@ -216,6 +250,8 @@ except:
     print pymsg + "\n"
 
 finally:
+    if session:
+        session.close()
     endTime = datetime.now()
     print
     print "Done."
@@ -62,6 +62,18 @@ import urllib
 import urllib2
 import json
 import time
+import datetime
+import httplib
+import sys
+import socket
+import errno
+import threading
+import urlparse
+import Queue
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from JobRunner import poll_jobs
+from JobRunner import is_gp_job_finished
 
 # Version of Python installed with 10.4 now validates SSL
 # certificate. The try/except/else block was added to ignore
@@ -77,6 +89,14 @@ else:
     # Handle target environment that doesn't support HTTPS verification
     ssl._create_default_https_context = _create_unverified_https_context
 
+# Largest page size of the logs/query operation, and the default page size
+# (which leaves room to double the page when many messages share a time)
+LOG_QUERY_MAX_PAGE_SIZE = 10000
+LOG_QUERY_PAGE_SIZE = 5000
+
+# Socket errors raised by a keep-alive connection the server has closed
+STALE_CONNECTION_ERRORS = (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE)
+
 def gentoken(server, port, adminUser, adminPass, useSSL=True, expiration=60):
     #Re-usable function to get a token required for Admin changes
     
@@ -120,6 +140,159 @@ def gentoken2(server_url, user_name, user_pass, expiration=60):
         return token['token']
 
 
+class AdminSession(object):
+    ''' Persistent administrative session with an ArcGIS Server site.
+    Keeps a pool of keep-alive connections per server and caches the token,
+    generating a new one only when the current one is close to expiring.
+    An AdminSession can be passed as the "token" parameter of any function
+    in this module, i.e.:
+
+        session = AdminSession(server, port, adminUser, adminPass, useSSL)
+        services = getServiceList(server, port, adminUser, adminPass, useSSL, session)
+        for service in services:
+            folder, serviceNameType = parseService(service)
+            getServiceStatus(server, port, adminUser, adminPass, folder, serviceNameType, useSSL, session)
+        session.close()
+    '''
+
+    def __init__(self, server, port, adminUser, adminPass, useSSL=True,
+                 expiration=60, maxConnections=10, refreshMargin=120, timeout=None):
+        self.server = server
+        self.port = port
+        self.adminUser = adminUser
+        self.adminPass = adminPass
+        self.useSSL = useSSL
+        self.expiration = expiration          # token lifetime, in minutes
+        self.maxConnections = maxConnections  # idle connections kept per host
+        self.refreshMargin = refreshMargin    # seconds before expiry to renew
+        self.timeout = timeout
+
+        self._token = None
+        self._tokenExpires = 0
+        self._tokenLock = threading.Lock()
+        self._pool = {}
+        self._poolLock = threading.Lock()
+
+    def __str__(self):
+        # Allows the session to be formatted into URLs in place of a token
+        return self.token
+
+    @property
+    def token(self):
+        ''' Return the cached token, generating a new one if it is about to expire. '''
+        with self._tokenLock:
+            if self._token is None or time.time() >= self._tokenExpires - self.refreshMargin:
+                self._token = gentoken(self.server, self.port, self.adminUser,
+                                       self.adminPass, self.useSSL, self.expiration)
+                self._tokenExpires = time.time() + (self.expiration * 60)
+            return self._token
+
+    def open(self, url, data=None):
+        ''' Open the url using a pooled connection; returns a file-like response
+        object compatible with urllib2.urlopen. If data is not None the request
+        is sent as a POST.
+        '''
+
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.netloc)
+        path = urlparse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+
+        method = 'GET'
+        headers = {'Connection': 'keep-alive'}
+        if data is not None:
+            method = 'POST'
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        # A pooled connection may have been closed by the server since it
+        # was last used; if so, retry once on a new connection. Only retry if
+        # the request couldn't be sent, or the connection was closed or reset
+        # before a status line came back, as the server hasn't processed the
+        # request then (a timeout or an error reading the body isn't retried).
+        for attempt in range(2):
+            conn, reused = self._getConnection(key)
+            try:
+                conn.request(method, path, data, headers)
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            try:
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if reused and attempt == 0 and \
+                        (isinstance(e, httplib.BadStatusLine) or
+                         getattr(e, 'errno', None) in STALE_CONNECTION_ERRORS):
+                    continue
+                raise
+            break
+
+        try:
+            body = response.read()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._releaseConnection(key, conn)
+
+        if response.status in (301, 302, 303, 307):
+            # Let urllib2 deal with redirects
+            if data is None:
+                return urllib2.urlopen(url)
+            return urllib2.urlopen(url, data)
+
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, StringIO(body))
+
+        return urllib.addinfourl(StringIO(body), response.msg, url, response.status)
+
+    def close(self):
+        ''' Close all pooled connections. '''
+        with self._poolLock:
+            for connections in self._pool.values():
+                for conn in connections:
+                    conn.close()
+            self._pool = {}
+
+    def _getConnection(self, key):
+        with self._poolLock:
+            connections = self._pool.get(key)
+            if connections:
+                return connections.pop(), True
+
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        return conn, False
+
+    def _releaseConnection(self, key, conn):
+        with self._poolLock:
+            connections = self._pool.setdefault(key, [])
+            if len(connections) < self.maxConnections:
+                connections.append(conn)
+                return
+        conn.close()
+
+
+def _urlopen(url, data=None, token=None):
+    ''' Open the url through the AdminSession if one was passed in as the
+    token, otherwise fall back to urllib2.
+    '''
+
+    if isinstance(token, AdminSession):
+        return token.open(url, data)
+    if data is None:
+        return urllib2.urlopen(url)
+    return urllib2.urlopen(url, data)
+
+
 def modifyLogs(server, port, adminUser, adminPass, clearLogs, logLevel, useSSL=True, token=None):
     ''' Function to clear logs and modify log settings.
     Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
@@ -135,14 +308,14 @@ def modifyLogs(server, port, adminUser, adminPass, clearLogs, logLevel, useSSL=T
     # Clear existing logs
     if clearLogs:
         clearLogs = "{}{}{}/arcgis/admin/logs/clean?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)
-        status = urllib2.urlopen(clearLogs, ' ').read()    
+        status = _urlopen(clearLogs, ' ', token).read()    
     
         if 'success' in status:
             print "Cleared log files"
     
     # Get the current logDir, maxErrorReportsCount and maxLogFileAge as we dont want to modify those
     currLogSettings_url = "{}{}{}/arcgis/admin/logs/settings?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), token)
-    logSettingProps = json.loads(urllib2.urlopen(currLogSettings_url, ' ').read())['settings'] 
+    logSettingProps = json.loads(_urlopen(currLogSettings_url, ' ', token).read())['settings'] 
     
     # Place the current settings, along with new log setting back into the payload
     logLevel_dict = {      "logDir": logSettingProps['logDir'],
@@ -154,7 +327,11 @@ def modifyLogs(server, port, adminUser, adminPass, clearLogs, logLevel, useSSL=T
     # Modify the logLevel
     log_encode = urllib.urlencode(logLevel_dict)     
     logLevel_url = "{}{}{}/arcgis/admin/logs/settings/edit?f=json&token={}".format(getProtocol(useSSL), server, getPort(port), token)
-    logStatus = json.loads(urllib.urlopen(logLevel_url, log_encode).read())
+    try:
+        logStatus = json.loads(_urlopen(logLevel_url, log_encode, token).read())
+    except urllib2.HTTPError as e:
+        # Read the error response body, as urllib.urlopen used to
+        logStatus = json.loads(e.read())
     
     
     if logStatus['status'] == 'success':
@@ -165,6 +342,177 @@ def modifyLogs(server, port, adminUser, adminPass, clearLogs, logLevel, useSSL=T
     return
         
         
+def parseLogTime(value):
+    ''' Convert local time string (YYYY-MM-DDTHH:MM:SS) or milliseconds
+    since epoch to milliseconds since epoch. '''
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    dt = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    return int(time.mktime(dt.timetuple()) * 1000)
+
+def parseLogTimeRange(fromTime, toTime):
+    ''' Convert the oldest (fromTime) and most recent (toTime) time of a log
+    query to milliseconds since epoch; see parseLogTime.
+    Raises ValueError if a time is not valid or fromTime is after toTime.
+    Returns tuple of fromTime, toTime. '''
+    fromTime = parseLogTime(fromTime)
+    toTime = parseLogTime(toTime)
+    if fromTime > toTime:
+        raise ValueError('<From_Time> must be older than <To_Time>.')
+    return fromTime, toTime
+
+def queryLogs(server, port, adminUser, adminPass, startTime, endTime, level='WARNING', services='*', machines='*',
+              useSSL=True, token=None, pageSize=LOG_QUERY_PAGE_SIZE):
+    ''' Function to query the server logs; generator that yields one page (list) of log messages at a time.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    startTime = Most recent time to query from (milliseconds since epoch)
+    endTime = Oldest time to query to (milliseconds since epoch)
+    level = SEVERE|WARNING|INFO|FINE|VERBOSE|DEBUG
+    services = "*" or list of services in the <folder>/<name>.<type> notation
+    machines = "*" or list of machine names
+    If a token exists, you can pass one in for use.
+    '''
+
+    if token is None:
+        token = gentoken(server, port, adminUser, adminPass, useSSL)
+
+    logFilter = json.dumps({'services': services, 'machines': machines, 'server': '*'})
+    URL = "{}{}{}/arcgis/admin/logs/query?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)
+
+    # The next page starts at the time of the oldest message of the previous
+    # page, so the messages with that time are returned again (in the same
+    # order); skip as many of them as were already returned.
+    boundaryTime = None
+    boundaryCount = 0
+    querySize = pageSize
+
+    while True:
+        query_encode = urllib.urlencode({'startTime': startTime, 'endTime': endTime, 'level': level,
+                                         'filterType': 'json', 'filter': logFilter, 'pageSize': querySize})
+        response = json.loads(_urlopen(URL, query_encode, token).read())
+
+        if response.get('status') == 'error':
+            raise Exception('Log query failed: {}'.format(response.get('messages')))
+
+        messages = response.get('logMessages', [])
+        page = []
+        skip = boundaryCount
+        for message in messages:
+            if skip and message.get('time') == boundaryTime:
+                skip -= 1
+                continue
+            page.append(message)
+
+        if page:
+            yield page
+
+        nextStartTime = response.get('endTime')
+        if not response.get('hasMore') or nextStartTime is None:
+            break
+
+        if nextStartTime == boundaryTime and not page:
+            # The page only holds messages with the boundary time that were
+            # already returned; query that time again with a larger page
+            if querySize < LOG_QUERY_MAX_PAGE_SIZE:
+                querySize = min(querySize * 2, LOG_QUERY_MAX_PAGE_SIZE)
+                continue
+            print 'WARNING: more than {} log messages at time {}; skipping the rest of them.'.format(
+                querySize, boundaryTime)
+            nextStartTime -= 1
+
+        boundaryTime = nextStartTime
+        boundaryCount = len([message for message in messages if message.get('time') == boundaryTime])
+        querySize = pageSize
+        startTime = nextStartTime
+
+def queryLogsConcurrent(server, port, adminUser, adminPass, startTime, endTime, level='WARNING', services='*',
+                        machines='*', useSSL=True, token=None, pageSize=LOG_QUERY_PAGE_SIZE, windows=8,
+                        maxWorkers=4):
+    ''' Function to query the server logs, splitting the time range into windows that are queried concurrently;
+    generator that yields one page (list) of log messages at a time, in the order the pages arrive.
+    At most 2 * maxWorkers pages are held in memory at once.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    startTime = Most recent time to query from (milliseconds since epoch)
+    endTime = Oldest time to query to (milliseconds since epoch)
+    See queryLogs for remaining parameters.
+    If a token exists, you can pass one in for use.
+    '''
+
+    if maxWorkers < 1:
+        raise ValueError('maxWorkers must be 1 or more, not {}'.format(maxWorkers))
+
+    # Share one token and connection pool across all workers
+    session = None
+    if token is None:
+        token = session = AdminSession(server, port, adminUser, adminPass, useSSL,
+                                       maxConnections=maxWorkers)
+
+    # Split the time range into non-overlapping windows (most recent first)
+    startTime = int(startTime)
+    endTime = int(endTime)
+    windows = max(1, min(windows, startTime - endTime + 1))
+    windowSize = (startTime - endTime + 1) // windows
+    windowQueue = Queue.Queue()
+    for i in range(windows):
+        windowStart = startTime - (i * windowSize)
+        windowEnd = windowStart - windowSize + 1
+        if i == windows - 1:
+            windowEnd = endTime
+        windowQueue.put((windowStart, windowEnd))
+
+    pages = Queue.Queue(maxsize=2 * maxWorkers)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        # Queue the item, unless the consumer stops first; returns True if queued
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _worker():
+        try:
+            while not stop.is_set():
+                try:
+                    windowStart, windowEnd = windowQueue.get_nowait()
+                except Queue.Empty:
+                    break
+                for page in queryLogs(server, port, adminUser, adminPass, windowStart, windowEnd, level,
+                                      services, machines, useSSL, token, pageSize):
+                    if not _put(page):
+                        break
+            _put(done)
+        except Exception:
+            # Pass the exception with its traceback to the consumer
+            _put(sys.exc_info())
+
+    workers = []
+    for i in range(min(maxWorkers, windows)):
+        worker = threading.Thread(target=_worker)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    try:
+        running = len(workers)
+        while running:
+            page = pages.get()
+            if page is done:
+                running -= 1
+            elif isinstance(page, tuple):
+                raise page[0], page[1], page[2]
+            else:
+                yield page
+    finally:
+        stop.set()
+        if session:
+            session.close()
+
 def createFolder(server, port, adminUser, adminPass, folderName, folderDescription, useSSL=True, token=None):
     ''' Function to create a folder
     Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
@@ -184,7 +532,7 @@ def createFolder(server, port, adminUser, adminPass, folderName, folderDescripti
     
     folder_encode = urllib.urlencode(folderProp_dict)            
     create = "{}{}{}/arcgis/admin/services/createFolder?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = urllib2.urlopen(create, folder_encode).read()
+    status = _urlopen(create, folder_encode, token).read()
 
     
     if 'success' in status:
@@ -230,7 +578,7 @@ def renameService(server, port, adminUser, adminPass, service, newName, useSSL=T
     
     rename_encode = urllib.urlencode(renameService_dict)            
     rename = "{}{}{}/arcgis/admin/services/renameService?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = urllib2.urlopen(rename, rename_encode ).read()
+    status = _urlopen(rename, rename_encode, token).read()
     
     
     if 'success' in status:
@@ -276,7 +624,7 @@ def stopStartServices(server, port, adminUser, adminPass, stopStart, serviceList
     # modify the services(s)    
     for service in serviceList:
         op_service_url = "{}{}{}/arcgis/admin/services/{}/{}?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), service, stopStart, token)
-        status = urllib2.urlopen(op_service_url, ' ').read()
+        status = _urlopen(op_service_url, ' ', token).read()
         
         if 'success' in status:
             print (str(service) + " === " + str(stopStart))
@@ -285,7 +633,273 @@ def stopStartServices(server, port, adminUser, adminPass, stopStart, serviceList
     
     return
         
-        
+def stopStartServicesBatch(server, port, adminUser, adminPass, stopStart, serviceList, useSSL=True, token=None,
+                           batchSize=25, maxWorkers=0, waitTimeout=600, pollInterval=2):
+    ''' Function to stop or start services in bulk and wait for them to reach the requested state.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    stopStart = Stop|Start
+    serviceList = List of services. A service must be in the {folder//}<name>.<type> notation
+    batchSize = Number of services sent in each call to the services/startServices or services/stopServices operation.
+    maxWorkers = If greater than 0, send one start/stop call per service using this many concurrent requests
+        instead of the batch operations; also used for the number of concurrent status requests (default 8).
+    waitTimeout = Number of seconds to wait for the services to reach the requested state.
+    If a token exists, you can pass one in for use.
+    Returns dictionary keyed by service of {'success': True|False, 'state': realTimeState,
+        'seconds': seconds to reach requested state, 'message': error message}.
+    '''
+
+    if stopStart.upper() not in ('START', 'STOP'):
+        raise ValueError('stopStart must be Start or Stop, not {}'.format(stopStart))
+
+    # Number of concurrent requests; maxWorkers if sending one call per service
+    workers = maxWorkers if maxWorkers > 0 else 8
+
+    # Share one token and connection pool across all concurrent requests
+    session = None
+    if token is None:
+        token = session = AdminSession(server, port, adminUser, adminPass, useSSL,
+                                       maxConnections=workers)
+
+    targetState = {'START': 'STARTED', 'STOP': 'STOPPED'}[stopStart.upper()]
+    results = dict((service, {'success': False, 'state': None, 'seconds': None, 'message': None})
+                   for service in serviceList)
+    submitTimes = {}
+
+    pool = ThreadPool(workers)
+    try:
+        # Submit the start/stop requests
+        if maxWorkers > 0:
+            def _submit(service):
+                submitTimes[service] = time.time()
+                return service, _stopStartService(server, port, stopStart, service, useSSL, token)
+
+            for service, status in pool.imap_unordered(_submit, serviceList):
+                if status.get('status') != 'success':
+                    results[service]['message'] = status
+        else:
+            for i in range(0, len(serviceList), batchSize):
+                batch = serviceList[i:i + batchSize]
+                batchTime = time.time()
+                for service in batch:
+                    submitTimes[service] = batchTime
+
+                status = _stopStartServiceBatch(server, port, stopStart, batch, useSSL, token)
+                if status.get('status') != 'success':
+                    # Operation is not available or failed; fall back to one
+                    # request per service for this batch
+                    for service, status in pool.imap_unordered(
+                            lambda s: (s, _stopStartService(server, port, stopStart, s, useSSL, token)), batch):
+                        if status.get('status') != 'success':
+                            results[service]['message'] = status
+
+        # Poll the state of all pending services together
+        pending = [service for service in serviceList if results[service]['message'] is None]
+        deadline = time.time() + waitTimeout
+
+        while pending:
+            statuses = getServicesStatus(server, port, adminUser, adminPass, pending,
+                                         useSSL, token, workers)
+            for service, status in statuses.iteritems():
+                state = status.get('realTimeState')
+                results[service]['state'] = state
+                if state and state.upper() == targetState:
+                    results[service]['success'] = True
+                    results[service]['seconds'] = time.time() - submitTimes[service]
+                    print '{} === {} ({:.1f} seconds)'.format(service, stopStart, results[service]['seconds'])
+            pending = [service for service in pending if not results[service]['success']]
+
+            if pending:
+                if time.time() >= deadline:
+                    for service in pending:
+                        results[service]['message'] = 'Timed out waiting for state {}; state is {}'.format(
+                            targetState, results[service]['state'])
+                    break
+                time.sleep(pollInterval)
+    finally:
+        pool.close()
+        pool.join()
+        if session:
+            session.close()
+
+    for service in serviceList:
+        if results[service]['message'] is not None:
+            print '{} === {} failed: {}'.format(service, stopStart, results[service]['message'])
+
+    return results
+
+def _stopStartService(server, port, stopStart, service, useSSL, token):
+    ''' Send start/stop request for a single service; returns the response json. '''
+
+    folder, serviceNameType = parseService(service)
+    if folder is not None:
+        serviceNameType = folder + "/" + serviceNameType
+    URL = "{}{}{}/arcgis/admin/services/{}/{}?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), serviceNameType, stopStart.lower(), token)
+    try:
+        return json.loads(_urlopen(URL, ' ', token).read())
+    except Exception as e:
+        return {'status': 'error', 'messages': [str(e)]}
+
+def _stopStartServiceBatch(server, port, stopStart, serviceList, useSSL, token):
+    ''' Send services to the services/startServices or services/stopServices operation; returns the response json. '''
+
+    services = []
+    for service in serviceList:
+        folder, serviceNameType = parseService(service)
+        serviceName, serviceType = serviceNameType.rsplit('.', 1)
+        services.append({'folderName': folder or '', 'serviceName': serviceName, 'type': serviceType})
+
+    services_encode = urllib.urlencode({'services': json.dumps({'services': services})})
+    URL = "{}{}{}/arcgis/admin/services/{}Services?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), stopStart.lower(), token)
+    try:
+        return json.loads(_urlopen(URL, services_encode, token).read())
+    except Exception as e:
+        return {'status': 'error', 'messages': [str(e)]}
+
+def restartServicesRolling(server, port, adminUser, adminPass, serviceList, useSSL=True, token=None,
+                           servicesPerCluster=1, waitTimeout=600, pollInterval=2):
+    ''' Function to restart services in waves, one lane per cluster.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    serviceList = List of services. A service must be in the {folder//}<name>.<type> notation
+    servicesPerCluster = Number of services restarted at the same time in each cluster.
+    Each wave is stopped, started and is only complete once the REST endpoint of
+    every service in the wave answers; the next wave of the cluster starts immediately after.
+    Clusters are restarted concurrently.
+    If a token exists, you can pass one in for use.
+    Returns dictionary keyed by service of {'success': True|False, 'cluster': clusterName,
+        'seconds': seconds until the service answered, 'message': error message}.
+    '''
+
+    session = None
+    if token is None:
+        token = session = AdminSession(server, port, adminUser, adminPass, useSSL)
+    try:
+        return _restartServicesRolling(server, port, adminUser, adminPass, serviceList, useSSL, token,
+                                       servicesPerCluster, waitTimeout, pollInterval)
+    finally:
+        if session:
+            session.close()
+
+def _restartServicesRolling(server, port, adminUser, adminPass, serviceList, useSSL, token,
+                            servicesPerCluster, waitTimeout, pollInterval):
+
+    def _cluster(service):
+        folder, serviceNameType = parseService(service)
+        try:
+            info = getServiceInfo(server, port, adminUser, adminPass, folder, serviceNameType, useSSL, token)
+            return service, info.get('clusterName'), None
+        except Exception as e:
+            return service, None, str(e)
+
+    results = {}
+    lanes = {}
+    pool = ThreadPool(8)
+    try:
+        for service, clusterName, error in pool.imap(_cluster, serviceList):
+            results[service] = {'success': False, 'cluster': clusterName, 'seconds': None, 'message': error}
+            if error is None:
+                lanes.setdefault(clusterName, []).append(service)
+    finally:
+        pool.close()
+        pool.join()
+
+    clusters = getClusters(server, port, adminUser, adminPass, useSSL, token)
+    if clusters is None:
+        raise Exception('Could not get the clusters of the site.')
+    clusterNames = [cluster['clusterName'] for cluster in clusters]
+    for clusterName in lanes:
+        if clusterName not in clusterNames:
+            print 'WARNING: cluster {} of services {} does not exist.'.format(clusterName, lanes[clusterName])
+
+    def _answers(service):
+        # A stopped service returns an error; a secured service that is
+        # running answers with a token required/invalid token error.
+        folder, serviceNameType = parseService(service)
+        try:
+            serviceJson = getServiceJSON(server, port, adminUser, adminPass, folder, serviceNameType, useSSL, token)
+        except Exception:
+            return False
+        error = serviceJson.get('error')
+        return error is None or error.get('code') in (403, 498, 499)
+
+    def _stopStartWave(stopStart, wave):
+        # Stop or start the services of a wave and wait for them to reach
+        # the requested state; sets the message of the services that don't
+        targetState = {'START': 'STARTED', 'STOP': 'STOPPED'}[stopStart.upper()]
+        status = _stopStartServiceBatch(server, port, stopStart, wave, useSSL, token)
+        if status.get('status') != 'success':
+            # Operation is not available or failed; one request per service
+            for service in wave:
+                status = _stopStartService(server, port, stopStart, service, useSSL, token)
+                if status.get('status') != 'success':
+                    results[service]['message'] = status
+
+        pending = [service for service in wave if results[service]['message'] is None]
+        deadline = time.time() + waitTimeout
+        while pending:
+            for service in list(pending):
+                folder, serviceNameType = parseService(service)
+                try:
+                    state = getServiceStatus(server, port, adminUser, adminPass, folder,
+                                             serviceNameType, useSSL, token).get('realTimeState')
+                except Exception:
+                    state = None
+                if state and state.upper() == targetState:
+                    pending.remove(service)
+            if pending:
+                if time.time() >= deadline:
+                    for service in pending:
+                        results[service]['message'] = 'Timed out waiting for state {}'.format(targetState)
+                    break
+                time.sleep(pollInterval)
+
+    def _restartLane(clusterName):
+        lane = lanes[clusterName]
+        try:
+            for i in range(0, len(lane), servicesPerCluster):
+                wave = lane[i:i + servicesPerCluster]
+                print 'Cluster {}: restarting {}'.format(clusterName, ', '.join(wave))
+                waveStart = time.time()
+
+                # Only start the services that were stopped
+                _stopStartWave('Stop', wave)
+                _stopStartWave('Start', [service for service in wave if results[service]['message'] is None])
+
+                # Health gate; wait for each service's REST endpoint to answer
+                pending = [service for service in wave if results[service]['message'] is None]
+                deadline = time.time() + waitTimeout
+                while pending:
+                    for service in list(pending):
+                        if _answers(service):
+                            results[service]['success'] = True
+                            results[service]['seconds'] = time.time() - waveStart
+                            pending.remove(service)
+                    if pending:
+                        if time.time() >= deadline:
+                            for service in pending:
+                                results[service]['message'] = 'Timed out waiting for REST endpoint to answer'
+                            break
+                        time.sleep(pollInterval)
+        except Exception as e:
+            # Fail the rest of this lane only
+            for service in lane:
+                if not results[service]['success'] and results[service]['message'] is None:
+                    results[service]['message'] = str(e)
+
+        for service in lane:
+            if results[service]['message'] is not None:
+                print '{} === Restart failed: {}'.format(service, results[service]['message'])
+
+    pool = ThreadPool(max(1, len(lanes)))
+    try:
+        for _ in pool.imap_unordered(_restartLane, lanes.keys()):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
 def registerSOE(server, port, adminUser, adminPass, itemID, useSSL=True, token=None):
     ''' Function to upload a file to the REST Admin
     Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
@@ -300,7 +914,7 @@ def registerSOE(server, port, adminUser, adminPass, itemID, useSSL=True, token=N
     SOE_encode = urllib.urlencode({"id":itemID})   
     
     register = "{}{}{}/arcgis/admin/services/types/extensions/register?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = urllib2.urlopen(register, SOE_encode).read()
+    status = _urlopen(register, SOE_encode, token).read()
     
     if 'success' in status:
         print "Succesfully registed SOE"
@@ -326,7 +940,7 @@ def getServiceList(server, port, adminUser, adminPass, useSSL=True, token=None):
     folder = ''    
     URL = "{}{}{}/arcgis/admin/services{}?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), folder, token)    
 
-    serviceList = json.loads(urllib2.urlopen(URL).read())
+    serviceList = json.loads(_urlopen(URL, token=token).read())
 
     # Build up list of services at the root level
     for single in serviceList["services"]:
@@ -340,7 +954,7 @@ def getServiceList(server, port, adminUser, adminPass, useSSL=True, token=None):
     if len(folderList) > 0:
         for folder in folderList:                                              
             URL = "{}{}{}/arcgis/admin/services/{}?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), folder, token)    
-            fList = json.loads(urllib2.urlopen(URL).read())
+            fList = json.loads(_urlopen(URL, token=token).read())
             
             for single in fList["services"]:
                 services.append(folder + "//" + single['serviceName'] + '.' + single['type'])                
@@ -359,7 +973,7 @@ def getServerInfo(server, port, adminUser, adminPass, useSSL=True, token=None):
     # Helper function to return JSON for a specific end point
     #    
         openURL = URL + endURL + "?token={}&f=json".format(token)    
-        status = urllib2.urlopen(openURL, '').read()    
+        status = _urlopen(openURL, '', token).read()    
         outJson = json.loads(status)   
         
         return outJson       
@@ -405,7 +1019,6 @@ def getServerInfo(server, port, adminUser, adminPass, useSSL=True, token=None):
     jLicense = getJson(URL, "system/licenses", token)
     report += "License is: {} / {}\n".format(jLicense["edition"]["name"], jLicense["level"]["name"])    
     if jLicense["edition"]["canExpire"] == True:
-        import datetime
         d = datetime.date.fromtimestamp(jLicense["edition"]["expiration"] // 1000) #time in milliseconds since epoch
         report += "License set to expire: {}\n".format(datetime.datetime.strftime(d, '%Y-%m-%d'))        
     else:
@@ -465,7 +1078,7 @@ def getServiceInfo(server, port, adminUser,  adminPass, folder, serviceNameAndTy
     
     URL = "{}{}{}/arcgis/admin/services/{}?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), folderServerNameType, token)    
 
-    serviceInfo = json.loads(urllib2.urlopen(URL).read())
+    serviceInfo = json.loads(_urlopen(URL, token=token).read())
     
     return serviceInfo
 
@@ -483,7 +1096,7 @@ def getServiceInfo2(server_url, user_name,  user_pass, servicename_and_type, tok
     serviceInfo = {}       
     URL = "{}/admin/services/{}?token={}&f=json".format(server_url, servicename_and_type, token)    
 
-    serviceInfo = json.loads(urllib2.urlopen(URL).read())
+    serviceInfo = json.loads(_urlopen(URL, token=token).read())
     
     return serviceInfo
 
@@ -505,10 +1118,100 @@ def getServiceStatus(server, port, adminUser,  adminPass, folder, serviceNameAnd
     serviceInfo = {}       
     URL = "{}{}{}/arcgis/admin/services/{}/status?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), folderServerNameType, token)    
 
-    serviceInfo = json.loads(urllib2.urlopen(URL).read())
+    serviceInfo = json.loads(_urlopen(URL, token=token).read())
     
     return serviceInfo
 
+def getFolderReport(server, port, adminUser, adminPass, folder=None, useSSL=True, token=None, parameters=None):
+    ''' Function to get the report of all services in a folder (i.e. /admin/services/<folder>/report).
+    Each element of the report contains the service json and the service status.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    folder = Name of folder; None for the root folder.
+    parameters = Optional list of additional properties to include in the report (i.e. ["INSTANCES", "ITEMINFO"]).
+    If a token exists, you can pass one in for use.
+    Returns list of service reports, or None if the report resource is not available.
+    '''
+
+    if token is None:
+        token = gentoken(server, port, adminUser, adminPass, useSSL)
+
+    if folder:
+        folderPath = folder + "/"
+    else:
+        folderPath = ""
+
+    URL = "{}{}{}/arcgis/admin/services/{}report?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), folderPath, token)
+    if parameters:
+        URL += "&" + urllib.urlencode({'parameters': json.dumps(parameters)})
+
+    try:
+        report = json.loads(_urlopen(URL, token=token).read())
+    except urllib2.HTTPError:
+        return None
+
+    if report.get('status') == 'error' or 'reports' not in report:
+        return None
+
+    return report['reports']
+
+def getServicesStatus(server, port, adminUser, adminPass, serviceList, useSSL=True, token=None, maxWorkers=8):
+    ''' Function to get the status of many services.
+    Uses the folder report resource (one request per folder) when it is available
+    and requests the status of any remaining services individually.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    serviceList = List of services. A service must be in the {folder//}<name>.<type> notation
+    If a token exists, you can pass one in for use.
+    Returns dictionary of service status json keyed by service.
+    '''
+
+    # Share one token and connection pool across all concurrent requests
+    session = None
+    if token is None:
+        token = session = AdminSession(server, port, adminUser, adminPass, useSSL,
+                                       maxConnections=maxWorkers)
+
+    statuses = {}
+    folders = {}
+    for service in serviceList:
+        folder, serviceNameType = parseService(service)
+        folders.setdefault(folder, {})[serviceNameType] = service
+
+    def _report(folder):
+        try:
+            return folder, getFolderReport(server, port, adminUser, adminPass, folder, useSSL, token)
+        except Exception as e:
+            print 'WARNING: Could not get the report of folder {}: {}; getting the status of its services ' \
+                  'individually.'.format(folder or '(root)', e)
+            return folder, None
+
+    def _status(service):
+        folder, serviceNameType = parseService(service)
+        try:
+            return service, getServiceStatus(server, port, adminUser, adminPass, folder,
+                                             serviceNameType, useSSL, token)
+        except Exception as e:
+            return service, {'realTimeState': None, 'message': str(e)}
+
+    pool = ThreadPool(maxWorkers)
+    try:
+        for folder, reports in pool.imap_unordered(_report, folders.keys()):
+            for report in reports or []:
+                serviceNameType = '{}.{}'.format(report.get('serviceName'), report.get('type'))
+                service = folders[folder].get(serviceNameType)
+                if service is not None and report.get('status'):
+                    statuses[service] = report['status']
+
+        remaining = [service for service in serviceList if service not in statuses]
+        for service, status in pool.imap_unordered(_status, remaining):
+            statuses[service] = status
+    finally:
+        pool.close()
+        pool.join()
+        if session:
+            session.close()
+
+    return statuses
+
 
 def editServiceInfo(server, port, adminUser,  adminPass, folder, serviceNameAndType, serviceInfo, useSSL=True, token=None):
     ''' Function to edit service item info
@@ -530,7 +1233,7 @@ def editServiceInfo(server, port, adminUser,  adminPass, folder, serviceNameAndT
     prop_encode = urllib.urlencode({'service': updatedSvcJson})
     
     URL = "{}{}{}/arcgis/admin/services/{}/edit?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), folderServerNameType, token)    
-    status = json.loads(urllib2.urlopen(URL, prop_encode).read())
+    status = json.loads(_urlopen(URL, prop_encode, token).read())
 
     if status.get('status') == 'success':
         success = True
@@ -559,7 +1262,7 @@ def getServiceItemInfo(server, port, adminUser,  adminPass, folder, serverNameAn
     serviceItemInfo = {}       
     URL = "{}{}{}/arcgis/admin/services/{}/iteminfo?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), folderServerNameType, token)    
 
-    serviceItemInfo = json.loads(urllib2.urlopen(URL).read())
+    serviceItemInfo = json.loads(_urlopen(URL, token=token).read())
     
     return serviceItemInfo
 
@@ -576,7 +1279,7 @@ def getConfigStoreProperty(server, port, adminUser, adminPass, useSSL=True, toke
     directories = {}       
     URL = "{}{}{}/arcgis/admin/system/configstore?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), token)    
 
-    configStore = json.loads(urllib2.urlopen(URL).read())
+    configStore = json.loads(_urlopen(URL, token=token).read())
     
     return configStore[property]
 
@@ -593,7 +1296,7 @@ def getServerDirectories(server, port, adminUser, adminPass, useSSL=True, token=
     serverDirectories = {}       
     URL = "{}{}{}/arcgis/admin/system/directories?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), token)    
 
-    serverDirectories = json.loads(urllib2.urlopen(URL).read())
+    serverDirectories = json.loads(_urlopen(URL, token=token).read())
     
     return serverDirectories
 
@@ -605,7 +1308,7 @@ def getServerDirectory(server, port, adminUser, adminPass, directoryType, useSSL
     '''
     
     
-    serverDirectories = getServerDirectories(server, port, adminUser, adminPass, useSSL, token=None)
+    serverDirectories = getServerDirectories(server, port, adminUser, adminPass, useSSL, token)
     
     for serverDirectory in serverDirectories["directories"]:
         if serverDirectory["directoryType"] == directoryType.upper():
@@ -627,7 +1330,7 @@ def getDataItemInfo(server, port, adminUser,  adminPass, dataItemPath, useSSL=Tr
     dataItemInfo = {}       
     URL = "{}{}{}/arcgis/admin/data/items{}?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), dataItemPath, token)    
 
-    dataItemInfo = json.loads(urllib2.urlopen(URL).read())
+    dataItemInfo = json.loads(_urlopen(URL, token=token).read())
     
     if dataItemInfo.get('status'):
         # The 'status' key only exists if there is an error.
@@ -651,7 +1354,7 @@ def registerDataItem(server, port, adminUser, adminPass, item, useSSL=True, toke
     
     item_encode = urllib.urlencode(item)            
     URL = "{}{}{}/arcgis/admin/data/registerItem?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = json.loads(urllib2.urlopen(URL, item_encode).read())
+    status = json.loads(_urlopen(URL, item_encode, token).read())
     
     if status.get('status') == 'error':
         success = False
@@ -677,7 +1380,7 @@ def unregisterDataItem(server, port, adminUser, adminPass, itemPath, useSSL=True
     
     item_encode = urllib.urlencode(itemPath)            
     URL = "{}{}{}/arcgis/admin/data/unregisterItem?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = json.loads(urllib2.urlopen(URL, item_encode).read())
+    status = json.loads(_urlopen(URL, item_encode, token).read())
 
     if status.get('status') == 'error':
         success = False
@@ -703,7 +1406,7 @@ def validateDataItem(server, port, adminUser, adminPass, item, useSSL=True, toke
     
     item_encode = urllib.urlencode(item)            
     URL = "{}{}{}/arcgis/admin/data/validateDataItem?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = json.loads(urllib2.urlopen(URL, item_encode).read())
+    status = json.loads(_urlopen(URL, item_encode, token).read())
     
     if status.get('status') == 'success':
         success = True
@@ -724,7 +1427,7 @@ def getServicesDirectory(server, port, adminUser,  adminPass, useSSL=True, token
         token = gentoken(server, port, adminUser, adminPass, useSSL)
 
     URL = "{}{}{}/arcgis/admin/system/handlers/rest/servicesdirectory?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = json.loads(urllib2.urlopen(URL, '').read())
+    status = json.loads(_urlopen(URL, '', token).read())
     
     # If successful, the json won't contain a 'status' or 'success' key/values;
     # so test success by whether the json contains one of the services
@@ -804,7 +1507,7 @@ def editServicesDirectory(server, port, adminUser, adminPass,
     prop_encode = urllib.urlencode(prop_dict)
     
     URL = "{}{}{}/arcgis/admin/system/handlers/rest/servicesdirectory/edit?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    status = json.loads(urllib2.urlopen(URL, prop_encode).read())
+    status = json.loads(_urlopen(URL, prop_encode, token).read())
 
     if status.get('status') == 'success':
         success = True
@@ -827,7 +1530,7 @@ def getServiceTypes(server, port, adminUser, adminPass, useSSL=True, token=None)
     types = {}       
     URL = "{}{}{}/arcgis/admin/services/types?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), token)    
 
-    types = json.loads(urllib2.urlopen(URL).read())
+    types = json.loads(_urlopen(URL, token=token).read())
     
     typeList = types.get('types')
     
@@ -849,7 +1552,7 @@ def getServiceTypeExtensions(server, port, adminUser, adminPass, serviceType, us
     serviceTypeAndExtensions = {}       
     URL = "{}{}{}/arcgis/admin/services/types/{}?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), serviceType, token)    
 
-    serviceTypeAndExtensions = json.loads(urllib2.urlopen(URL).read())
+    serviceTypeAndExtensions = json.loads(_urlopen(URL, token=token).read())
     
     return serviceTypeAndExtensions
 
@@ -870,7 +1573,7 @@ def getServiceManifest(server, port, adminUser,  adminPass, folder, serverNameAn
     serviceManifest = {}       
     URL = "{}{}{}/arcgis/admin/services/{}/iteminfo/manifest/manifest.json?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), folderServerNameType, token)    
 
-    serviceManifest = json.loads(urllib2.urlopen(URL).read())
+    serviceManifest = json.loads(_urlopen(URL, token=token).read())
     
     return serviceManifest
 
@@ -885,7 +1588,7 @@ def getDBConnectionStrFromStr(server, port, adminUser, adminPass, dbConnectionSt
     in_param_dict['in_connDataType'] = 'CONNECTION_STRING'
     in_param_dict['in_inputData'] = dbConnectionString
     
-    return _getDBConnectionString(server, port, adminUser, adminPass, in_param_dict, useSSL, token=None)
+    return _getDBConnectionString(server, port, adminUser, adminPass, in_param_dict, useSSL, token)
     
 def _getDBConnectionString(server, port, adminUser, adminPass, in_param_dict, useSSL=True, token=None):
     ''' Executes "Get Database Connecting String" gp service task.
@@ -904,22 +1607,23 @@ def _getDBConnectionString(server, port, adminUser, adminPass, in_param_dict, us
     # Submit the job
     item_encode = urllib.urlencode(in_param_dict)            
     URL = "{}{}{}/arcgis/rest/services/System/PublishingTools/GPServer/Get%20Database%20Connection%20String/submitJob?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)    
-    submit_results = json.loads(urllib2.urlopen(URL, item_encode).read())
+    submit_results = json.loads(_urlopen(URL, item_encode, token).read())
 
     job_status = submit_results['jobStatus']
     job_id = submit_results['jobId']
     job_URL = "{}{}{}/arcgis/rest/services/System/PublishingTools/GPServer/Get%20Database%20Connection%20String/jobs/{}?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), job_id, token)
     
-    # Check for job completion
-    while job_status == 'esriJobSubmitted':
-        time.sleep(2)
-        job_results = json.loads(urllib2.urlopen(job_URL).read())
+    # Check for job completion; polls with backoff until the job reaches a terminal state
+    def _checkJobStatus(jobId, status):
+        return json.loads(_urlopen(job_URL, token=token).read())
+    
+    for jobId, job_results in poll_jobs({job_id: submit_results}, _checkJobStatus, is_gp_job_finished):
         job_status = job_results['jobStatus']
     
     # Check job completion status
-    if job_status == 'esriJobFailed':
+    if job_status <> 'esriJobSucceeded':
         success = False
-        msgs = job_results['messages']
+        msgs = job_results.get('messages', [])
         results = []
         for msg in msgs:
             if msg['type'] == 'esriJobMessageTypeError':
@@ -929,7 +1633,7 @@ def _getDBConnectionString(server, port, adminUser, adminPass, in_param_dict, us
         success = True
         param_URL = job_results['results']['out_connectionString']['paramUrl']
         job_results_URL = "{}{}{}/arcgis/rest/services/System/PublishingTools/GPServer/Get%20Database%20Connection%20String/jobs/{}/{}?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), job_id, param_URL, token)
-        out_connection_string = json.loads(urllib2.urlopen(job_results_URL).read())
+        out_connection_string = json.loads(_urlopen(job_results_URL, token=token).read())
         results = out_connection_string['value'].encode('ascii')
     
     return success, results
@@ -947,10 +1651,118 @@ def getClusters(server, port, adminUser, adminPass, useSSL=True, token=None):
     folder = ''    
     URL = "{}{}{}/arcgis/admin/clusters?f=pjson&token={}".format(getProtocol(useSSL), server, getPort(port), token)    
 
-    clusters = json.loads(urllib2.urlopen(URL).read())
+    clusters = json.loads(_urlopen(URL, token=token).read())
 
     return clusters.get('clusters')
 
+def createUsageReport(server, port, adminUser, adminPass, usageReport, useSSL=True, token=None):
+    ''' Function to create a usage report
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    usageReport = Usage report definition (dictionary); see the 'Add Usage Report' operation
+    of the ArcGIS Server REST Admin API.
+    If a token exists, you can pass one in for use.
+    '''
+
+    if token is None:
+        token = gentoken(server, port, adminUser, adminPass, useSSL)
+
+    report_encode = urllib.urlencode({'usagereport': json.dumps(usageReport)})
+
+    URL = "{}{}{}/arcgis/admin/usagereports/add?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), token)
+    status = json.loads(_urlopen(URL, report_encode, token).read())
+
+    if status.get('status') == 'success':
+        success = True
+    else:
+        success = False
+
+    return success, status
+
+def queryUsageReport(server, port, adminUser, adminPass, reportName, machines='*', useSSL=True, token=None):
+    ''' Function to query the data of a usage report
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    machines = "*" or list of machine names
+    If a token exists, you can pass one in for use.
+    '''
+
+    if token is None:
+        token = gentoken(server, port, adminUser, adminPass, useSSL)
+
+    filter_encode = urllib.urlencode({'filter': json.dumps({'machines': machines})})
+
+    URL = "{}{}{}/arcgis/admin/usagereports/{}/data?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), reportName, token)
+    response = json.loads(_urlopen(URL, filter_encode, token).read())
+
+    if response.get('status') == 'error':
+        raise Exception('Usage report query failed: {}'.format(response.get('messages')))
+
+    return response.get('report')
+
+def deleteUsageReport(server, port, adminUser, adminPass, reportName, useSSL=True, token=None):
+    ''' Function to delete a usage report
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    If a token exists, you can pass one in for use.
+    '''
+
+    if token is None:
+        token = gentoken(server, port, adminUser, adminPass, useSSL)
+
+    URL = "{}{}{}/arcgis/admin/usagereports/{}/delete?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), reportName, token)
+    status = json.loads(_urlopen(URL, urllib.urlencode({}), token).read())
+
+    return status.get('status') == 'success'
+
+def getServiceUsage(server, port, adminUser, adminPass, serviceList, metrics, since='LAST_WEEK', fromTime=None,
+                    toTime=None, aggregationInterval=None, useSSL=True, token=None):
+    ''' Function to get usage statistics of services; a temporary usage report is created,
+    queried and deleted.
+    Requires Admin user/password, as well as server and port (necessary to construct token if one does not exist).
+    serviceList = list of services in the format returned by getServiceList
+    metrics = list of usage metrics (i.e. RequestCount, RequestAvgResponseTime, ServiceActiveInstances)
+    since = LAST_DAY|LAST_WEEK|LAST_MONTH|CUSTOM; for CUSTOM specify fromTime and toTime
+    (milliseconds since epoch)
+    aggregationInterval = Length of the report time slices in minutes (server default if None)
+    Returns dictionary {'time-slices': [...], 'services': {service: {metric: [values per time slice]}}}
+    If a token exists, you can pass one in for use.
+    '''
+
+    if token is None:
+        token = gentoken(server, port, adminUser, adminPass, useSSL)
+
+    resourceURIs = {}
+    for service in serviceList:
+        resourceURIs['services/' + service.replace('//', '/')] = service
+
+    reportName = 'usage_{}'.format(int(time.time() * 1000))
+    usageReport = {'reportname': reportName,
+                   'since': since,
+                   'queries': [{'resourceURIs': resourceURIs.keys(), 'metrics': metrics}],
+                   'metadata': {'temp': True}}
+    if since == 'CUSTOM':
+        usageReport['from'] = fromTime
+        usageReport['to'] = toTime
+    if aggregationInterval:
+        usageReport['aggregationInterval'] = aggregationInterval
+
+    success, status = createUsageReport(server, port, adminUser, adminPass, usageReport, useSSL, token)
+    if not success:
+        raise Exception('Could not create usage report: {}'.format(status))
+
+    try:
+        report = queryUsageReport(server, port, adminUser, adminPass, reportName, useSSL=useSSL, token=token)
+    finally:
+        deleteUsageReport(server, port, adminUser, adminPass, reportName, useSSL, token)
+
+    usage = {'time-slices': report.get('time-slices', []), 'services': {}}
+    for reportData in report.get('report-data', []):
+        for metricData in reportData:
+            service = resourceURIs.get(metricData.get('resourceURI'))
+            if service is None:
+                continue
+            usage['services'].setdefault(service, {})[metricData.get('metric-type')] = metricData.get('data', [])
+
+    return usage
+
 def parseService(service):
     # Parse folder and service nameType
     folder = None
@@ -985,7 +1797,7 @@ def getHostedServiceDefinition(server, port, adminUser,  adminPass, folder, serv
     else:
         folderServerNameType = serviceNameAndType
     
-    serviceInfo = getServiceInfo(server, port, adminUser, adminPass, folder, serviceNameAndType)     
+    serviceInfo = getServiceInfo(server, port, adminUser, adminPass, folder, serviceNameAndType, useSSL, token)     
     
     definition = {}
     definition['capabilities'] = serviceInfo['capabilities']
@@ -1027,7 +1839,7 @@ def updateHostedFeatureServiceDefinition(server, port, adminUser,  adminPass, se
     print 'update function - service: {}'.format(service)
     URL = "{}{}{}/arcgis/rest/admin/services/{}/updateDefinition?token={}&f=json".format(getProtocol(useSSL), server, getPort(port), service.replace('.', '/'), token)
 
-    status = json.loads(urllib2.urlopen(URL, prop_encode).read())
+    status = json.loads(_urlopen(URL, prop_encode, token).read())
 
     if status.get('success'):
         success = True
@@ -1056,6 +1868,6 @@ def getServiceJSON(server, port, adminUser,  adminPass, folder, serviceNameAndTy
     
     URL = "{}{}{}/arcgis/rest/services/{}?f=pjson".format(getProtocol(useSSL), server, getPort(port), folderServerNameType)
 
-    service_json = json.loads(urllib2.urlopen(URL, '').read())
+    service_json = json.loads(_urlopen(URL, '', token).read())
     
     return service_json
\ No newline at end of file
@@ -19,7 +19,7 @@
 #
 #==============================================================================
 
-import sys, os, traceback
+import sys, os, traceback, json, hashlib, threading
 from AGSRestFunctions import registerDataItem as _register
 from AGSRestFunctions import unregisterDataItem as _unregister
 from AGSRestFunctions import validateDataItem as _validateitem
@@ -56,6 +56,72 @@ _postgres_db_conn_template_str = "SERVER=serverReplaceStr;" + \
     "DB_CONNECTION_PROPERTIES=serverReplaceStr;DATABASE=dbReplaceStr;USER=userReplaceStr;PASSWORD=" + \
     "passwordReplaceStr;VERSION=sde.DEFAULT;AUTHENTICATION_MODE=DBMS"
 
+# Cache of encrypted database connection strings. Keys are SHA-256 digests of
+# the ArcGIS Server site and plain connection string so that neither the cache
+# nor the optional cache file contain the plain database passwords; the values
+# are encrypted by the ArcGIS Server site.
+_db_conn_str_cache = {}
+_db_conn_str_cache_file = None
+_db_conn_str_cache_lock = threading.Lock()
+
+def set_db_connection_str_cache_file(file_path):
+    ''' Keep encrypted database connection strings in file so they are reused
+        across runs. Loads any connection strings already in the file.
+    '''
+    global _db_conn_str_cache_file
+    
+    with _db_conn_str_cache_lock:
+        _db_conn_str_cache_file = file_path
+        if file_path and os.path.exists(file_path):
+            f = open(file_path, 'r')
+            try:
+                _db_conn_str_cache.update(json.load(f))
+            finally:
+                f.close()
+
+def clear_db_connection_str_cache():
+    ''' Remove all encrypted database connection strings from the cache (and cache file). '''
+    with _db_conn_str_cache_lock:
+        _db_conn_str_cache.clear()
+        if _db_conn_str_cache_file and os.path.exists(_db_conn_str_cache_file):
+            os.remove(_db_conn_str_cache_file)
+
+def get_encrypted_db_connection_str(server, port, user, password, db_conn_str, useSSL=True, token=None):
+    ''' Return encrypted database connection string, running the "Get Database Connection
+        String" gp service only if the connection string has not already been encrypted
+        by the ArcGIS Server site.
+        Returns tuple: success(True|False) and encrypted connection string or error messages.
+    '''
+    key = hashlib.sha256('{}|{}|{}'.format(server.lower(), port, db_conn_str)).hexdigest()
+    
+    with _db_conn_str_cache_lock:
+        if key in _db_conn_str_cache:
+            return True, _db_conn_str_cache[key].encode('ascii')
+    
+    success, results = getDBConnectionStrFromStr(server, port, user, password, db_conn_str, useSSL, token)
+    
+    if success:
+        with _db_conn_str_cache_lock:
+            _db_conn_str_cache[key] = results
+            if _db_conn_str_cache_file:
+                _write_db_connection_str_cache_file()
+    
+    return success, results
+
+def _write_db_connection_str_cache_file():
+    # The encrypted connection strings are credentials; write the cache file
+    # so it is readable by the current user only, replacing it in one step
+    temp_path = _db_conn_str_cache_file + '.' + str(os.getpid()) + '.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    f = os.fdopen(fd, 'w')
+    try:
+        json.dump(_db_conn_str_cache, f)
+    finally:
+        f.close()
+    if os.name == 'nt' and os.path.exists(_db_conn_str_cache_file):
+        os.remove(_db_conn_str_cache_file)
+    os.rename(temp_path, _db_conn_str_cache_file)
+
 def create_postgresql_db_connection_str(server, port, user, password, dbservername, dbname, dbusername, dbpassword, useSSL=True, token=None, encrypt_dbpassword=True):
     ''' Create PostgreSQL database connection string.
         Parameters server, port, user, password, useSSL and token are to connect to ArcGIS Server site
@@ -70,7 +136,7 @@ def create_postgresql_db_connection_str(server, port, user, password, dbserverna
     
     # Encrypt the database password
     if encrypt_dbpassword:
-        success, db_conn_str = getDBConnectionStrFromStr(server, port, user, password, db_conn_str, useSSL, token)
+        success, db_conn_str = get_encrypted_db_connection_str(server, port, user, password, db_conn_str, useSSL, token)
     
     return success, db_conn_str
 
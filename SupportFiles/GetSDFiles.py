@@ -26,7 +26,9 @@ import sys, os, traceback, datetime, json, subprocess, tempfile
 from walkingDirTrees import listFiles
 from AGSRestFunctions import getServerDirectory
 from AGSRestFunctions import getServiceList
-from AGSRestFunctions import getServiceInfo
+from ServiceInventory import get_service_inventory
+from ServiceInventory import INFO
+from ServiceInventory import read_service_inventory
 from shutil import copy2
 from shutil import rmtree
 from socket import getfqdn
@@ -55,7 +57,7 @@ def check_args():
 
     if len(sys.argv) < 6:
         
-        print '\n' + scriptName + ' <AGSFullyQualifiedDomainName> <Port> <AdminUser> <AdminPassword> <REPORT|COPY> {CopyToFolder} {Owners}'
+        print '\n' + scriptName + ' <AGSFullyQualifiedDomainName> <Port> <AdminUser> <AdminPassword> <REPORT|COPY> {CopyToFolder} {Owners} {InventoryFile}'
     
         print '\nWhere:'
         print '\n\t<AGSFullyQualifiedDomainName> (required parameter): the fully qualified domain name of th ArcGIS Server.'
@@ -69,6 +71,9 @@ def check_args():
         print '\t\t"owned" by these users *** [AND SHARED WITH "EVERYONE"] *** will be copied).'
         print '\n\t\t- List must be comma delimited list (spaces can be included after commas, but list must be enclosed by quotes).'
         print '\t\t- Owner names are case sensitive.'
+        print '\n\t{InventoryFile} (optional) service inventory file written by ServiceInventory.py; services and'
+        print '\t\tservice info are read from the file instead of requested from the server.'
+        print '\n\t(specify # for an optional parameter that is not used)'
         print '\nNOTE: if not executed on the ArcGIS Server machine, the ArcGIS Server "Directories" (see Manager) have to be UNC paths'
         print 'and given the appropriate OS permissions.'
         return None
@@ -84,10 +89,16 @@ def check_args():
         targetFolder = None
         specified_users = None
         users = None
-        if len(sys.argv) >= 7:
+        inventoryFile = None
+        if len(sys.argv) >= 7 and sys.argv[6].strip() != '#':
             targetFolder = sys.argv[6]
-        if len(sys.argv) >= 8:
+        if len(sys.argv) >= 8 and sys.argv[7].strip() != '#':
             specified_users = sys.argv[7]
+        if len(sys.argv) >= 9:
+            inventoryFile = sys.argv[8]
+            if not os.path.exists(inventoryFile):
+                print '\n{InventoryFile} ' + inventoryFile + ' does not exist. Exiting script.'
+                return None
         
         # Process/validate variables
         
@@ -126,7 +137,7 @@ def check_args():
         if specified_users:
             users = specified_users.replace(' ', '').split(',')
             
-    return server, port, adminuser, password, doCopy, targetFolder, users
+    return server, port, adminuser, password, doCopy, targetFolder, users, inventoryFile
 
 def extractFromSDFile(sdFile, extractFolder, fileToExtract=None):
     ''' Extract file from compressed .sd file '''
@@ -206,31 +217,35 @@ def get_sd_files(sdRootFolder):
     
     return fileInfo
 
-def get_ags_services(server, port, adminuser, password):
-    ''' Return collection of ArcGIS Server services and service info'''
+def get_ags_services(server, port, adminuser, password, inventoryFile=None):
+    ''' Return collection of ArcGIS Server services and service info.
+    If inventoryFile is specified, the services are read from the service
+    inventory file (see ServiceInventory.py).'''
     
     agsServices = {}
     
     # Get all services that exist on server
-    allServices = getServiceList(server, port, adminuser, password)
+    inventory = None
+    if inventoryFile:
+        inventory = read_service_inventory(inventoryFile)
+        allServices = inventory['services'].keys()
+    else:
+        allServices = getServiceList(server, port, adminuser, password)
     
     # Remove certain services from collection
     excludeServices = ['SampleWorldCities.MapServer']
     services = [service for service in allServices if service not in excludeServices]
     
-    # Create dictionary from list of services; values are None.
+    # Get the service info for all services concurrently
+    inventory = get_service_inventory(server, port, adminuser, password,
+                                      parts=(INFO,), services=services,
+                                      inventory=inventory)
     for service in services:
-        
-        parsedService = service.split('//')
-        folder = None
-        if len(parsedService) == 1:
-            serviceNameType = parsedService[0]
-        else:
-            folder = parsedService[0]
-            serviceNameType = parsedService[1]
-            
-        info = getServiceInfo(server, port, adminuser, password, folder, serviceNameType)
-        agsServices[service] = info
+        entry = inventory['services'][service]
+        if entry[INFO] is None:
+            raise Exception('Could not get service info for {}: {}'.format(
+                service, entry['errors'][INFO]))
+        agsServices[service] = entry[INFO]
         
     if debug:
         print "\nwithin get_ags_servides function:"
@@ -428,10 +443,10 @@ def main():
         sys.exit(exitErrCode)
         
     try:
-        server, port, adminuser, password, doCopy, targetFolder, users = results
+        server, port, adminuser, password, doCopy, targetFolder, users, inventoryFile = results
         
         if debug:
-            print server, port, adminuser, password, doCopy, targetFolder, users
+            print server, port, adminuser, password, doCopy, targetFolder, users, inventoryFile
         
         # Determine where admins upload folder is located on server
         uploadsFolderInfo = getServerDirectory(server, port, adminuser, password, "UPLOADS")
@@ -445,12 +460,13 @@ def main():
         sdFiles = get_sd_files(sdRootFolder)
         
         # Get collection of ArcGIS Service services on server
-        agsServices = get_ags_services(server, port, adminuser, password)
+        agsServices = get_ags_services(server, port, adminuser, password, inventoryFile)
         
         # Get the portal properties for each portal item referenced by the service
         # according to the services' json info
         
         portal = Portal('https://' + server + ':7443/arcgis', adminuser, password)
+        portal.enable_item_cache()
         
         props = getPortalPropsForServices(portal, agsServices)
         
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#------------------------------------------------------------------------------
+# Copyright 2014 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#==============================================================================
+#Name:          JobRunner.py
+#
+#Purpose:       Functions for polling all outstanding asynchronous jobs
+#               (i.e. geoprocessing service jobs or portal publishing jobs) in
+#               one loop. Each job is polled with exponential backoff and
+#               jitter and results are yielded as the jobs finish.
+#
+#==============================================================================
+import time, random
+
+# Terminal job states of ArcGIS Server geoprocessing service jobs
+GP_JOB_FINISHED_STATES = frozenset(['esriJobSucceeded', 'esriJobFailed',
+                                    'esriJobTimedOut', 'esriJobCancelled',
+                                    'esriJobDeleted'])
+
+# Terminal job states of portal item jobs (i.e. publish, createService)
+PORTAL_JOB_FINISHED_STATES = frozenset(['completed', 'failed'])
+
+def is_gp_job_finished(status):
+    ''' Return True if geoprocessing job status json is in a terminal state. '''
+    return status.get('jobStatus') in GP_JOB_FINISHED_STATES
+
+def is_portal_job_finished(status):
+    ''' Return True if portal job status json is in a terminal state. '''
+    return status.get('status') in PORTAL_JOB_FINISHED_STATES
+
+def poll_jobs(jobs, check_status, is_finished, initial_interval=1, max_interval=30,
+              backoff=2, jitter=0.25, timeout=None):
+    ''' Poll outstanding jobs in one loop until they finish.
+        'jobs' is a dictionary of job status json keyed by a caller defined key.
+        'check_status' is called with the key and the last status json and
+        returns the new status json; 'is_finished' is called with a status json
+        and returns True when the job has reached a terminal state.
+        Each job is first polled after 'initial_interval' seconds; the interval
+        is multiplied by 'backoff' after every poll, up to 'max_interval'
+        seconds, and randomized by +/- 'jitter' (fraction of the interval).
+        If 'timeout' (seconds) is specified, jobs still outstanding after the
+        timeout are yielded with their last status.
+        Yields (key, status) tuples as the jobs finish.
+    '''
+
+    start = time.time()
+    outstanding = {}
+    for key, status in jobs.iteritems():
+        if is_finished(status):
+            yield key, status
+        else:
+            outstanding[key] = [status, initial_interval, start + _jittered(initial_interval, jitter)]
+
+    while outstanding:
+        now = time.time()
+
+        if timeout is not None and now - start >= timeout:
+            for key in outstanding.keys():
+                yield key, outstanding.pop(key)[0]
+            break
+
+        for key in [key for key in outstanding if outstanding[key][2] <= now]:
+            job = outstanding[key]
+            status = check_status(key, job[0])
+            if is_finished(status):
+                del outstanding[key]
+                yield key, status
+            else:
+                interval = min(job[1] * backoff, max_interval)
+                outstanding[key] = [status, interval, time.time() + _jittered(interval, jitter)]
+
+        if outstanding:
+            wait = min(job[2] for job in outstanding.itervalues()) - time.time()
+            if timeout is not None:
+                wait = min(wait, start + timeout - time.time())
+            if wait > 0:
+                time.sleep(wait)
+
+def _jittered(interval, jitter):
+    return interval * (1 + random.uniform(-jitter, jitter))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+#------------------------------------------------------------------------------
+# Copyright 2014 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#==============================================================================
+#Name:          ServiceInventory.py
+#
+#Purpose:       Creates an in-memory snapshot of the service info, status,
+#               manifest and portal properties of every service in an
+#               ArcGIS Server site. Requests are sent through a bounded
+#               pool of worker threads. The snapshot can be written to and
+#               read from a json file.
+#
+#==============================================================================
+import sys, os, traceback, time, json
+from multiprocessing.pool import ThreadPool
+from AGSRestFunctions import AdminSession
+from AGSRestFunctions import getServiceList
+from AGSRestFunctions import getServiceInfo
+from AGSRestFunctions import getServiceStatus
+from AGSRestFunctions import getServiceManifest
+from AGSRestFunctions import parseService
+from AGSRestFunctions import getFolderReport
+
+# Parts of the service that can be included in the inventory
+INFO = 'info'
+STATUS = 'status'
+MANIFEST = 'manifest'
+ALL_PARTS = (INFO, STATUS, MANIFEST)
+
+_partfunctions = {INFO: getServiceInfo,
+                  STATUS: getServiceStatus,
+                  MANIFEST: getServiceManifest}
+
+# Folder report keys that are not part of the service info
+_reportonlykeys = frozenset(['folderName', 'status', 'instances', 'iteminfo', 'permissions'])
+
+def get_service_inventory(server, port, user, password, useSSL=True, token=None,
+                          parts=ALL_PARTS, max_workers=8, services=None, out_file=None,
+                          use_report=True, inventory=None):
+    ''' Return snapshot (dictionary) of the services on the ArcGIS Server site.
+        'parts' determines which of the service info, status and manifest are
+        requested for each service; the 'portalProperties' value is taken from
+        the service info. 'services' is an optional list of services (in the
+        format returned by getServiceList) to limit the inventory to.
+        If 'out_file' is specified, the snapshot is also written to that file.
+        If 'use_report' is True, the service info and status are taken from the
+        folder reports (one request per folder) when the server supports them;
+        only the remaining parts are requested for each service.
+        If 'inventory' is an existing snapshot (i.e. from read_service_inventory),
+        only the services and parts missing from it are requested; the
+        snapshot is updated and returned. If 'services' is not specified, the
+        services in the snapshot are used.
+
+        Snapshot structure:
+            {'server': ..., 'created': <epoch seconds>,
+             'services': {<folder//name.type>: {'folder': ..., 'serviceNameType': ...,
+                                               'info': {...}, 'status': {...},
+                                               'manifest': {...}, 'portalProperties': {...},
+                                               'errors': {<part>: <message>}}}}
+    '''
+
+    # Share one token and connection pool across all worker threads
+    session = None
+    if token is None:
+        token = session = AdminSession(server, port, user, password, useSSL,
+                                       maxConnections=max_workers)
+    try:
+        inventory = _get_service_inventory(server, port, user, password, useSSL, token,
+                                           parts, max_workers, services, use_report,
+                                           inventory)
+    finally:
+        if session:
+            session.close()
+
+    if out_file:
+        write_service_inventory(inventory, out_file)
+
+    return inventory
+
+def _get_service_inventory(server, port, user, password, useSSL, token, parts,
+                           max_workers, services, use_report, inventory):
+
+    if inventory:
+        if services is None:
+            services = inventory['services'].keys()
+    else:
+        inventory = {'server': server, 'created': time.time(), 'services': {}}
+        if services is None:
+            services = getServiceList(server, port, user, password, useSSL, token)
+
+    for service in services:
+        if service in inventory['services']:
+            continue
+        folder, serviceNameType = parseService(service)
+        entry = {'folder': folder, 'serviceNameType': serviceNameType, 'errors': {}}
+        for part in ALL_PARTS:
+            entry[part] = None
+        entry['portalProperties'] = None
+        inventory['services'][service] = entry
+
+    def _request(task):
+        service, part = task
+        entry = inventory['services'][service]
+        try:
+            response = _partfunctions[part](server, port, user, password,
+                                            entry['folder'], entry['serviceNameType'],
+                                            useSSL, token)
+        except Exception as e:
+            return service, part, None, str(e)
+        return service, part, response, None
+
+    def _report(folder):
+        try:
+            return folder, getFolderReport(server, port, user, password, folder, useSSL, token)
+        except Exception:
+            return folder, None
+
+    pool = ThreadPool(max(1, max_workers))
+    try:
+        if use_report and (INFO in parts or STATUS in parts):
+            folders = {}
+            for service in services:
+                entry = inventory['services'][service]
+                if (INFO in parts and entry[INFO] is None) or \
+                        (STATUS in parts and entry[STATUS] is None):
+                    folders.setdefault(entry['folder'], {})[entry['serviceNameType']] = service
+
+            for folder, reports in pool.imap_unordered(_report, folders.keys()):
+                for report in reports or []:
+                    service = folders[folder].get('{}.{}'.format(report.get('serviceName'), report.get('type')))
+                    if service is None:
+                        continue
+                    entry = inventory['services'][service]
+                    if STATUS in parts and report.get('status'):
+                        entry[STATUS] = report['status']
+                        entry['errors'].pop(STATUS, None)
+                    # Only use the report as the service info if it contains the full service json
+                    if INFO in parts and 'properties' in report and 'clusterName' in report:
+                        entry[INFO] = dict((key, value) for key, value in report.iteritems()
+                                           if key not in _reportonlykeys)
+                        entry['portalProperties'] = entry[INFO].get('portalProperties')
+                        entry['errors'].pop(INFO, None)
+
+        tasks = [(service, part) for service in services for part in parts
+                 if inventory['services'][service][part] is None]
+
+        for service, part, response, error in pool.imap_unordered(_request, tasks):
+            entry = inventory['services'][service]
+            if error:
+                entry['errors'][part] = error
+            else:
+                entry[part] = response
+                entry['errors'].pop(part, None)
+                if part == INFO:
+                    entry['portalProperties'] = response.get('portalProperties')
+    finally:
+        pool.close()
+        pool.join()
+
+    return inventory
+
+def write_service_inventory(inventory, file_path):
+    ''' Write service inventory snapshot to json file. '''
+
+    f = open(file_path, 'w')
+    try:
+        json.dump(inventory, f)
+    finally:
+        f.close()
+
+def read_service_inventory(file_path):
+    ''' Read service inventory snapshot from json file. '''
+
+    f = open(file_path, 'r')
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def main():
+
+    totalSuccess = True
+    scriptName = os.path.basename(sys.argv[0])
+
+    if len(sys.argv) < 7:
+        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Output_File> {Max_Workers}'
+        print '\nWhere:'
+        print '\n\t<Server_FullyQualifiedDomainName> (required): the fully qualified domain name of the ArcGIS Server machine.'
+        print '\n\t<Server_Port> (required): the port number of the ArcGIS Server (specify # if no port).'
+        print '\n\t<User_Name> (required): ArcGIS Server for ArcGIS site administrator.'
+        print '\n\t<Password> (required): Password for ArcGIS Server for ArcGIS site administrator user.'
+        print '\n\t<Use_SSL: Yes|No> (required): Flag indicating if ArcGIS Server requires HTTPS.'
+        print '\n\t<Output_File> (required): Path and name of json file to write the service inventory to.'
+        print '\n\t{Max_Workers} (optional): Number of concurrent requests (default 8).'
+        sys.exit(1)
+
+    server = sys.argv[1]
+    port = sys.argv[2]
+    user = sys.argv[3]
+    password = sys.argv[4]
+    useSSL = sys.argv[5]
+    out_file = sys.argv[6]
+    max_workers = 8
+    if len(sys.argv) > 7:
+        max_workers = int(sys.argv[7])
+
+    if port.strip() == '#':
+        port = None
+
+    if useSSL.strip().lower() in ['yes', 'ye', 'y']:
+        useSSL = True
+    else:
+        useSSL = False
+
+    try:
+        startTime = time.time()
+        inventory = get_service_inventory(server, port, user, password, useSSL,
+                                          max_workers=max_workers, out_file=out_file)
+        print '\nWrote inventory of {} services to file {} ({:.1f} seconds).'.format(
+            len(inventory['services']), out_file, time.time() - startTime)
+
+        for service, entry in sorted(inventory['services'].iteritems()):
+            for part, error in entry['errors'].iteritems():
+                print '\tWARNING: could not get {} for {}: {}'.format(part, service, error)
+
+    except:
+        totalSuccess = False
+
+        # Get the traceback object
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+
+        # Concatenate information together concerning the error into a message string
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+
+        # Print Python error messages for use in Python / Python Window
+        print
+        print "***** ERROR ENCOUNTERED *****"
+        print pymsg + "\n"
+
+    finally:
+        if totalSuccess:
+            sys.exit(0)
+        else:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
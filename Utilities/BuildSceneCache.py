@@ -31,14 +31,22 @@
 import httplib, urllib, json
 
 # For system tools
-import sys, time, ssl, os
+import sys, ssl, os
 
 # For reading passwords without echoing
 import getpass
 
+# Add "Root folder"\SupportFiles to sys path inorder to import
+#   modules in subfolder
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(sys.argv[0])), 'SupportFiles'))
+
+from JobRunner import poll_jobs
+from JobRunner import is_gp_job_finished
+
 script_referrer="PYTHON-SCRIPT"
 
-# Change cacheUpdateFreq value (in secs) below to change caching job polling interval
+# Change cacheUpdateFreq value (in secs) below to change the maximum caching job
+# polling interval; jobs are polled with backoff up to this interval
 cacheJobStatusUpdateFreq = 10
 
 scriptName = os.path.basename(sys.argv[0])
@@ -138,43 +146,6 @@ def assertJsonSuccess(data):
     else:
         return True
     
-# A function that returns the caching status message given the JobID 
-def getJobStatusMessage(serverName, username, password, SceneCachingToolJobsURL, token, serverPort):    
-    # get the rest response
-    data = getJsonResponse(serverName, username, password, SceneCachingToolJobsURL, token, serverPort)
-
-    # load to get the json structs
-    obj = json.loads(data)
-    # pretty print the response json...
-    import pprint
-    pp = pprint.PrettyPrinter(indent=2).pprint
-    if 'jobStatus' in obj and (obj['jobStatus'] == "esriJobExecuting" or obj['jobStatus'] == "esriJobWaiting" or
-                               obj['jobStatus'] == "esriJobCancelling" or obj['jobStatus'] == "esriJobDeleting" or
-                               obj['jobStatus'] == "esriJobSubmitted"):              
-        for message in obj['messages']:
-            for key, value in message.iteritems():
-                if (key == 'type'):
-                    typevalue = str(value)
-                else:
-                    if (key == 'description'):
-                        description = str(value)
-            if (len(typevalue) >= 0 and len(description) >= 0):
-                #print typevalue, description + '\n'
-                print description
-        return True
-    else:        
-        for message in obj['messages']:
-            for key, value in message.iteritems():
-                if (key == 'type'):
-                    typevalue = str(value)
-                else:
-                    if (key == 'description'):
-                        description = str(value)
-            if (len(typevalue) >= 0 and len(description) >= 0):
-                #print typevalue, description + '\n'
-                print description
-        return False
-
 # A function that returns the rest message from an ArcGIS Server
 def getJsonResponse(serverName, username, password, restResourceURL, token, serverPort):    
 # set the header
@@ -300,6 +271,10 @@ def main(argv=None):
         for serviceName in selectedServiceNames:
             print serviceName
         
+    # Caching jobs keyed by scene service name
+    jobs = {}
+    jobURLs = {}
+    
     for serviceName in selectedServiceNames:
         print '\n{}'.format(sectionBreak1)
         print serviceName
@@ -389,7 +364,6 @@ def main(argv=None):
                 print 'Error returned by operation. ' + data
             else:
                 print 'Scene Caching Job Submitted successfully!'
-                print 'Caching Job status updates every {} seconds...'.format(cacheJobStatusUpdateFreq)
          
                 # Extract the jobID from it
                 jobid = json.loads(data)            
@@ -397,16 +371,45 @@ def main(argv=None):
                 print 'JobID: {}'.format(guidJobId)
                 
                 # get the job status from the tool..             
-                SceneCachingToolJobsURL = '{}/jobs/{}'.format(SceneCachingToolURL, guidJobId)            
-                # Check the status of the result object every n seconds until it stops execution..
-                result = True
-                while result == True:                
-                    time.sleep(cacheJobStatusUpdateFreq)
-                    result = getJobStatusMessage(serverName, username, password, SceneCachingToolJobsURL, token, serverPort)
-                #return
+                jobURLs[serviceName] = '{}/jobs/{}'.format(SceneCachingToolURL, guidJobId)
+                jobs[serviceName] = jobid
+    
+    # Number of messages of each job that have been printed
+    printedMessages = dict((serviceName, 0) for serviceName in jobs)
+    
+    def printJobMessages(serviceName, status):
+        # Print the job messages that were added since the last poll
+        messages = status.get('messages', [])
+        for message in messages[printedMessages[serviceName]:]:
+            print '{}: {}'.format(serviceName, message.get('description'))
+        printedMessages[serviceName] = len(messages)
+    
+    # Check the status of all caching jobs together until they stop execution..
+    def checkJobStatus(serviceName, status):
+        data = getJsonResponse(serverName, username, password, jobURLs[serviceName], token, serverPort)
+        if data is None:
+            return status
+        status = json.loads(data)
+        printJobMessages(serviceName, status)
+        return status
+    
+    if len(jobs) > 0:
+        print '\n{}'.format(sectionBreak1)
+        print 'Waiting for {} caching job(s) to finish...'.format(len(jobs))
+        print sectionBreak1
+    
+    for serviceName, status in poll_jobs(jobs, checkJobStatus, is_gp_job_finished,
+                                         max_interval=cacheJobStatusUpdateFreq):
+        printJobMessages(serviceName, status)
+        print '\n{}: {}\n'.format(serviceName, status.get('jobStatus'))
+        if status.get('jobStatus') <> 'esriJobSucceeded':
+            total_success = False
 
     print '\n\nScript {} completed.\n'.format(scriptName)
-    sys.exit(0)
+    if total_success:
+        sys.exit(0)
+    else:
+        sys.exit(exit_err_code)
 
 # Script start
 if __name__ == "__main__":
@@ -437,6 +437,9 @@ def main():
         
         if not portal:
             raise Exception('ERROR: Could not create "portal" object.')
+        
+        # Web maps are referenced by many apps; cache the items
+        portal.enable_item_cache()
 
         if not portal.logged_in_user():
             raise Exception('\nERROR: Could not sign in with specified credentials.')
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#------------------------------------------------------------------------------
+# Copyright 2014 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#==============================================================================
+#Name:          ExportServerLogs.py
+#
+#Purpose:       Export the log messages of an ArcGIS Server site for a time
+#               range to a newline delimited json file (one log message per
+#               line). The time range is split into windows that are queried
+#               concurrently; pages are written as they arrive so memory use
+#               does not depend on the number of log messages.
+#
+#==============================================================================
+import sys, os, traceback, time, json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(sys.argv[0])), 'SupportFiles'))
+
+from AGSRestFunctions import queryLogsConcurrent
+from AGSRestFunctions import parseLogTimeRange
+
+scriptName = os.path.basename(sys.argv[0])
+exitErrCode = 1
+logLevels = ['SEVERE', 'WARNING', 'INFO', 'FINE', 'VERBOSE', 'DEBUG']
+
+
+def check_args():
+    # ---------------------------------------------------------------------
+    # Check arguments
+    # ---------------------------------------------------------------------
+
+    if len(sys.argv) < 9 or len(sys.argv) > 12:
+
+        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Output_File> <From_Time> <To_Time> {Level} {Windows} {Max_Workers}'
+
+        print '\nWhere:'
+        print '\n\t<Server_FullyQualifiedDomainName> (required): the fully qualified domain name of the ArcGIS Server machine.'
+        print '\n\t<Server_Port> (required): the port number of the ArcGIS Server (specify # if no port).'
+        print '\n\t<User_Name> (required): ArcGIS Server for ArcGIS site administrator.'
+        print '\n\t<Password> (required): Password for ArcGIS Server for ArcGIS site administrator user.'
+        print '\n\t<Use_SSL: Yes|No> (required) Flag indicating if ArcGIS Server requires HTTPS.'
+        print '\n\t<Output_File> (required): Path and name of the newline delimited json file to write the log messages to.'
+        print '\n\t<From_Time> (required): Oldest time to export, as local time (YYYY-MM-DDTHH:MM:SS) or milliseconds since epoch.'
+        print '\n\t<To_Time> (required): Most recent time to export, as local time (YYYY-MM-DDTHH:MM:SS) or milliseconds since epoch.'
+        print '\n\t{Level} (optional): ' + '|'.join(logLevels) + ' (default WARNING).'
+        print '\n\t{Windows} (optional): Number of time windows to split the time range into (default 8).'
+        print '\n\t{Max_Workers} (optional): Number of windows to query concurrently (default 4).'
+        print '\n\tExample: ' + scriptName + ' myserver.domain.com 6443 admin pwd Yes C:\\logs.json 2016-05-21T00:00:00 2016-05-22T00:00:00 FINE\n'
+        return None
+
+    else:
+
+        # Set variables from parameter values
+        server = sys.argv[1]
+        port = sys.argv[2]
+        adminuser = sys.argv[3]
+        password = sys.argv[4]
+        useSSL = sys.argv[5]
+        outFile = sys.argv[6]
+        try:
+            fromTime, toTime = parseLogTimeRange(sys.argv[7], sys.argv[8])
+        except ValueError as e:
+            print '\nERROR: ' + str(e) + '\n'
+            return None
+        level = 'WARNING'
+        windows = 8
+        maxWorkers = 4
+
+        if len(sys.argv) > 9:
+            level = sys.argv[9].strip().upper()
+            if level not in logLevels:
+                print '\nERROR: Invalid {Level} ' + sys.argv[9] + '. Valid values are ' + ', '.join(logLevels) + '.\n'
+                return None
+
+        if len(sys.argv) > 10:
+            windows = int(sys.argv[10])
+
+        if len(sys.argv) > 11:
+            maxWorkers = int(sys.argv[11])
+
+        if windows < 1 or maxWorkers < 1:
+            print '\nERROR: {Windows} and {Max_Workers} must be 1 or more.\n'
+            return None
+
+        if port.strip() == '#':
+            port = None
+
+        if useSSL.strip().lower() in ['yes', 'ye', 'y']:
+            useSSL = True
+        else:
+            useSSL = False
+
+    return server, port, adminuser, password, useSSL, outFile, fromTime, toTime, level, windows, maxWorkers
+
+def export_logs(server, port, adminuser, password, useSSL, out_file, from_time, to_time,
+                level='WARNING', windows=8, max_workers=4, services='*', machines='*'):
+    ''' Write the log messages logged between from_time and to_time
+        (milliseconds since epoch) to newline delimited json file.
+        Returns the number of log messages written. '''
+
+    count = 0
+    f = open(out_file, 'w')
+    try:
+        for page in queryLogsConcurrent(server, port, adminuser, password, to_time, from_time,
+                                        level, services, machines, useSSL,
+                                        windows=windows, maxWorkers=max_workers):
+            for message in page:
+                f.write(json.dumps(message) + '\n')
+            count += len(page)
+    finally:
+        f.close()
+
+    return count
+
+def main():
+
+    totalSuccess = True
+
+    # -------------------------------------------------
+    # Check arguments
+    # -------------------------------------------------
+    results = check_args()
+    if not results:
+        sys.exit(exitErrCode)
+    server, port, adminuser, password, useSSL, outFile, fromTime, toTime, level, windows, maxWorkers = results
+
+    try:
+        startTime = time.time()
+        count = export_logs(server, port, adminuser, password, useSSL, outFile, fromTime, toTime,
+                            level, windows, maxWorkers)
+        print '\nWrote {} log messages to file {} ({:.1f} seconds).'.format(
+            count, outFile, time.time() - startTime)
+
+    except:
+        totalSuccess = False
+
+        # Get the traceback object
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+
+        # Concatenate information together concerning the error into a message string
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+
+        # Print Python error messages for use in Python / Python Window
+        print
+        print "***** ERROR ENCOUNTERED *****"
+        print pymsg + "\n"
+
+    finally:
+        if totalSuccess:
+            sys.exit(0)
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,9 @@ import sys, os, traceback, datetime, ast, copy, json
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(sys.argv[0])), 'SupportFiles'))
 
 from AGSRestFunctions import getServiceList
-from AGSRestFunctions import getServiceManifest
+from ServiceInventory import get_service_inventory
+from ServiceInventory import MANIFEST
+from ServiceInventory import read_service_inventory
 
 scriptName = os.path.basename(sys.argv[0])
 exitErrCode = 1
@@ -38,16 +40,18 @@ def check_args():
     # Check arguments
     # ---------------------------------------------------------------------
 
-    if len(sys.argv) <> 6:
+    if len(sys.argv) < 6 or len(sys.argv) > 7:
         
-        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No>'
+        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> {Inventory_File}'
     
         print '\nWhere:'
         print '\n\t<Server_FullyQualifiedDomainName> (required): the fully qualified domain name of the ArcGIS Server machine.'
         print '\n\t<Server_Port> (required): the port number of the ArcGIS Server (specify # if no port).'
         print '\n\t<User_Name> (required): ArcGIS Server for ArcGIS site administrator.'
         print '\n\t<Password> (required): Password for ArcGIS Server for ArcGIS site administrator user.'
-        print '\n\t<Use_SSL: Yes|No> (required) Flag indicating if ArcGIS Server requires HTTPS.\n'
+        print '\n\t<Use_SSL: Yes|No> (required) Flag indicating if ArcGIS Server requires HTTPS.'
+        print '\n\t{Inventory_File} (optional) Service inventory file written by ServiceInventory.py; services'
+        print '\t\tand manifests are read from the file instead of requested from the server.\n'
         return None
     
     else:
@@ -58,6 +62,13 @@ def check_args():
         adminuser = sys.argv[3]
         password = sys.argv[4]
         useSSL = sys.argv[5]
+        inventoryFile = None
+        
+        if len(sys.argv) > 6:
+            inventoryFile = sys.argv[6]
+            if not os.path.exists(inventoryFile):
+                print '\nERROR: {Inventory_File} ' + inventoryFile + ' does not exist.\n'
+                return None
         
         if port.strip() == '#':
             port = None
@@ -67,7 +78,7 @@ def check_args():
         else:
             useSSL = False
         
-    return server, port, adminuser, password, useSSL
+    return server, port, adminuser, password, useSSL, inventoryFile
 
 def parseService(service):
     # Parse folder and service nameType
@@ -94,7 +105,7 @@ def main():
     results = check_args()
     if not results:
         sys.exit(exitErrCode)
-    server, port, adminuser, password, useSSL = results
+    server, port, adminuser, password, useSSL, inventoryFile = results
     
     if debug:
         print server, port, adminuser, password, useSSL
@@ -108,7 +119,12 @@ def main():
         else:
             protocol = 'http'
             
-        allServices = getServiceList(server, port, adminuser, password)
+        inventory = None
+        if inventoryFile:
+            inventory = read_service_inventory(inventoryFile)
+            allServices = inventory['services'].keys()
+        else:
+            allServices = getServiceList(server, port, adminuser, password, useSSL)
         
         # Remove certain services from collection
         excludeServices = ['SampleWorldCities.MapServer']
@@ -122,6 +138,11 @@ def main():
         numServices = len(services)
         i = 0
         
+        # Get the manifests of all services concurrently
+        inventory = get_service_inventory(server, port, adminuser, password, useSSL,
+                                          parts=(MANIFEST,), services=services,
+                                          inventory=inventory)
+        
         # Print header
         print 'ArcGIS Server|Service|On Server Connection String/or Path'
         
@@ -130,7 +151,10 @@ def main():
             
             folder, serviceNameType = parseService(service)
             
-            serviceManifest = getServiceManifest(server, port, adminuser, password, folder, serviceNameType)
+            serviceManifest = inventory['services'][service][MANIFEST]
+            if serviceManifest is None:
+                print '{}|{}|{}'.format(server, service, inventory['services'][service]['errors'][MANIFEST])
+                continue
 
             databases = serviceManifest.get('databases')
             if databases:
@@ -21,6 +21,11 @@
 #               2) Edit service property values in Properties_File
 #               3) Execute script using UPDATE option
 #
+#               Alternatively, execute script using ADVISE option to create
+#               Properties_File with instance counts recommended from the
+#               service usage statistics, review it and execute script
+#               using UPDATE option.
+#
 #               Properties updated by script are:
 #                   clusterName
 #                   minInstancesPerNode
@@ -35,6 +40,7 @@ import traceback
 import json
 import logging
 import time
+import math
 
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
     sys.argv[0])), 'SupportFiles'))
@@ -44,6 +50,10 @@ from AGSRestFunctions import getServiceInfo
 from AGSRestFunctions import parseService
 from AGSRestFunctions import editServiceInfo
 from AGSRestFunctions import getClusters
+from AGSRestFunctions import getServiceUsage
+from ServiceInventory import get_service_inventory
+from ServiceInventory import INFO
+from ServiceInventory import read_service_inventory
 
 # Defines which service json properties this script will update.
 UPDATABLE_SERVICE_PROPERTIES = frozenset([
@@ -55,9 +65,35 @@ UPDATABLE_SERVICE_PROPERTIES = frozenset([
 # Defines valid script options
 VALID_OPTIONS = frozenset([
     'REPORT',
+    'ADVISE',
     'UPDATE'
     ])
 
+# Defines valid usage statistics periods for ADVISE option
+VALID_USAGE_PERIODS = frozenset([
+    'LAST_DAY',
+    'LAST_WEEK',
+    'LAST_MONTH'
+    ])
+
+# Usage metrics used by ADVISE option
+USAGE_METRICS = ['RequestCount', 'RequestAvgResponseTime', 'ServiceActiveInstances']
+
+# Estimated memory (MB) used by one instance of each service type; used by
+# ADVISE option to keep instances within the memory per machine
+INSTANCE_MEMORY_MB = {
+    'MapServer': 150,
+    'FeatureServer': 150,
+    'ImageServer': 200,
+    'GPServer': 200,
+    'GeocodeServer': 500,
+    'GeometryServer': 80
+    }
+DEFAULT_INSTANCE_MEMORY_MB = 150
+
+# Recommended max instances = peak concurrent requests per machine * headroom
+INSTANCE_HEADROOM = 1.25
+
 def print_args():
     """ Print script arguments """
     
@@ -69,7 +105,10 @@ def print_args():
             ' <Password>' + \
             ' <Use_SSL: Yes|No>' + \
             ' <Properties_File>' + \
-            ' {Service_Property_Option}'
+            ' {Service_Property_Option}' + \
+            ' {Memory_Per_Machine_MB}' + \
+            ' {Usage_Period}' + \
+            ' {Inventory_File}'
     
         print '\nWhere:'
         print '\n\t<Server_FullyQualifiedDomainName> (required): the fully qualified domain name of the ArcGIS Server machine.'
@@ -80,7 +119,14 @@ def print_args():
         print '\n\t<Properties_File> (required) Path to file containing service properties.'
         print '\n\t{{Service_Property_Option}} (optional) {}'.format('|'.join(VALID_OPTIONS))
         print '\t\tREPORT: (default) - write service properties to Properties_File.'
+        print '\t\tADVISE: write service properties with recommended min/max instances to Properties_File.'
         print '\t\tUPDATE: updates service properties based on contents of Properties_File.'
+        print '\n\t{Memory_Per_Machine_MB} (optional) ADVISE only: memory (MB) available to service instances'
+        print '\t\ton each machine; recommended max instances are reduced to fit (specify # for no limit).'
+        print '\n\t{{Usage_Period}} (optional) ADVISE only: {} (default LAST_WEEK).'.format('|'.join(VALID_USAGE_PERIODS))
+        print '\n\t{Inventory_File} (optional) REPORT and ADVISE only: service inventory file written by'
+        print '\t\tServiceInventory.py; services and service info are read from the file instead of'
+        print '\t\trequested from the server.'
         print '\n\tNOTE: The following services properties can be reported/updated:'
         print '\t\t{}'.format(', '.join(UPDATABLE_SERVICE_PROPERTIES))
         return None
@@ -95,6 +141,9 @@ def print_args():
         use_ssl = sys.argv[5]
         file_path = sys.argv[6]
         option = 'REPORT'
+        memory_per_machine = None
+        usage_period = 'LAST_WEEK'
+        inventory_file = None
         
         if port.strip() == '#':
             port = None
@@ -110,12 +159,30 @@ def print_args():
                 print 'Specified "Service_Property_Option" parameter value is invalid.'
                 return None
         
+        if len(sys.argv) >= 9 and sys.argv[8].strip() != '#':
+            if not sys.argv[8].strip().isdigit() or int(sys.argv[8]) <= 0:
+                print 'Specified "Memory_Per_Machine_MB" parameter value must be a positive integer.'
+                return None
+            memory_per_machine = int(sys.argv[8])
+        
+        if len(sys.argv) >= 10:
+            usage_period = sys.argv[9].upper()
+            if usage_period not in VALID_USAGE_PERIODS:
+                print 'Specified "Usage_Period" parameter value is invalid.'
+                return None
+        
+        if len(sys.argv) >= 11:
+            inventory_file = sys.argv[10]
+            if not os.path.exists(inventory_file):
+                print 'Specified "Inventory_File" does not exist.'
+                return None
+        
         if option == 'UPDATE':
             if not os.path.exists(file_path):
                 print 'Specified "Service_Property_File" does not exist.'
                 return None
                 
-    return server, port, adminuser, password, use_ssl, file_path, option
+    return server, port, adminuser, password, use_ssl, file_path, option, memory_per_machine, usage_period, inventory_file
 
 def read_file(file_path):
     
@@ -142,6 +209,68 @@ def validate_file_contents(file_contents):
 
     return valid
 
+def format_properties_line(service, cluster_name, min_instances, max_instances):
+    """ Return line written to Properties_File for a service """
+    
+    write_str = '{{"service": "{}", "properties": {{"clusterName": "{}", "minInstancesPerNode": {}, "maxInstancesPerNode": {}}}}}\n'
+    return write_str.format(service, cluster_name, min_instances, max_instances)
+
+def get_concurrency(service_usage, slice_seconds):
+    """ Return list of the concurrent requests (site wide) in each usage
+    time slice; the larger of the max active instances and the request
+    rate multiplied by the average response time. """
+    
+    counts = service_usage.get('RequestCount') or []
+    avg_times = service_usage.get('RequestAvgResponseTime') or []
+    active = service_usage.get('ServiceActiveInstances') or []
+    
+    concurrency = []
+    for i in range(max(len(counts), len(avg_times), len(active))):
+        count = counts[i] if i < len(counts) else None
+        avg_time = avg_times[i] if i < len(avg_times) else None
+        value = active[i] if i < len(active) and active[i] is not None else 0
+        if count and avg_time:
+            # Little's law; response times are in milliseconds
+            value = max(value, count * (avg_time / 1000.0) / slice_seconds)
+        concurrency.append(value)
+    
+    return concurrency
+
+def recommend_instances(service_usage, slice_seconds, machine_count):
+    """ Return recommended (min, max) instances per machine and peak
+    concurrent requests per machine. """
+    
+    if not sum(count or 0 for count in service_usage.get('RequestCount') or []):
+        # Unused service; don't keep idle instances running
+        return 0, 1, 0.0
+    
+    concurrency = get_concurrency(service_usage, slice_seconds)
+    peak = float(max(concurrency)) / machine_count
+    average = float(sum(concurrency)) / len(concurrency) / machine_count
+    
+    min_instances = max(1, int(math.ceil(average)))
+    max_instances = max(min_instances, int(math.ceil(peak * INSTANCE_HEADROOM)))
+    
+    return min_instances, max_instances, peak
+
+def fit_memory_budget(recommendations, memory_per_machine):
+    """ Reduce the recommended max instances of the services of a cluster
+    until the instances fit in the memory per machine; the instances with
+    the most headroom over the peak concurrent requests are removed first.
+    Returns False if the min instances do not fit. """
+    
+    def _memory():
+        return sum(rec['max'] * rec['memory'] for rec in recommendations)
+    
+    while _memory() > memory_per_machine:
+        candidates = [rec for rec in recommendations if rec['max'] > max(rec['min'], 1)]
+        if not candidates:
+            return False
+        rec = max(candidates, key=lambda rec: (rec['max'] - rec['peak'], rec['memory']))
+        rec['max'] -= 1
+    
+    return True
+
 def main():
     exit_err_code = 1
     
@@ -149,7 +278,7 @@ def main():
     results = print_args()
     if not results:
         sys.exit(exit_err_code)
-    server, port, adminuser, password, use_ssl, file_path, option = results
+    server, port, adminuser, password, use_ssl, file_path, option, memory_per_machine, usage_period, inventory_file = results
     
     total_success = True
     title_break_count = 100
@@ -164,8 +293,16 @@ def main():
     cluster_names = [cluster['clusterName'] for cluster in clusters]
 
     try:
-        services = getServiceList(server, port, adminuser, password, use_ssl)
-        services = [service.replace('//', '/') for service in services]
+        inventory = None
+        if inventory_file and option in ('REPORT', 'ADVISE'):
+            inventory = read_service_inventory(inventory_file)
+            # Key the snapshot by the service names used by this script
+            inventory['services'] = dict((service.replace('//', '/'), entry)
+                                         for service, entry in inventory['services'].iteritems())
+            services = inventory['services'].keys()
+        else:
+            services = getServiceList(server, port, adminuser, password, use_ssl)
+            services = [service.replace('//', '/') for service in services]
         
         # Properties of hosted services should not be altered; remove hosted
         # services from the services list
@@ -180,9 +317,18 @@ def main():
             
             print 'Writing service property information to file (excluding hosted services)...\n'
             
+            # Get the service info for all services concurrently
+            inventory = get_service_inventory(server, port, adminuser, password, use_ssl,
+                                              parts=(INFO,), services=services,
+                                              inventory=inventory)
+            
             for service in services:
-                folder, servicename_type = parseService(service)
-                service_info = getServiceInfo(server, port, adminuser, password, folder, servicename_type, use_ssl)
+                service_info = inventory['services'][service][INFO]
+                if service_info is None:
+                    total_success = False
+                    print '***ERROR: Could not get service info for {}: {}'.format(
+                        service, inventory['services'][service]['errors'][INFO])
+                    continue
                 
                 # Don't write service info if service is associated
                 # with gp service. Service is edited through gp service.
@@ -191,8 +337,7 @@ def main():
                     if parent_name.find('.GPServer') > -1:
                         continue
         
-                write_str = '{{"service": "{}", "properties": {{"clusterName": "{}", "minInstancesPerNode": {}, "maxInstancesPerNode": {}}}}}\n'
-                write_str = write_str.format(
+                write_str = format_properties_line(
                         service,
                         service_info['clusterName'],
                         service_info['minInstancesPerNode'],
@@ -201,6 +346,83 @@ def main():
                 f.write(write_str)
             f.close
         
+        # ---------------------------------------------------------------------
+        # Recommend service instances from usage statistics
+        # ---------------------------------------------------------------------
+        if option == "ADVISE":
+            
+            print 'Getting service usage statistics ({})...\n'.format(usage_period)
+            
+            inventory = get_service_inventory(server, port, adminuser, password, use_ssl,
+                                              parts=(INFO,), services=services,
+                                              inventory=inventory)
+            usage = getServiceUsage(server, port, adminuser, password, services,
+                                    USAGE_METRICS, usage_period, useSSL=use_ssl)
+            
+            time_slices = usage['time-slices']
+            if len(time_slices) > 1:
+                slice_seconds = (time_slices[1] - time_slices[0]) / 1000.0
+            else:
+                slice_seconds = {'LAST_DAY': 1, 'LAST_WEEK': 7, 'LAST_MONTH': 30}[usage_period] * 86400.0
+            
+            machine_counts = dict((cluster['clusterName'], len(cluster.get('machineNames') or []) or 1)
+                                  for cluster in clusters)
+            
+            # Recommend instances for each service, grouped by cluster
+            cluster_recommendations = {}
+            for service in services:
+                service_info = inventory['services'][service][INFO]
+                if service_info is None:
+                    total_success = False
+                    print '***ERROR: Could not get service info for {}: {}'.format(
+                        service, inventory['services'][service]['errors'][INFO])
+                    continue
+                
+                # Don't write service info if service is associated
+                # with gp service. Service is edited through gp service.
+                parent_name = service_info['properties'].get('parentName')
+                if parent_name:
+                    if parent_name.find('.GPServer') > -1:
+                        continue
+                
+                cluster_name = service_info['clusterName']
+                min_instances, max_instances, peak = recommend_instances(
+                        usage['services'].get(service, {}), slice_seconds,
+                        machine_counts.get(cluster_name, 1))
+                service_type = service.split('.')[-1]
+                cluster_recommendations.setdefault(cluster_name, []).append({
+                        'service': service,
+                        'info': service_info,
+                        'min': min_instances,
+                        'max': max_instances,
+                        'peak': peak,
+                        'memory': INSTANCE_MEMORY_MB.get(service_type, DEFAULT_INSTANCE_MEMORY_MB)})
+            
+            f = open(file_path, 'w')
+            
+            print 'Writing recommended service properties to file (excluding hosted services)...\n'
+            print '{:<60} {:>12} {:>12} {:>8}'.format('Service', 'Min (orig.)', 'Max (orig.)', 'Peak')
+            
+            for cluster_name in sorted(cluster_recommendations.keys()):
+                recommendations = cluster_recommendations[cluster_name]
+                
+                if memory_per_machine:
+                    if not fit_memory_budget(recommendations, memory_per_machine):
+                        total_success = False
+                        print '\n***ERROR: min instances of services in cluster "{}" do not fit in {} MB per machine;'.format(
+                            cluster_name, memory_per_machine)
+                        print '\tno recommendations written for the services of the cluster.\n'
+                        continue
+                
+                for rec in recommendations:
+                    print '{:<60} {:>12} {:>12} {:>8.2f}'.format(
+                            rec['service'],
+                            '{} ({})'.format(rec['min'], rec['info']['minInstancesPerNode']),
+                            '{} ({})'.format(rec['max'], rec['info']['maxInstancesPerNode']),
+                            rec['peak'])
+                    f.write(format_properties_line(rec['service'], cluster_name, rec['min'], rec['max']))
+            f.close()
+        
         # ---------------------------------------------------------------------
         # Update/Edit service properties
         # ---------------------------------------------------------------------
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#------------------------------------------------------------------------------
+# Copyright 2014 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#==============================================================================
+#Name:          ServiceLatencyReport.py
+#
+#Purpose:       Calculate the request count and the 50th, 95th and 99th
+#               percentile request times of each service in an ArcGIS Server
+#               site from the FINE level "request successfully processed" log
+#               messages, and write them to a csv file sorted by the 95th
+#               percentile (slowest service first).
+#
+#               NOTE: the log level of the site must be set to FINE (or more
+#               verbose) for the time range to contain request times.
+#
+#==============================================================================
+import sys, os, traceback, time, csv, math
+from array import array
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(sys.argv[0])), 'SupportFiles'))
+
+from AGSRestFunctions import AdminSession
+from AGSRestFunctions import getServiceList
+from AGSRestFunctions import queryLogsConcurrent
+from AGSRestFunctions import parseLogTimeRange
+
+scriptName = os.path.basename(sys.argv[0])
+exitErrCode = 1
+percentiles = [50, 95, 99]
+
+# Log messages written once for each service request; the 'elapsed'
+# property of these messages is the request time in seconds
+requestMessage = 'request successfully processed'
+
+
+def check_args():
+    # ---------------------------------------------------------------------
+    # Check arguments
+    # ---------------------------------------------------------------------
+
+    if len(sys.argv) < 9 or len(sys.argv) > 10:
+
+        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Output_File> <From_Time> <To_Time> {Windows}'
+
+        print '\nWhere:'
+        print '\n\t<Server_FullyQualifiedDomainName> (required): the fully qualified domain name of the ArcGIS Server machine.'
+        print '\n\t<Server_Port> (required): the port number of the ArcGIS Server (specify # if no port).'
+        print '\n\t<User_Name> (required): ArcGIS Server for ArcGIS site administrator.'
+        print '\n\t<Password> (required): Password for ArcGIS Server for ArcGIS site administrator user.'
+        print '\n\t<Use_SSL: Yes|No> (required) Flag indicating if ArcGIS Server requires HTTPS.'
+        print '\n\t<Output_File> (required): Path and name of the csv file to write the report to.'
+        print '\n\t<From_Time> (required): Oldest time to report on, as local time (YYYY-MM-DDTHH:MM:SS) or milliseconds since epoch.'
+        print '\n\t<To_Time> (required): Most recent time to report on, as local time (YYYY-MM-DDTHH:MM:SS) or milliseconds since epoch.'
+        print '\n\t{Windows} (optional): Number of time windows to split the time range into (default 8).'
+        print '\n\tExample: ' + scriptName + ' myserver.domain.com 6443 admin pwd Yes C:\\latency.csv 2016-05-21T00:00:00 2016-05-22T00:00:00\n'
+        return None
+
+    else:
+
+        # Set variables from parameter values
+        server = sys.argv[1]
+        port = sys.argv[2]
+        adminuser = sys.argv[3]
+        password = sys.argv[4]
+        useSSL = sys.argv[5]
+        outFile = sys.argv[6]
+        try:
+            fromTime, toTime = parseLogTimeRange(sys.argv[7], sys.argv[8])
+        except ValueError as e:
+            print '\nERROR: ' + str(e) + '\n'
+            return None
+        windows = 8
+
+        if len(sys.argv) > 9:
+            windows = int(sys.argv[9])
+
+        if port.strip() == '#':
+            port = None
+
+        if useSSL.strip().lower() in ['yes', 'ye', 'y']:
+            useSSL = True
+        else:
+            useSSL = False
+
+    return server, port, adminuser, password, useSSL, outFile, fromTime, toTime, windows
+
+def log_source_to_service(source):
+    ''' Convert log message source (i.e. folder/name.MapServer) to the
+        service format returned by getServiceList (i.e. folder//name.MapServer). '''
+    if '/' in source:
+        folder, serviceNameType = source.rsplit('/', 1)
+        return folder + '//' + serviceNameType
+    return source
+
+def get_request_times(log_pages):
+    ''' Return dictionary of request times (seconds) keyed by service, from
+        pages of log messages. Request times are kept in compact arrays of
+        doubles; the log messages themselves are not kept. '''
+    times = {}
+    for page in log_pages:
+        for message in page:
+            elapsed = message.get('elapsed')
+            if not elapsed or requestMessage not in message.get('message', '').lower():
+                continue
+            try:
+                elapsed = float(elapsed)
+            except ValueError:
+                continue
+            service = log_source_to_service(message.get('source', ''))
+            if service not in times:
+                times[service] = array('d')
+            times[service].append(elapsed)
+    return times
+
+def percentile(sorted_values, pct):
+    ''' Return the nearest-rank percentile of a sorted list of values. '''
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+def get_latency_stats(times, services=None):
+    ''' Return list of per service statistics (dictionaries) sorted by the
+        95th percentile request time, slowest first. Services in the optional
+        'services' list without any requests are included with a count of 0. '''
+    stats = []
+    allServices = set(times.keys())
+    if services:
+        allServices.update(services)
+    for service in allServices:
+        values = sorted(times.get(service, []))
+        stat = {'Service': service, 'Requests': len(values),
+                'Max': values[-1] if values else None}
+        for pct in percentiles:
+            stat['p{}'.format(pct)] = percentile(values, pct)
+        stats.append(stat)
+    stats.sort(key=lambda stat: (stat['p95'] is None, -(stat['p95'] or 0), stat['Service']))
+    return stats
+
+def write_latency_report(stats, out_file):
+    ''' Write service statistics to csv file. '''
+    fieldNames = ['Service', 'Requests'] + ['p{}'.format(pct) for pct in percentiles] + ['Max']
+    f = open(out_file, 'wb')
+    try:
+        writer = csv.DictWriter(f, fieldNames)
+        writer.writerow(dict((name, name) for name in fieldNames))
+        writer.writerows(stats)
+    finally:
+        f.close()
+
+def main():
+
+    totalSuccess = True
+
+    # -------------------------------------------------
+    # Check arguments
+    # -------------------------------------------------
+    results = check_args()
+    if not results:
+        sys.exit(exitErrCode)
+    server, port, adminuser, password, useSSL, outFile, fromTime, toTime, windows = results
+
+    session = None
+    try:
+        startTime = time.time()
+        session = AdminSession(server, port, adminuser, password, useSSL)
+
+        # -------------------------------------------------
+        # Get request times from the FINE log messages
+        # -------------------------------------------------
+        services = getServiceList(server, port, adminuser, password, useSSL, session)
+        times = get_request_times(queryLogsConcurrent(server, port, adminuser, password,
+                                                      toTime, fromTime, 'FINE', useSSL=useSSL,
+                                                      token=session, windows=windows))
+
+        stats = get_latency_stats(times, services)
+        write_latency_report(stats, outFile)
+
+        numRequests = sum(stat['Requests'] for stat in stats)
+        print '\nWrote request times of {} services ({} requests) to file {} ({:.1f} seconds).'.format(
+            len(stats), numRequests, outFile, time.time() - startTime)
+        if numRequests == 0:
+            print '\nWARNING: no request times found; is the log level of the site set to FINE?'
+
+        for stat in stats[:10]:
+            if stat['Requests']:
+                print '\t{}: {} requests, p95 {:.3f} seconds'.format(stat['Service'], stat['Requests'], stat['p95'])
+
+    except:
+        totalSuccess = False
+
+        # Get the traceback object
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+
+        # Concatenate information together concerning the error into a message string
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+
+        # Print Python error messages for use in Python / Python Window
+        print
+        print "***** ERROR ENCOUNTERED *****"
+        print pymsg + "\n"
+
+    finally:
+        if session:
+            session.close()
+        if totalSuccess:
+            sys.exit(0)
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,7 +32,9 @@ sys.path.append(os.path.join(os.path.dirname(os.path.dirname(sys.argv[0])), 'Sup
 from AGSRestFunctions import getServiceList
 from AGSRestFunctions import getHostedServiceDefinition
 from AGSRestFunctions import parseService
-from AGSRestFunctions import getServicePortalProps
+from ServiceInventory import get_service_inventory
+from ServiceInventory import INFO
+from ServiceInventory import read_service_inventory
 
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(sys.argv[0])), 'Publish', 'Portal'))
 from portalpy import Portal
@@ -52,7 +54,7 @@ def check_args():
 
     if len(sys.argv) < 7:
         
-        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Output_File> {Owners}'
+        print '\n' + scriptName + ' <Server_FullyQualifiedDomainName> <Server_Port> <User_Name> <Password> <Use_SSL: Yes|No> <Output_File> {Owners} {Inventory_File}'
     
         print '\nWhere:'
         print '\n\t<Server_FullyQualifiedDomainName> (required): the fully qualified domain name of the ArcGIS Server machine.'
@@ -66,6 +68,9 @@ def check_args():
         print '\n\t\t- List must be comma delimited list (spaces can be included after commas, but list'
         print '\t\t  must be enclosed by quotes).'
         print '\t\t- Owner names are case sensitive.'
+        print '\t\t- Specify # for all owners.'
+        print '\n\t{Inventory_File} (optional) service inventory file written by ServiceInventory.py; services'
+        print '\t\tand service info are read from the file instead of requested from the server.'
         return None
     
     else:
@@ -79,9 +84,16 @@ def check_args():
         output_file  = sys.argv[6]
         
         owners = None
-        if len(sys.argv) > 7:
+        if len(sys.argv) > 7 and sys.argv[7].strip() != '#':
             owners = sys.argv[7]
             owners = owners.replace(' ', '').split(',')
+        
+        inventory_file = None
+        if len(sys.argv) > 8:
+            inventory_file = sys.argv[8]
+            if not os.path.exists(inventory_file):
+                print '\nERROR: {Inventory_File} ' + inventory_file + ' does not exist.'
+                return None
  
         if port.strip() == '#':
             port = None
@@ -91,7 +103,7 @@ def check_args():
         else:
             use_ssl = False
         
-    return server, port, adminuser, password, use_ssl, output_file, owners
+    return server, port, adminuser, password, use_ssl, output_file, owners, inventory_file
 
 def get_invalid_owners(portal, owners):
     invalid_users = []
@@ -111,7 +123,7 @@ def main():
     results = check_args()
     if not results:
         sys.exit(exitErrCode)
-    server, port, adminuser, password, use_ssl, output_file, owners = results
+    server, port, adminuser, password, use_ssl, output_file, owners, inventory_file = results
     
     if debug:
         print server, port, adminuser, password, use_ssl, output_file, owners
@@ -136,8 +148,16 @@ def main():
         else:
             
             # Get all services that exist on server
-            all_services = getServiceList(server, port, adminuser, password)
-            all_services = [service.replace('//', '/') for service in all_services]
+            inventory = None
+            if inventory_file:
+                inventory = read_service_inventory(inventory_file)
+                # Key the snapshot by the service names used by this script
+                inventory['services'] = dict((service.replace('//', '/'), entry)
+                                             for service, entry in inventory['services'].iteritems())
+                all_services = inventory['services'].keys()
+            else:
+                all_services = getServiceList(server, port, adminuser, password, use_ssl)
+                all_services = [service.replace('//', '/') for service in all_services]
             
             # Create collection of only hosted services
             print '\n{}'.format('=' * 80)
@@ -145,11 +165,20 @@ def main():
             print 'for hosted feature services that meet filter criteria.'
             print '{}\n'.format('=' * 80)
             
+            # Get the portal properties of all feature services concurrently
+            feature_services = [service for service in all_services if service.endswith('.FeatureServer')]
+            inventory = get_service_inventory(server, port, adminuser, password, use_ssl,
+                                              parts=(INFO,), services=feature_services,
+                                              inventory=inventory)
+            
             definitions = {}
             for service in all_services:
                 folder, serviceNameType = parseService(service)
                 if serviceNameType.endswith('.FeatureServer'):
-                    portal_props = getServicePortalProps(server, port, adminuser, password, folder, serviceNameType)
+                    portal_props = inventory['services'][service]['portalProperties']
+                    errors = inventory['services'][service]['errors']
+                    if errors:
+                        print '\tCould not get service info for {}: {}'.format(service, errors[INFO])
                     if portal_props:
                         if portal_props['isHosted']:
                             portal_items = portal_props['portalItems']